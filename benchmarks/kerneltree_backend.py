@@ -0,0 +1,136 @@
+#!/usr/bin/env python2
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""
+Benchmark the pygit2 KernelTree backend against the git CLI backend on a
+synthetic repository. Requires pygit2.
+
+Run from the top of the source tree:
+
+    python benchmarks/kerneltree_backend.py
+"""
+from __future__ import print_function
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from skt.kerneltree import KernelTree  # noqa: E402
+
+try:
+    from skt.pygit2tree import Pygit2KernelTree  # noqa: E402
+except ImportError:
+    Pygit2KernelTree = None
+
+
+def make_repository(path, commits):
+    """
+    Create a synthetic repository with linear history, using a single
+    "git fast-import" run.
+
+    Args:
+        path:       Path to the repository to create.
+        commits:    Number of commits to create.
+    """
+    subprocess.check_call(['git', 'init', '-q', path])
+    stream = []
+    for idx in range(commits):
+        content = "content %d\n" % idx
+        message = "commit %d\n" % idx
+        stream.append("commit refs/heads/master\n"
+                      "committer A <a@a> %d +0000\n"
+                      "data %d\n%s"
+                      "M 644 inline file%d\n"
+                      "data %d\n%s\n" %
+                      (1500000000 + idx, len(message), message, idx % 100,
+                       len(content), content))
+    proc = subprocess.Popen(['git', '-C', path, 'fast-import', '--quiet'],
+                            stdin=subprocess.PIPE)
+    proc.communicate("".join(stream))
+    subprocess.check_call(['git', '-C', path, 'checkout', '-q', 'master'])
+
+
+def workload(ktree, refs):
+    """
+    Run the repository queries a merge typically makes.
+
+    Args:
+        ktree:  The KernelTree to query.
+        refs:   List of references to look up.
+    """
+    for ref in refs:
+        ktree.get_commit_hash(ref)
+        ktree.get_commit_date(ref)
+    ktree.remotes = None
+    for idx in range(10):
+        ktree.add_merge_remote("git://example.com/repo%d.git" % idx)
+        ktree.set_remote("origin", "git://example.com/base.git")
+
+
+def report(name, cli, pygit2, number):
+    """Time and print results of both backends."""
+    cli_time = min(timeit.repeat(cli, number=number, repeat=3)) / number
+    pygit2_time = min(timeit.repeat(pygit2, number=number,
+                                    repeat=3)) / number
+    print("%-32s cli %10.3f ms  pygit2 %10.3f ms  speedup %8.1fx" %
+          (name, cli_time * 1000, pygit2_time * 1000,
+           cli_time / pygit2_time))
+
+
+def main():
+    """Run the benchmarks."""
+    if Pygit2KernelTree is None:
+        print("pygit2 is not installed, install skt with the pygit2 extras")
+        sys.exit(1)
+
+    logging.disable(logging.CRITICAL)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        repo = os.path.join(tmpdir, "repo")
+        make_repository(repo, 1000)
+        refs = ["HEAD~%d" % idx for idx in range(0, 1000, 10)]
+
+        def create(cls, copy=False):
+            """
+            Create a KernelTree in a new working directory, empty or with a
+            copy of the repository.
+            """
+            wdir = tempfile.mkdtemp(dir=tmpdir)
+            if copy:
+                shutil.rmtree(wdir)
+                shutil.copytree(repo, wdir)
+            return cls("git://example.com/base.git", wdir=wdir)
+
+        report("initialize", lambda: create(KernelTree),
+               lambda: create(Pygit2KernelTree), 5)
+
+        cli_tree = create(KernelTree, copy=True)
+        pygit2_tree = create(Pygit2KernelTree, copy=True)
+        report("%d lookups, 20 remote updates" % (len(refs) * 2),
+               lambda: workload(cli_tree, refs),
+               lambda: workload(pygit2_tree, refs), 5)
+        cli_tree.cleanup()
+        pygit2_tree.cleanup()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
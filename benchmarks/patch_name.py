@@ -0,0 +1,102 @@
+#!/usr/bin/env python2
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""
+Benchmark header-only patch subject extraction against parsing whole mboxes.
+
+Run from the top of the source tree:
+
+    python benchmarks/patch_name.py
+"""
+from __future__ import print_function
+import email.parser
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import skt  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def make_patch(idx, diff_lines):
+    """
+    Generate a synthetic patch mbox message.
+
+    Args:
+        idx:        Number of the patch in the series.
+        diff_lines: Number of lines in the diff.
+
+    Returns:
+        String representing the message.
+    """
+    diff = ''.join('+\tcall_something(%d, "some generated content");\n' % n
+                   for n in range(diff_lines))
+    return ('From 0123456789abcdef Mon Sep 17 00:00:00 2001\n'
+            'From: Some Developer <developer@example.com>\n'
+            'Date: Thu, 3 May 2018 17:49:51 +0200\n'
+            'Subject: [PATCH %d/N] subsystem: do something with a\n'
+            ' subject folded over two lines\n'
+            'X-Patchwork-Id: %d\n'
+            '\n'
+            'Commit message.\n'
+            '\n'
+            '---\n'
+            'diff --git a/file.c b/file.c\n'
+            '--- a/file.c\n'
+            '+++ b/file.c\n'
+            '@@ -1,0 +1,%d @@\n'
+            '%s\n') % (idx, idx, diff_lines, diff)
+
+
+def old_get_patch_name(content):
+    """The original implementation, parsing the whole mbox."""
+    headers = email.parser.Parser().parsestr(content, True)
+    return skt.decode_patch_subject(headers['Subject'])
+
+
+def old_get_patch_names(messages):
+    """Subjects of a series with the original implementation."""
+    return [old_get_patch_name(message) for message in messages]
+
+
+def report(name, old, new, number):
+    """Time and print results of old and new implementations."""
+    old_time = min(timeit.repeat(old, number=number, repeat=3)) / number
+    new_time = min(timeit.repeat(new, number=number, repeat=3)) / number
+    print("%-32s old %10.3f ms  new %10.3f ms  speedup %8.1fx" %
+          (name, old_time * 1000, new_time * 1000, old_time / new_time))
+
+
+def main():
+    """Run the benchmarks."""
+    for diff_lines in [100, 10000, 200000]:
+        patch = make_patch(1, diff_lines)
+        assert old_get_patch_name(patch) == skt.get_patch_name(patch)
+        report("single patch, %d KiB" % (len(patch) / 1024),
+               lambda: old_get_patch_name(patch),
+               lambda: skt.get_patch_name(patch),
+               10)
+
+    messages = [make_patch(idx, 2000) for idx in range(1, 41)]
+    series = '\n'.join(messages)
+    assert old_get_patch_names(messages) == skt.get_patch_names(series)
+    report("40 patch series, %d KiB" % (len(series) / 1024),
+           lambda: old_get_patch_names(messages),
+           lambda: skt.get_patch_names(series),
+           10)
+
+
+if __name__ == '__main__':
+    main()
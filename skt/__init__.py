@@ -12,12 +12,33 @@
 # along with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 """Functions used by multiple parts of skt."""
+import contextlib
 from email.errors import HeaderParseError
 import email.header
 import email.parser
+import fcntl
+from multiprocessing.pool import ThreadPool
 import os
+import re
+import shutil
+import tempfile
+
 import requests
 
+import skt.httpsession
+
+# A skt.mboxcache.MboxCache instance to serve mbox downloads from, or None
+MBOX_CACHE = None
+
+# Size of chunks to download and read mboxes in, bytes
+MBOX_CHUNK_SIZE = 64 * 1024
+
+# The empty line ending a message header block
+HEADER_END_RE = re.compile(r'\r?\n\r?\n')
+# An mbox message separator, i.e. an empty line followed by a "From " line,
+# matching just before the "From " line
+MESSAGE_START_RE = re.compile(r'\n\r?\n(?=From )')
+
 
 def get_patch_mbox(url):
     """
@@ -36,8 +57,11 @@ def get_patch_mbox(url):
     # with URLs ending both with and without slash.
     mbox_url = os.path.join(url, 'mbox')
 
+    if MBOX_CACHE is not None:
+        return MBOX_CACHE.get(mbox_url)
+
     try:
-        response = requests.get(mbox_url)
+        response = skt.httpsession.get(mbox_url)
     except requests.exceptions.RequestException as exc:
         raise(exc)
 
@@ -48,20 +72,210 @@ def get_patch_mbox(url):
     return response.content
 
 
-def get_patch_name(content):
+def stream_patch_mbox(url, fileh):
     """
-    Retrieve patch name from 'Subject' header from the mbox string
-    representing a patch.
+    Download mbox of the patch into a file in chunks, without holding the
+    whole mbox in memory.
 
     Args:
-        content: String representing patch mbox
+        url:    Patchwork URL of the patch to retrieve
+        fileh:  File object to write the mbox to
+
+    Raises:
+        Exception in case the URL is currently unavailable or invalid
+    """
+    mbox_url = os.path.join(url, 'mbox')
+
+    if MBOX_CACHE is not None:
+        with MBOX_CACHE.fetch(mbox_url) as cached:
+            shutil.copyfileobj(cached, fileh, MBOX_CHUNK_SIZE)
+        return
+
+    response = skt.httpsession.get(mbox_url, stream=True)
+    try:
+        if response.status_code != requests.codes.ok:
+            raise Exception('Failed to retrieve patch from %s, returned %d' %
+                            (url, response.status_code))
+
+        for chunk in response.iter_content(MBOX_CHUNK_SIZE):
+            fileh.write(chunk)
+    finally:
+        response.close()
+
+
+def download_patch_mbox(url):
+    """
+    Download mbox of the patch into an anonymous temporary file.
+
+    Args:
+        url: Patchwork URL of the patch to retrieve
+
+    Returns:
+        The temporary file object containing the mbox, positioned at the
+        start. The file is removed once closed.
+
+    Raises:
+        Exception in case the URL is currently unavailable or invalid
+    """
+    fileh = tempfile.TemporaryFile()
+    try:
+        stream_patch_mbox(url, fileh)
+    except Exception:
+        fileh.close()
+        raise
+    fileh.seek(0)
+
+    return fileh
+
+
+def read_patch_name(fileh):
+    """
+    Retrieve patch name from 'Subject' header from an mbox file, reading
+    only the first chunks of the file containing the headers.
+
+    Args:
+        fileh: File object containing the mbox, positioned at the start.
+               The position is reset to the start before returning.
+
+    Returns:
+        Name of the patch, see get_patch_name().
+    """
+    head = ''
+    while True:
+        chunk = fileh.read(MBOX_CHUNK_SIZE)
+        head += chunk
+        if not chunk or HEADER_END_RE.search(head):
+            break
+    fileh.seek(0)
+
+    return get_patch_name(head)
+
+
+class PatchPrefetcher(object):
+    """
+    Download patch mboxes in the background with a bounded pool of threads.
+    """
+
+    def __init__(self, urls, workers=4):
+        """
+        Initialize a patch prefetcher and start downloading all the patches.
+
+        Args:
+            urls:       A list of Patchwork URLs of the patches to download.
+            workers:    Maximum number of concurrent downloads.
+        """
+        self.pool = ThreadPool(max(1, min(workers, len(urls))))
+        # Patch URL -> AsyncResult of the mbox download
+        self.results = {}
+        for url in urls:
+            if url not in self.results:
+                self.results[url] = self.pool.apply_async(download_patch_mbox,
+                                                          (url,))
+        self.pool.close()
+
+    def get(self, url):
+        """
+        Get the mbox of a patch, waiting for its download to finish.
+
+        Args:
+            url:    Patchwork URL of the patch.
+
+        Returns:
+            Temporary file object containing the mbox, positioned at the
+            start, see download_patch_mbox().
+
+        Raises:
+            The exception raised by download_patch_mbox(), if the download
+            failed.
+        """
+        # Use a timeout, as otherwise waiting can't be interrupted on Python 2
+        fileh = self.results[url].get(60 * 60 * 24)
+        fileh.seek(0)
+        return fileh
+
+    def terminate(self):
+        """Stop all pending downloads."""
+        self.pool.terminate()
+
+
+def iter_mbox_headers(content):
+    """
+    Parse headers of every message in an mbox string, in a single pass over
+    the string. Only the header block of each message is parsed, message
+    bodies are skipped.
+
+    Args:
+        content: String representing the mbox
+
+    Returns:
+        An iterator over email.message.Message objects containing only the
+        headers of each message, in order.
+    """
+    pos = 0
+    while True:
+        # Headers end with the first empty line
+        match = HEADER_END_RE.search(content, pos)
+        end = match.start() if match else len(content)
+        yield email.parser.HeaderParser().parsestr(content[pos:end])
+        if not match:
+            break
+
+        # Skip the body up to the next message separator
+        match = MESSAGE_START_RE.search(content, match.start())
+        if not match:
+            break
+        pos = match.end()
+
+
+def read_mbox_headers(fileh):
+    """
+    Parse headers of every message in an mbox file, reading it line by line,
+    so only the header block of one message is held in memory at a time.
+    Message bodies are skipped.
+
+    Args:
+        fileh: File object containing the mbox, positioned at the start.
+               It's read to the end.
+
+    Returns:
+        An iterator over email.message.Message objects containing only the
+        headers of each message, in order, see iter_mbox_headers().
+    """
+    lines = []
+    in_headers = True
+    # Whether the previous line was empty, so a "From " line starts a message
+    empty = False
+    for line in fileh:
+        if in_headers:
+            if line in ('\n', '\r\n'):
+                yield email.parser.HeaderParser().parsestr(''.join(lines))
+                lines = []
+                in_headers = False
+                empty = True
+            else:
+                lines.append(line)
+            continue
+
+        if empty and line.startswith('From '):
+            lines.append(line)
+            in_headers = True
+        empty = line in ('\n', '\r\n')
+
+    if in_headers:
+        yield email.parser.HeaderParser().parsestr(''.join(lines))
+
+
+def decode_patch_subject(subject):
+    """
+    Decode the value of a 'Subject' header of a patch.
+
+    Args:
+        subject: The raw header value, or None if the header is missing
 
     Returns:
         Name of the patch. <SUBJECT MISSING> is returned if no subject is
-        found, and <SUBJECT ENCODING INVALID> if header decoding fails.
+        given, and <SUBJECT ENCODING INVALID> if header decoding fails.
     """
-    headers = email.parser.Parser().parsestr(content, True)
-    subject = headers['Subject']
     if not subject:
         # Emails return None if the header is not found so use a stub subject
         # instead of it
@@ -84,6 +298,58 @@ def get_patch_name(content):
     return ''.join(decoded)
 
 
+def get_patch_name(content):
+    """
+    Retrieve patch name from 'Subject' header from the mbox string
+    representing a patch. Only the headers are parsed, so the cost doesn't
+    depend on the size of the patch.
+
+    Args:
+        content: String representing patch mbox
+
+    Returns:
+        Name of the patch. <SUBJECT MISSING> is returned if no subject is
+        found, and <SUBJECT ENCODING INVALID> if header decoding fails.
+    """
+    headers = next(iter_mbox_headers(content))
+    return decode_patch_subject(headers['Subject'])
+
+
+def get_patch_names(content):
+    """
+    Retrieve patch names from 'Subject' headers of all messages in an mbox
+    string, such as a Patchwork series mbox, in a single pass.
+
+    Args:
+        content: String representing the mbox
+
+    Returns:
+        A list of patch names, in the order of messages, see
+        get_patch_name().
+    """
+    return [decode_patch_subject(headers['Subject'])
+            for headers in iter_mbox_headers(content)]
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """
+    Hold an exclusive lock on a file, shared with other processes, creating
+    the file if it doesn't exist.
+
+    Args:
+        path:   Path to the lock file.
+        shared: True to hold a shared lock instead, excluding only holders
+                of the exclusive lock.
+    """
+    with open(path, 'a') as fileh:
+        fcntl.flock(fileh, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fileh, fcntl.LOCK_UN)
+
+
 class CommandTimeoutError(Exception):
     """
     Exception raised when a timeout occurs on a process which has had timeouts
@@ -0,0 +1,132 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""
+Classification of kernel changes by the paths they touch, telling which
+builds they can affect.
+
+The classification is one of the following scopes:
+
+    none:   Only paths not used by kernel builds are changed, e.g.
+            documentation and userspace tools.
+    arch:   All built paths changed belong to a single architecture.
+    module: All built paths changed are in a single driver, filesystem,
+            network or sound directory.
+    full:   Anything else.
+"""
+import os
+import re
+
+# Scopes of changes, from the narrowest
+SCOPE_NONE = "none"
+SCOPE_ARCH = "arch"
+SCOPE_MODULE = "module"
+SCOPE_FULL = "full"
+
+# Patterns of paths not used by kernel builds
+UNBUILT_PATTERNS = [
+    r'^Documentation/',
+    # Except for the tools built and included by the kernel build itself
+    r'^tools/(?!objtool/|bpf/resolve_btfids/|include/|lib/|scripts/)',
+    r'^LICENSES/',
+    r'^(CREDITS|MAINTAINERS|README|COPYING)$',
+    r'(^|/)\.(gitignore|mailmap|clang-format|cocciconfig)$',
+]
+
+# Top directories of subsystems whose directories are built as modules
+MODULE_DIRS = ["drivers", "fs", "net", "sound"]
+
+# Kernel architecture directories indexed by machine names, for those
+# differing
+KERNEL_ARCHES = {
+    'x86_64': 'x86',
+    'i386': 'x86',
+    'i686': 'x86',
+    'aarch64': 'arm64',
+    'ppc64': 'powerpc',
+    'ppc64le': 'powerpc',
+    's390x': 's390',
+}
+
+
+def get_kernel_arch(machine):
+    """
+    Get the name of the kernel architecture directory for a machine name.
+
+    Args:
+        machine:    A machine name, as returned by "uname -m", or a kernel
+                    architecture name, as passed in the ARCH variable.
+
+    Returns:
+        The name of the directory under "arch/".
+    """
+    if machine in KERNEL_ARCHES:
+        return KERNEL_ARCHES[machine]
+    if re.match(r'^armv\d', machine):
+        return 'arm'
+    return machine
+
+
+def is_built(path):
+    """
+    Check if a path can be used by kernel builds.
+
+    Args:
+        path:   The path relative to the top of the kernel tree.
+
+    Returns:
+        False if the path is never used by kernel builds, True otherwise.
+    """
+    return not any(re.search(pattern, path) for pattern in UNBUILT_PATTERNS)
+
+
+def classify(paths):
+    """
+    Classify changes by the paths they touch.
+
+    Args:
+        paths:  A list of changed paths, relative to the top of the kernel
+                tree.
+
+    Returns:
+        A tuple of the scope of the changes, and the name of the affected
+        architecture for the "arch" scope, or the affected directory for the
+        "module" scope, or None.
+    """
+    if not paths:
+        # Nothing is known about the changes
+        return (SCOPE_FULL, None)
+
+    built = [path for path in paths if is_built(path)]
+    if not built:
+        return (SCOPE_NONE, None)
+
+    arches = set(re.match(r'^arch/([^/]+)/', path).group(1)
+                 if path.startswith('arch/') and path.count('/') > 1
+                 else None
+                 for path in built)
+    if len(arches) == 1 and None not in arches:
+        return (SCOPE_ARCH, arches.pop())
+
+    dirs = set(os.path.dirname(path) for path in built)
+    if len(dirs) == 1:
+        directory = dirs.pop()
+        # Kconfig and Makefile changes can affect other directories
+        if directory.split('/')[0] in MODULE_DIRS and \
+                directory.count('/') > 0 and \
+                not any(os.path.basename(path).startswith(('Kconfig',
+                                                           'Makefile'))
+                        for path in built):
+            return (SCOPE_MODULE, directory)
+
+    return (SCOPE_FULL, None)
@@ -22,6 +22,7 @@ import json
 import logging
 import os
 import shutil
+import subprocess
 import sys
 import tempfile
 import time
@@ -30,11 +31,18 @@ import traceback
 import junit_xml
 
 import skt
+import skt.changes
+import skt.httpsession
+import skt.maintenance
+import skt.manifest
+import skt.mboxcache
+import skt.mirror
 import skt.publisher
 import skt.reporter
 import skt.runner
+import skt.workdirpool
 from skt.kernelbuilder import KernelBuilder
-from skt.kerneltree import KernelTree
+from skt.kerneltree import KernelTree, get_kerneltree
 
 DEFAULTRC = "~/.sktrc"
 LOGGER = logging.getLogger()
@@ -123,6 +131,122 @@ def junit(func):
     return wrapper
 
 
+def save_gitstats(cfg, ktree):
+    """
+    Log the per-subcommand summary of git commands executed for a kernel
+    tree, and the counts of decisions about them, e.g. skipped fetches, and
+    save both to the state as JSON objects.
+
+    Args:
+        cfg:    A dictionary of skt configuration.
+        ktree:  The KernelTree the commands were executed for.
+    """
+    ktree.gitstats.log_summary()
+    save_state(cfg, {'gitstats': json.dumps(ktree.gitstats.get_summary(),
+                                            sort_keys=True),
+                     'gitcounters': json.dumps(ktree.gitstats.get_counters(),
+                                               sort_keys=True)})
+
+
+def get_merge_patches(cfg, prefetcher):
+    """
+    Get all patches to apply, in order.
+
+    Args:
+        cfg:        A dictionary of skt configuration.
+        prefetcher: The skt.PatchPrefetcher downloading the Patchwork
+                    patches and series, or None if there are none.
+
+    Returns:
+        A list of tuples, each containing the name of a patch and either a
+        path to a local patch file, or a file object with a Patchwork mbox.
+    """
+    patches = [(patch, os.path.abspath(patch))
+               for patch in cfg.get('patchlist') or []]
+    patches += [(patch, prefetcher.get(patch))
+                for patch in (cfg.get('pw') or []) +
+                (cfg.get('pw_series') or [])]
+
+    return patches
+
+
+def merge_updates(cfg, ktree, prefetcher, bhead, utypes, mergestate):
+    """
+    Merge references and apply patches on top of the checked-out base tree.
+
+    Args:
+        cfg:        A dictionary of skt configuration.
+        ktree:      The KernelTree with the base tree checked out.
+        prefetcher: The skt.PatchPrefetcher downloading the Patchwork
+                    patches and series, or None if there are none.
+        bhead:      The hash of the base commit.
+        utypes:     The list to append the types of applied updates to.
+        mergestate: The dictionary to put the saved state into.
+
+    Returns:
+        True if everything was merged, False if merging a reference failed.
+    """
+    global retcode
+
+    def save_merge_state(state):
+        mergestate.update(state)
+        save_state(cfg, state)
+
+    workers = int(cfg.get('fetch_workers') or 4)
+    ktree.fetch_git_refs(cfg.get('merge_ref'), workers)
+
+    if cfg.get('precheck'):
+        try:
+            failed = ktree.precheck(cfg.get('merge_ref'),
+                                    get_merge_patches(cfg, prefetcher),
+                                    workers)
+        except subprocess.CalledProcessError as exc:
+            logging.warning("pre-check couldn't run, merging without it: %s",
+                            exc.output)
+            failed = None
+        if failed is not None:
+            raise Exception("Pre-check failed: %s doesn't apply" % failed)
+
+    idx = 0
+    for mb in cfg.get('merge_ref'):
+        save_merge_state({'mergerepo_%02d' % idx: mb[0],
+                          'mergehead_%02d' % idx: bhead})
+        (retcode, _) = ktree.merge_git_ref(*mb)
+
+        utypes.append("[git]")
+        idx += 1
+        if retcode:
+            return False
+
+    if cfg.get('patchlist'):
+        utypes.append("[local patch]")
+        idx = 0
+        for patch in cfg.get('patchlist'):
+            save_merge_state({'localpatch_%02d' % idx: patch})
+            ktree.merge_patch_file(os.path.abspath(patch))
+            idx += 1
+
+    if cfg.get('pw') or cfg.get('pw_series'):
+        utypes.append("[patchwork]")
+        idx = 0
+        for patch in cfg.get('pw') or []:
+            save_merge_state({'patchwork_%02d' % idx: patch})
+            ktree.merge_patchwork_patch(patch, prefetcher.get(patch))
+            idx += 1
+
+        sidx = 0
+        for series in cfg.get('pw_series') or []:
+            save_merge_state({'pwseries_%02d' % sidx: series})
+            for patch in ktree.merge_patchwork_series(
+                    series, prefetcher.get(series)
+            ):
+                save_merge_state({'patchwork_%02d' % idx: patch})
+                idx += 1
+            sidx += 1
+
+    return True
+
+
 @junit
 def cmd_merge(cfg):
     """
@@ -132,50 +256,122 @@ def cmd_merge(cfg):
     Args:
         cfg:    A dictionary of skt configuration.
     """
-    global retcode
     utypes = []
-    ktree = KernelTree(
+    prefetcher = None
+    pool = None
+    # Start downloading the patches right away, so the downloads overlap
+    # with leasing a working directory, and fetching and checking out the
+    # base tree
+    if cfg.get('pw') or cfg.get('pw_series'):
+        prefetcher = skt.PatchPrefetcher(
+            (cfg.get('pw') or []) + (cfg.get('pw_series') or []),
+            int(cfg.get('pw_workers') or 4)
+        )
+    if not cfg.get('workdir'):
+        pool = get_workdir_pool(cfg)
+        ref = cfg.get('ref') or "master"
+        repo = None
+        try:
+            if cfg.get('mirror_dir'):
+                # Fetch the base head into the mirror first, so working
+                # directories which don't have it yet can be compared with
+                # it. The checkout below then finds it there.
+                mirror = skt.mirror.GitMirror(cfg.get('mirror_dir'),
+                                              cfg.get('baserepo'))
+                mirror.update(ref, depth=cfg.get('fetch_depth'),
+                              fetch_filter=cfg.get('fetch_filter'))
+                repo = mirror.path
+            cfg['workdir'] = pool.lease(
+                KernelTree.get_remote_head(cfg.get('baserepo'), ref), repo
+            )
+        except Exception:
+            if prefetcher is not None:
+                prefetcher.terminate()
+            raise
+        # Make sure cleanup releases the working directory
+        save_state(cfg, {'workdir': cfg.get('workdir')})
+
+    ktree = get_kerneltree(
+        cfg.get('git_backend'),
         cfg.get('baserepo'),
         ref=cfg.get('ref'),
         wdir=cfg.get('workdir'),
-        fetch_depth=cfg.get('fetch_depth')
+        fetch_depth=cfg.get('fetch_depth'),
+        mirror_dir=cfg.get('mirror_dir'),
+        worktree_repo=cfg.get('worktree_repo'),
+        fetch_filter=cfg.get('fetch_filter'),
+        seed_bundle=cfg.get('seed_bundle'),
+        patch_index=cfg.get('skip_merged'),
+        check_fresh=cfg.get('check_fresh')
     )
-    bhead = ktree.checkout()
+    try:
+        bhead = ktree.checkout()
+    except Exception:
+        if prefetcher is not None:
+            prefetcher.terminate()
+        save_gitstats(cfg, ktree)
+        raise
+    if pool is not None:
+        pool.record_base(cfg.get('workdir'), bhead)
     commitdate = ktree.get_commit_date(bhead)
     save_state(cfg, {'baserepo': cfg.get('baserepo'),
                      'basehead': bhead,
-                     'commitdate': commitdate})
+                     'commitdate': commitdate,
+                     'changedfiles': ktree.changed_files})
 
     try:
-        idx = 0
-        for mb in cfg.get('merge_ref'):
-            save_state(cfg, {'mergerepo_%02d' % idx: mb[0],
-                             'mergehead_%02d' % idx: bhead})
-            (retcode, _) = ktree.merge_git_ref(*mb)
-
-            utypes.append("[git]")
-            idx += 1
-            if retcode:
+        workers = int(cfg.get('fetch_workers') or 4)
+        cache_key = None
+        cached = None
+        merged = None
+        # Runs merging references test the merges, even if the patches are
+        # merged already
+        if cfg.get('skip_merged') and not cfg.get('merge_ref'):
+            merged = ktree.find_merged_patches(
+                get_merge_patches(cfg, prefetcher)
+            )
+
+        if merged:
+            logging.info("all patches are merged already, as %s",
+                         " ".join(merged))
+            # Skip merging, as with a cached merge
+            cached = {'state': {'redundant': " ".join(merged)},
+                      'utypes': []}
+        elif cfg.get('merge_cache'):
+            cache_key = ktree.get_merge_cache_key(
+                cfg.get('merge_ref'), get_merge_patches(cfg, prefetcher),
+                workers
+            )
+            if cache_key is not None:
+                cached = ktree.load_merge_cache(cache_key)
+
+        if cached is not None:
+            save_state(cfg, cached['state'])
+            utypes = cached['utypes']
+        else:
+            mergestate = {}
+            if not merge_updates(cfg, ktree, prefetcher, bhead, utypes,
+                                 mergestate):
                 return
-
-        if cfg.get('patchlist'):
-            utypes.append("[local patch]")
-            idx = 0
-            for patch in cfg.get('patchlist'):
-                save_state(cfg, {'localpatch_%02d' % idx: patch})
-                ktree.merge_patch_file(os.path.abspath(patch))
-                idx += 1
-
-        if cfg.get('pw'):
-            utypes.append("[patchwork]")
-            idx = 0
-            for patch in cfg.get('pw'):
-                save_state(cfg, {'patchwork_%02d' % idx: patch})
-                ktree.merge_patchwork_patch(patch)
-                idx += 1
+            if cache_key is not None:
+                ktree.save_merge_cache(cache_key, {'state': mergestate,
+                                                   'utypes': utypes})
     except Exception as e:
         save_state(cfg, {'mergelog': ktree.mergelog})
         raise e
+    finally:
+        if prefetcher is not None:
+            prefetcher.terminate()
+        save_gitstats(cfg, ktree)
+        # Keep track of used remotes, even if maintenance is only done by
+        # the maintenance command. Don't let bookkeeping failures hide the
+        # merge result.
+        try:
+            ktree.get_maintenance().record_run(ktree.used_remotes,
+                                               ktree.gitstats.get_summary())
+        except (IOError, OSError) as exc:
+            logging.warning("failed to record the run for maintenance: %s",
+                            exc)
 
     uid = "[baseline]"
     if utypes:
@@ -184,13 +380,49 @@ def cmd_merge(cfg):
     kpath = ktree.getpath()
     buildinfo = ktree.dumpinfo()
     buildhead = ktree.get_commit_hash()
+    if cfg.get('classify_changes') and buildhead != bhead:
+        (scope, target) = skt.changes.classify(
+            ktree.get_changed_paths(bhead)
+        )
+        logging.info("changes scope: %s %s", scope, target or "")
+        save_state(cfg, {'changescope': scope,
+                         'changetarget': target})
+    manifest = os.path.join(kpath, "manifest.json.gz")
+    skt.manifest.write(manifest, {'buildinfo': ktree.info})
 
     save_state(cfg, {'workdir': kpath,
                      'buildinfo': buildinfo,
                      'buildhead': buildhead,
+                     'manifest': manifest,
                      'uid': uid})
 
 
+def get_build_skip_reason(cfg, build_arch):
+    """
+    Get the reason to skip building and testing a kernel, based on the
+    classification of the merged changes saved in the state.
+
+    Args:
+        cfg:        A dictionary of skt configuration.
+        build_arch: The architecture the kernel is built for.
+
+    Returns:
+        A string describing why the changes can't affect the built kernel,
+        or None if the kernel should be built.
+    """
+    if cfg.get('redundant'):
+        return "all patches are merged in the base already"
+    scope = cfg.get('changescope')
+    if scope == skt.changes.SCOPE_NONE:
+        return "only files not used by kernel builds are changed"
+    if scope == skt.changes.SCOPE_ARCH and \
+            cfg.get('changetarget') != \
+            skt.changes.get_kernel_arch(build_arch):
+        return "only the %s architecture is changed, not %s" % \
+            (cfg.get('changetarget'), build_arch)
+    return None
+
+
 @junit
 def cmd_build(cfg):
     """
@@ -210,6 +442,12 @@ def cmd_build(cfg):
         enable_debuginfo=cfg.get('enable_debuginfo')
     )
 
+    reason = get_build_skip_reason(cfg, builder.build_arch)
+    if reason:
+        logging.info("skipping build: %s", reason)
+        save_state(cfg, {'buildskipped': reason})
+        return
+
     # Clean the kernel source with 'make mrproper' if requested.
     if cfg.get('wipe'):
         builder.clean_kernel_source()
@@ -240,9 +478,27 @@ def cmd_build(cfg):
 
     krelease = builder.getrelease()
 
+    tmanifest = None
+    if cfg.get('manifest'):
+        if cfg.get('buildhead'):
+            tmanifest = "%s.json.gz" % cfg.get('buildhead')
+        else:
+            tmanifest = addtstamp(cfg.get('manifest'), tstamp)
+        with open(tconfig, 'r') as fileh:
+            config = fileh.read()
+        skt.manifest.update(
+            cfg.get('manifest'),
+            config=config,
+            krelease=krelease,
+            checksums={os.path.basename(path): skt.manifest.checksum(path)
+                       for path in [ttgz, tconfig]}
+        )
+        os.rename(cfg.get('manifest'), tmanifest)
+
     save_state(cfg, {'tarpkg': ttgz,
                      'buildinfo': tbuildinfo,
                      'buildconf': tconfig,
+                     'manifest': tmanifest,
                      'krelease': krelease})
 
 
@@ -257,6 +513,10 @@ def cmd_publish(cfg):
     Args:
         cfg:    A dictionary of skt configuration.
     """
+    if cfg.get('buildskipped'):
+        logging.info("nothing to publish, build skipped")
+        return
+
     publisher = skt.publisher.getpublisher(*cfg.get('publisher'))
 
     if not cfg.get('tarpkg'):
@@ -264,6 +524,7 @@ def cmd_publish(cfg):
 
     infourl = None
     cfgurl = None
+    manifesturl = None
 
     url = publisher.publish(cfg.get('tarpkg'))
     logging.info("published url: %s", url)
@@ -274,9 +535,13 @@ def cmd_publish(cfg):
     if cfg.get('buildconf'):
         cfgurl = publisher.publish(cfg.get('buildconf'))
 
+    if cfg.get('manifest'):
+        manifesturl = publisher.publish(cfg.get('manifest'))
+
     save_state(cfg, {'buildurl': url,
                      'cfgurl': cfgurl,
-                     'infourl': infourl})
+                     'infourl': infourl,
+                     'manifesturl': manifesturl})
 
 
 @junit
@@ -289,6 +554,12 @@ def cmd_run(cfg):
         cfg:    A dictionary of skt configuration.
     """
     global retcode
+    if cfg.get('buildskipped'):
+        logging.info("not running tests, build skipped")
+        retcode = 0
+        save_state(cfg, {'retcode': retcode})
+        return
+
     runner = skt.runner.getrunner(*cfg.get('runner'))
     retcode = runner.run(cfg.get('buildurl'), cfg.get('krelease'),
                          cfg.get('wait'), uid=cfg.get('uid'))
@@ -369,9 +640,204 @@ def cmd_cleanup(cfg):
         except OSError:
             pass
 
+    if cfg.get('manifest'):
+        try:
+            os.unlink(cfg.get('manifest'))
+        except OSError:
+            pass
+
+    interval = int(cfg.get('maintenance_interval') or 0)
+    gdir = get_maintained_repo(cfg)
+    if interval and gdir and \
+            skt.maintenance.RepoMaintenance(gdir).is_due(interval):
+        maintain_repo(cfg, gdir)
+
     if cfg.get('wipe') and cfg.get('workdir'):
         shutil.rmtree(cfg.get('workdir'))
 
+    if cfg.get('workdir_pool') and cfg.get('workdir'):
+        get_workdir_pool(cfg).release(cfg.get('workdir'))
+
+    if cfg.get('worktree_repo'):
+        KernelTree.prune_worktrees(cfg.get('worktree_repo'))
+
+
+def get_mirror_refs(cfg):
+    """
+    Get the repositories and references to keep mirrored: the base
+    repository, the repositories to merge, and the ones listed in
+    "[mirror-*]" sections of the configuration file.
+
+    Args:
+        cfg:    A dictionary of skt configuration.
+
+    Returns:
+        A list of tuples, each containing a repository URL and a list of
+        references to mirror from it, in order of appearance.
+    """
+    mirror_refs = []
+    urlrefs = {}
+
+    descs = []
+    if cfg.get('baserepo'):
+        descs.append([cfg.get('baserepo'), cfg.get('ref') or "master"])
+    descs.extend(cfg.get('merge_ref') or [])
+    descs.extend(cfg.get('mirror_ref') or [])
+
+    for desc in descs:
+        url = desc[0]
+        refs = desc[1:] or ["master"]
+        if url not in urlrefs:
+            urlrefs[url] = []
+            mirror_refs.append((url, urlrefs[url]))
+        for ref in refs:
+            if ref not in urlrefs[url]:
+                urlrefs[url].append(ref)
+
+    return mirror_refs
+
+
+def cmd_mirror_sync(cfg):
+    """
+    Update shared mirrors of the base repository, the repositories to merge,
+    and the repositories listed in "[mirror-*]" sections of the configuration
+    file, so merges only need to fetch small deltas. Repeat every --interval
+    seconds, if specified.
+
+    Args:
+        cfg:    A dictionary of skt configuration.
+    """
+    global retcode
+
+    if not cfg.get('mirror_dir'):
+        raise Exception("skt mirror-sync is missing \"--mirror-dir <path>\" "
+                        "option")
+
+    mirror_refs = get_mirror_refs(cfg)
+    if not mirror_refs:
+        logging.warning("no repositories to mirror")
+        return
+
+    interval = int(cfg.get('interval') or 0)
+    while True:
+        for (url, refs) in mirror_refs:
+            mirror = skt.mirror.GitMirror(cfg.get('mirror_dir'), url)
+            try:
+                mirror.sync(refs)
+            except subprocess.CalledProcessError:
+                logging.error("failed to sync mirror of %s", url)
+                retcode = 1
+
+        if not interval:
+            break
+        logging.info("next mirror sync in %d seconds", interval)
+        time.sleep(interval)
+
+
+def get_maintained_repo(cfg):
+    """
+    Get the long-lived repository the runs use: the worktree repository, or
+    the repository of the work directory, unless it is wiped.
+
+    Args:
+        cfg:    A dictionary of skt configuration.
+
+    Returns:
+        The path to the repository, or None if there is none.
+    """
+    if cfg.get('worktree_repo'):
+        return cfg.get('worktree_repo')
+
+    if cfg.get('workdir') and not cfg.get('wipe'):
+        gdir = os.path.join(cfg.get('workdir'), ".git")
+        if os.path.isdir(gdir):
+            return gdir
+
+    return None
+
+
+def maintain_repo(cfg, gdir):
+    """
+    Maintain a long-lived repository, logging any failure.
+
+    Args:
+        cfg:    A dictionary of skt configuration.
+        gdir:   The path to the repository.
+
+    Returns:
+        True if the maintenance succeeded, False otherwise.
+    """
+    max_age = skt.maintenance.DEFAULT_MAX_AGE
+    if cfg.get('max_remote_age'):
+        max_age = int(cfg.get('max_remote_age')) * 24 * 60 * 60
+
+    maintenance = skt.maintenance.RepoMaintenance(gdir, max_age=max_age)
+    try:
+        if gdir == cfg.get('worktree_repo'):
+            # Keep jobs sharing the repository from changing it meanwhile
+            with skt.file_lock("%s.lock" % gdir):
+                maintenance.run()
+        else:
+            maintenance.run()
+    except subprocess.CalledProcessError:
+        logging.error("failed to maintain repository %s", gdir)
+        return False
+    finally:
+        maintenance.stats.log_summary()
+
+    return True
+
+
+def cmd_maintenance(cfg):
+    """
+    Maintain the long-lived repositories: the worktree repository, the
+    repository of the work directory, and the repositories of the free work
+    directories in the pool.
+
+    Args:
+        cfg:    A dictionary of skt configuration.
+    """
+    global retcode
+
+    gdirs = []
+    gdir = get_maintained_repo(cfg)
+    if gdir:
+        gdirs.append(gdir)
+
+    pool = get_workdir_pool(cfg)
+    leased = pool.lease_free() if pool else []
+    try:
+        gdirs.extend(os.path.join(path, ".git") for path in leased)
+        if not gdirs:
+            logging.warning("no repositories to maintain")
+
+        for gdir in gdirs:
+            if not maintain_repo(cfg, gdir):
+                retcode = 1
+    finally:
+        for path in leased:
+            pool.release(path)
+
+
+def get_workdir_pool(cfg):
+    """
+    Get the pool of working directories to lease the work directory from.
+
+    Args:
+        cfg:    A dictionary of skt configuration.
+
+    Returns:
+        The skt.workdirpool.WorkdirPool instance, or None if no pool is
+        configured.
+    """
+    if not cfg.get('workdir_pool'):
+        return None
+
+    return skt.workdirpool.WorkdirPool(
+        cfg.get('workdir_pool'),
+        size=int(cfg.get('workdir_pool_size') or 4)
+    )
+
 
 def cmd_all(cfg):
     """
@@ -432,6 +898,36 @@ def setup_parser():
         type=str,
         help="Path to work dir"
     )
+    parser.add_argument(
+        "--workdir-pool",
+        type=str,
+        help=(
+            "Path to a pool of reusable work dirs to lease the work dir from, "
+            "if not specified with --workdir"
+        )
+    )
+    parser.add_argument(
+        "--workdir-pool-size",
+        type=int,
+        help="Number of work dirs in the pool (default: 4)"
+    )
+    parser.add_argument(
+        "--maintenance-interval",
+        type=int,
+        help=(
+            "Maintain the long-lived repository of the work dir, or the "
+            "worktree repository, in cleanup after every specified number "
+            "of merges"
+        )
+    )
+    parser.add_argument(
+        "--max-remote-age",
+        type=int,
+        help=(
+            "Number of days a remote can go unused before maintenance "
+            "removes it (default: 14)"
+        )
+    )
     parser.add_argument(
         "-w",
         "--wipe",
@@ -471,6 +967,17 @@ def setup_parser():
         default=False
     )
 
+    parser.add_argument(
+        "--mbox-cache",
+        type=str,
+        help="Directory to cache downloaded Patchwork mboxes in"
+    )
+    parser.add_argument(
+        "--mbox-cache-size",
+        type=int,
+        help="Maximum size of the mbox cache in MiB (default: 256)"
+    )
+
     subparsers = parser.add_subparsers()
 
     # These arguments apply to the 'merge' skt subcommand
@@ -498,6 +1005,18 @@ def setup_parser():
         nargs="+",
         help="URLs to each Patchwork patch to apply (space delimited)"
     )
+    parser_merge.add_argument(
+        "--pw-series",
+        type=str,
+        nargs="+",
+        help=("URLs to each Patchwork series to apply, after --pw patches "
+              "(space delimited)")
+    )
+    parser_merge.add_argument(
+        "--pw-workers",
+        type=int,
+        help="Number of Patchwork patches to download in parallel (default: 4)"
+    )
     parser_merge.add_argument(
         "-m",
         "--merge-ref",
@@ -505,6 +1024,48 @@ def setup_parser():
         help="Merge ref format: 'url [ref]'",
         action="append"
     )
+    parser_merge.add_argument(
+        "--precheck",
+        action="store_true",
+        default=False,
+        help=(
+            "Check that all merge references and patches apply before "
+            "merging any, failing on the first one which doesn't"
+        )
+    )
+    parser_merge.add_argument(
+        "--classify-changes",
+        action="store_true",
+        default=False,
+        help=(
+            "Classify the merged changes by the paths they touch, and skip "
+            "building and testing if they can't affect the built kernel"
+        )
+    )
+    parser_merge.add_argument(
+        "--skip-merged",
+        action="store_true",
+        default=False,
+        help=(
+            "Keep an index of patch IDs of the base reference's recent "
+            "history, and skip merging, building and testing if all the "
+            "patches are merged in the base already"
+        )
+    )
+    parser_merge.add_argument(
+        "--merge-cache",
+        action="store_true",
+        default=False,
+        help=(
+            "Reuse the result of a previous merge of the same base commit, "
+            "merge reference heads and patches, kept in the repository"
+        )
+    )
+    parser_merge.add_argument(
+        "--fetch-workers",
+        type=int,
+        help="Number of merge references to fetch in parallel (default: 4)"
+    )
     parser_merge.add_argument(
         "--fetch-depth",
         type=str,
@@ -514,6 +1075,58 @@ def setup_parser():
         ),
         default=None
     )
+    parser_merge.add_argument(
+        "--fetch-filter",
+        type=str,
+        help=(
+            "Create a partial clone, fetching objects matching the specified "
+            "git object filter only, e.g. 'blob:none' or 'tree:0'. Missing "
+            "objects are fetched when needed."
+        )
+    )
+    parser_merge.add_argument(
+        "--check-fresh",
+        help=(
+            "Resolve the fetched references with a single git ls-remote per "
+            "remote first, and only fetch those whose heads are missing "
+            "locally"
+        ),
+        action="store_true",
+        default=False
+    )
+    parser_merge.add_argument(
+        "--seed-bundle",
+        type=str,
+        help=(
+            "Path to a git bundle to seed the repository from before the "
+            "first fetch, so only newer objects are fetched from remotes"
+        )
+    )
+    parser_merge.add_argument(
+        "--mirror-dir",
+        type=str,
+        help=(
+            "Directory with shared local mirrors of the fetched repositories "
+            "to borrow objects from"
+        )
+    )
+
+    parser_merge.add_argument(
+        "--git-backend",
+        choices=["cli", "pygit2"],
+        help=(
+            "Backend for repository queries: 'cli' to execute git (default), "
+            "or 'pygit2' to use libgit2 in-process, if installed"
+        )
+    )
+    parser_merge.add_argument(
+        "--worktree-repo",
+        type=str,
+        help=(
+            "Path to a long-lived repository to provision the work dir from "
+            "as a git worktree, instead of creating a separate repository"
+        )
+    )
 
     # These arguments apply to the 'build' skt command
     parser_build = subparsers.add_parser("build", add_help=False)
@@ -559,6 +1172,11 @@ def setup_parser():
         type=str,
         help="Path to accompanying buildinfo"
     )
+    parser_publish.add_argument(
+        "--manifest",
+        type=str,
+        help="Path to accompanying build manifest"
+    )
 
     # These arguments apply to the 'run' skt command
     parser_run = subparsers.add_parser("run", add_help=False)
@@ -598,6 +1216,34 @@ def setup_parser():
 
     parser_cleanup = subparsers.add_parser("cleanup", add_help=False)
 
+    # These arguments apply to the 'mirror-sync' skt subcommand
+    parser_mirror_sync = subparsers.add_parser("mirror-sync")
+    parser_mirror_sync.add_argument(
+        "--mirror-dir",
+        type=str,
+        help="Directory with shared local mirrors to update"
+    )
+    parser_mirror_sync.add_argument(
+        "--interval",
+        type=int,
+        help=(
+            "Keep updating the mirrors every specified number of seconds, "
+            "instead of updating once"
+        )
+    )
+    parser_mirror_sync.set_defaults(func=cmd_mirror_sync)
+    parser_mirror_sync.set_defaults(_name="mirror-sync")
+
+    # These arguments apply to the 'maintenance' skt subcommand
+    parser_maintenance = subparsers.add_parser("maintenance")
+    parser_maintenance.add_argument(
+        "--worktree-repo",
+        type=str,
+        help="Path to the long-lived worktree repository to maintain"
+    )
+    parser_maintenance.set_defaults(func=cmd_maintenance)
+    parser_maintenance.set_defaults(_name="maintenance")
+
     parser_all = subparsers.add_parser(
         "all",
         parents=[
@@ -743,11 +1389,20 @@ def load_config(args):
             if config.has_option(section, 'ref'):
                 mdesc.append(config.get(section, 'ref'))
             cfg['merge_ref'].append(mdesc)
+        elif section.startswith("mirror-"):
+            mdesc = [config.get(section, 'url')]
+            if config.has_option(section, 'refs'):
+                mdesc.extend(config.get(section, 'refs').split())
+            cfg.setdefault('mirror_ref', []).append(mdesc)
 
     # Get an absolute path for the work directory
+    if cfg.get('workdir_pool'):
+        cfg['workdir_pool'] = full_path(cfg.get('workdir_pool'))
+
     if cfg.get('workdir'):
         cfg['workdir'] = full_path(cfg.get('workdir'))
-    else:
+    elif not cfg.get('workdir_pool'):
+        # Otherwise leased from the pool by the merge command
         cfg['workdir'] = tempfile.mkdtemp()
 
     # Get an absolute path for the kernel configuration file
@@ -766,13 +1421,56 @@ def load_config(args):
     if cfg.get('buildconf'):
         cfg['buildconf'] = full_path(cfg.get('buildconf'))
 
+    # Get an absolute path for the build manifest
+    if cfg.get('manifest'):
+        cfg['manifest'] = full_path(cfg.get('manifest'))
+
     # Get an absolute path for the tarpkg
     if cfg.get('tarpkg'):
         cfg['tarpkg'] = full_path(cfg.get('tarpkg'))
 
+    # Get an absolute path for the mirror directory
+    if cfg.get('mirror_dir'):
+        cfg['mirror_dir'] = full_path(cfg.get('mirror_dir'))
+
+    # Get an absolute path for the seed bundle
+    if cfg.get('seed_bundle'):
+        cfg['seed_bundle'] = full_path(cfg.get('seed_bundle'))
+
+    # Get an absolute path for the worktree repository
+    if cfg.get('worktree_repo'):
+        cfg['worktree_repo'] = full_path(cfg.get('worktree_repo'))
+
+    # Get an absolute path for the mbox cache
+    if cfg.get('mbox_cache'):
+        cfg['mbox_cache'] = full_path(cfg.get('mbox_cache'))
+
     return cfg
 
 
+def setup_mbox_cache(cfg):
+    """
+    Make skt serve Patchwork mbox downloads from a persistent cache, if a
+    cache directory is configured.
+
+    Args:
+        cfg:    A dictionary of skt configuration.
+
+    Returns:
+        The created skt.mboxcache.MboxCache instance, or None if no cache
+        directory is configured.
+    """
+    if not cfg.get('mbox_cache'):
+        return None
+
+    kwargs = {}
+    if cfg.get('mbox_cache_size'):
+        kwargs['max_size'] = int(cfg.get('mbox_cache_size')) * 1024 * 1024
+    skt.MBOX_CACHE = skt.mboxcache.MboxCache(cfg.get('mbox_cache'), **kwargs)
+
+    return skt.MBOX_CACHE
+
+
 def main():
     global retcode
 
@@ -781,8 +1479,15 @@ def main():
 
     setup_logging(args.verbose)
     cfg = load_config(args)
+    mbox_cache = setup_mbox_cache(cfg)
 
     args.func(cfg)
+
+    if mbox_cache is not None:
+        logging.info("mbox cache: %(hits)d hits, %(misses)d misses",
+                     mbox_cache.get_stats())
+    if skt.httpsession.SESSION is not None:
+        skt.httpsession.SESSION.log_stats()
     if cfg.get('junit'):
         ts = junit_xml.TestSuite("skt", cfg.get('_testcases'))
         with open("%s/%s.xml" % (cfg.get('junit'), args._name), 'w') as fileh:
@@ -0,0 +1,216 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Timing and transfer accounting of git commands"""
+import logging
+import re
+import subprocess
+import threading
+import time
+
+# Global git options taking a separate value
+VALUE_OPTIONS = ["-C", "-c", "--git-dir", "--work-tree"]
+
+# Multipliers of size units used by git progress output
+SIZE_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}
+
+
+def get_subcommand(args):
+    """
+    Get the subcommand of a git command line.
+
+    Args:
+        args:   The command line, starting with "git".
+
+    Returns:
+        The subcommand name, e.g. "fetch", or None if not found.
+    """
+    args = iter(args[1:])
+    for arg in args:
+        if arg in VALUE_OPTIONS:
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def parse_fetch_progress(output):
+    """
+    Parse the number of objects and bytes received by a git fetch from its
+    --progress output.
+
+    Args:
+        output: The fetch standard error output.
+
+    Returns:
+        A tuple of the number of objects and the number of bytes received,
+        zeroes if nothing was received.
+    """
+    objects = None
+    total = 0
+    size = 0
+    # Progress lines are updated with carriage returns, the last update of
+    # each line is the final one
+    for line in re.split(r'[\r\n]', output):
+        match = re.search(r'(?:Receiving|Unpacking) objects: +\d+% '
+                          r'\((\d+)/\d+\)(?:, ([\d.]+) (bytes|[KMG]iB))?',
+                          line)
+        if match:
+            objects = int(match.group(1))
+            if match.group(2):
+                size = int(float(match.group(2)) *
+                           SIZE_UNITS[match.group(3)])
+            continue
+        # Small fetches can be unpacked without progress, fall back to the
+        # total reported by the remote
+        match = re.search(r'^remote: Total (\d+)', line)
+        if match:
+            total += int(match.group(1))
+
+    return (objects if objects is not None else total, size)
+
+
+class GitStats(object):
+    """
+    GitStats - records wall time, exit status and, for fetches, the amount
+    of objects and bytes received, of git commands, and summarizes them per
+    subcommand. Counts decisions made about git commands, e.g. skipped
+    fetches. Safe to use from multiple threads.
+    """
+
+    def __init__(self):
+        """Initialize empty git command statistics."""
+        self.lock = threading.Lock()
+        # List of dictionaries describing each executed command
+        self.commands = []
+        # Numbers of decisions made about git commands, e.g. skipped
+        # fetches, indexed by name
+        self.counters = {}
+
+    def record(self, args, seconds, retcode, objects=0, size=0):
+        """
+        Record an executed git command.
+
+        Args:
+            args:       The command line, starting with "git".
+            seconds:    The wall time the command took, in seconds.
+            retcode:    The exit status of the command.
+            objects:    The number of objects received.
+            size:       The number of bytes received.
+        """
+        command = {'command': get_subcommand(args),
+                   'seconds': seconds,
+                   'retcode': retcode,
+                   'objects': objects,
+                   'bytes': size}
+        logging.debug("git %(command)s took %(seconds).3fs, exited with "
+                      "%(retcode)d, received %(objects)d objects, "
+                      "%(bytes)d bytes", command)
+        with self.lock:
+            self.commands.append(command)
+
+    def count(self, name):
+        """
+        Count a decision made about git commands, e.g. a skipped fetch.
+
+        Args:
+            name:   The name of the decision, e.g. "fetch-skipped".
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def get_counters(self):
+        """
+        Get the numbers of counted decisions.
+
+        Returns:
+            A dictionary of numbers of decisions, indexed by name.
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def check_call(self, args, **kwargs):
+        """
+        Execute a git command like subprocess.check_call(), and record it.
+        Fetches not redirecting standard error get the --progress option
+        added, and the received amounts are parsed from its output.
+
+        Args:
+            args:   The command line, starting with "git".
+            kwargs: Keyword arguments for subprocess.Popen().
+
+        Raises:
+            subprocess.CalledProcessError if the command failed.
+        """
+        progress = get_subcommand(args) == "fetch" and 'stderr' not in kwargs
+        if progress:
+            args = list(args) + ["--progress"]
+            kwargs['stderr'] = subprocess.PIPE
+
+        start = time.time()
+        proc = subprocess.Popen(args, **kwargs)
+        (_, stderr) = proc.communicate()
+        seconds = time.time() - start
+
+        (objects, size) = (0, 0)
+        if progress:
+            (objects, size) = parse_fetch_progress(stderr)
+            # Skip the progress lines, keep any messages
+            for line in re.split(r'[\r\n]', stderr):
+                if line and not re.search(r'\d+% \(\d+/\d+\)', line):
+                    logging.debug("git: %s", line)
+            if proc.returncode != 0:
+                logging.error("%s", stderr)
+
+        self.record(args, seconds, proc.returncode, objects, size)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, args)
+
+    def get_summary(self):
+        """
+        Summarize recorded commands per subcommand.
+
+        Returns:
+            A dictionary of dictionaries, indexed by subcommand name, each
+            containing the number of executed commands ("count"), the number
+            of failed commands ("failed"), the total wall time ("seconds"),
+            and the total number of received objects ("objects") and bytes
+            ("bytes").
+        """
+        summary = {}
+        with self.lock:
+            for command in self.commands:
+                entry = summary.setdefault(command['command'], {
+                    'count': 0, 'failed': 0, 'seconds': 0.0,
+                    'objects': 0, 'bytes': 0
+                })
+                entry['count'] += 1
+                entry['failed'] += 1 if command['retcode'] else 0
+                entry['seconds'] += command['seconds']
+                entry['objects'] += command['objects']
+                entry['bytes'] += command['bytes']
+
+        for entry in summary.values():
+            entry['seconds'] = round(entry['seconds'], 3)
+
+        return summary
+
+    def log_summary(self):
+        """Log the per-subcommand summary and the counters at info level."""
+        for (command, entry) in sorted(self.get_summary().items()):
+            logging.info("git %s: %d runs, %d failed, %.3fs, %d objects, "
+                         "%d bytes received", command, entry['count'],
+                         entry['failed'], entry['seconds'], entry['objects'],
+                         entry['bytes'])
+        for (name, count) in sorted(self.get_counters().items()):
+            logging.info("git %s: %d", name, count)
@@ -0,0 +1,207 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Shared pooled HTTP session used for all skt network fetches"""
+import logging
+import threading
+import time
+import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+class HTTPSession(object):
+    """
+    A requests session keeping connections alive, retrying failed requests,
+    limiting the number of concurrent requests per host, and accounting
+    requests, bytes and latency per host.
+    """
+
+    def __init__(self, retries=3, backoff_factor=0.5, max_per_host=4):
+        """
+        Initialize an HTTP session.
+
+        Args:
+            retries:        Maximum number of retries for a request failing
+                            to connect or with a server error status.
+            backoff_factor: Backoff factor for sleeping between retries, in
+                            seconds. See urllib3's Retry for details.
+            max_per_host:   Maximum number of concurrent requests per host.
+                            Also the size of the connection pool per host.
+        """
+        self.max_per_host = max_per_host
+        self.session = requests.Session()
+        retry = Retry(total=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=max_per_host, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Lock protecting the per-host dictionaries below
+        self.lock = threading.Lock()
+        # Host name -> semaphore limiting concurrent requests
+        self.semaphores = {}
+        # Host name -> dictionary of "requests", "failures" (requests raising
+        # an exception), "bytes" (of bodies read) and "latency" (total seconds
+        # spent waiting for responses)
+        self.stats = {}
+
+    def _get_host_semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(
+                    self.max_per_host
+                )
+                self.stats[host] = {'requests': 0, 'failures': 0,
+                                    'bytes': 0, 'latency': 0.0}
+            return self.semaphores[host]
+
+    def _account(self, host, nbytes, latency, failed=False):
+        with self.lock:
+            self.stats[host]['requests'] += 1
+            self.stats[host]['bytes'] += nbytes
+            self.stats[host]['latency'] += latency
+            if failed:
+                self.stats[host]['failures'] += 1
+
+    def _hold_stream(self, response, host, semaphore, latency):
+        """
+        Keep the host semaphore acquired until a streamed response body is
+        consumed or the response is closed, accounting the bytes actually
+        read through iter_content(), which also backs "content", "text" and
+        iter_lines().
+
+        Args:
+            response:   The streamed requests response.
+            host:       The host name the response came from.
+            semaphore:  The acquired semaphore of the host.
+            latency:    Seconds spent waiting for the response headers.
+        """
+        state = {'held': True, 'bytes': 0}
+        state_lock = threading.Lock()
+        iter_content = response.iter_content
+        close = response.close
+
+        def release():
+            with state_lock:
+                if not state['held']:
+                    return
+                state['held'] = False
+            self._account(host, state['bytes'], latency)
+            semaphore.release()
+
+        def counting_iter_content(*args, **kwargs):
+            try:
+                for chunk in iter_content(*args, **kwargs):
+                    state['bytes'] += len(chunk)
+                    yield chunk
+            finally:
+                release()
+
+        def releasing_close():
+            try:
+                close()
+            finally:
+                release()
+
+        response.iter_content = counting_iter_content
+        response.close = releasing_close
+
+    def get(self, url, **kwargs):
+        """
+        Send a GET request through the session.
+
+        Args:
+            url:    The URL to get.
+            kwargs: Keyword arguments to pass to requests.Session.get().
+
+        Returns:
+            The requests response. Streamed responses ("stream=True") keep
+            their host's request slot until their body is consumed, or they
+            are closed, so callers must do either.
+        """
+        host = urlparse.urlparse(url).netloc
+        semaphore = self._get_host_semaphore(host)
+        semaphore.acquire()
+        tstart = time.time()
+        try:
+            response = self.session.get(url, **kwargs)
+        except Exception:
+            self._account(host, 0, time.time() - tstart, failed=True)
+            semaphore.release()
+            raise
+        latency = time.time() - tstart
+
+        if kwargs.get('stream'):
+            self._hold_stream(response, host, semaphore, latency)
+        else:
+            self._account(host, len(response.content), latency)
+            semaphore.release()
+
+        return response
+
+    def get_stats(self):
+        """
+        Get per-host request accounting.
+
+        Returns:
+            A dictionary of host names to dictionaries with "requests",
+            "failures", "bytes" and "latency" (seconds) totals.
+        """
+        with self.lock:
+            return dict((host, dict(hstats))
+                        for (host, hstats) in self.stats.iteritems())
+
+    def log_stats(self):
+        """Log per-host request accounting."""
+        for (host, hstats) in sorted(self.get_stats().iteritems()):
+            logging.info("http %s: %d requests, %d failed, %d bytes, "
+                         "%.2fs latency", host, hstats['requests'],
+                         hstats['failures'], hstats['bytes'],
+                         hstats['latency'])
+
+
+# The session shared by all skt modules, created on first use
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """
+    Get the session shared by all skt modules, creating it if necessary.
+
+    Returns:
+        The shared HTTPSession instance.
+    """
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = HTTPSession()
+        return SESSION
+
+
+def get(url, **kwargs):
+    """
+    Send a GET request through the shared session.
+
+    Args:
+        url:    The URL to get.
+        kwargs: Keyword arguments to pass to requests.Session.get().
+
+    Returns:
+        The requests response.
+    """
+    return get_session().get(url, **kwargs)
@@ -12,13 +12,122 @@
 # along with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 """Class for managing a kernel source tree"""
+import contextlib
+import hashlib
+import json
 import logging
 import os
 import re
 import shutil
 import subprocess
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 import skt
+import skt.gitstats
+import skt.maintenance
+import skt.mirror
+import skt.patchindex
+
+
+class GitCatFile(object):
+    """
+    GitCatFile - a long-lived "git cat-file --batch" process answering object
+    queries over a pipe, saving a process spawn and repository discovery per
+    query. Reference updates and new objects are picked up by the process
+    between queries.
+    """
+
+    def __init__(self, wdir, gdir):
+        """
+        Initialize a GitCatFile, starting the process.
+
+        Args:
+            wdir:   The git working directory.
+            gdir:   The git repository directory.
+        """
+        self.args = ["git", "--work-tree", wdir, "--git-dir", gdir,
+                     "cat-file", "--batch"]
+        self.proc = None
+        self.start()
+
+    def start(self):
+        """Start the process."""
+        logging.debug("executing: %s", " ".join(self.args))
+        self.proc = subprocess.Popen(self.args,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     env=dict(os.environ, **{'LC_ALL': 'C'}))
+
+    def close(self):
+        """Stop the process."""
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc = None
+
+    def query(self, name):
+        """
+        Look up an object.
+
+        Args:
+            name:   The object name, anything "git rev-parse" accepts, e.g.
+                    "HEAD^{commit}". Must not contain newlines.
+
+        Returns:
+            A tuple of the object's full hash, type and content strings, or
+            None if the object wasn't found.
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            self.start()
+
+        self.proc.stdin.write(name + "\n")
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().split()
+        if not header or header[-1] in ["missing", "ambiguous"]:
+            return None
+
+        (objhash, objtype, size) = header
+        content = self.proc.stdout.read(int(size))
+        # Skip the newline following the content
+        self.proc.stdout.read(1)
+
+        return (objhash, objtype, content)
+
+
+@contextlib.contextmanager
+def no_lock():
+    """Hold no lock, where a lock isn't needed."""
+    yield
+
+
+def get_kerneltree(backend, *args, **kwargs):
+    """
+    Create a KernelTree with the specified backend, falling back to the git
+    CLI backend if the backend is not available.
+
+    Args:
+        backend:    The name of the backend: "cli" to execute git for all
+                    operations, or "pygit2" to look up references, commits
+                    and remotes in-process with libgit2.
+        args:       Positional arguments for the KernelTree.
+        kwargs:     Keyword arguments for the KernelTree.
+
+    Returns:
+        The created KernelTree instance.
+    """
+    if backend == "pygit2":
+        try:
+            import skt.pygit2tree
+            return skt.pygit2tree.Pygit2KernelTree(*args, **kwargs)
+        except ImportError:
+            logging.warning("pygit2 is not available, using git CLI backend")
+    elif backend not in [None, "cli"]:
+        raise Exception("Unknown git backend: %s" % backend)
+
+    return KernelTree(*args, **kwargs)
 
 
 class KernelTree(object):
@@ -27,7 +136,9 @@ class KernelTree(object):
     working directory
     """
 
-    def __init__(self, uri, ref=None, wdir=None, fetch_depth=None):
+    def __init__(self, uri, ref=None, wdir=None, fetch_depth=None,
+                 mirror_dir=None, worktree_repo=None, fetch_filter=None,
+                 seed_bundle=None, patch_index=False, check_fresh=False):
         """
         Initialize a KernelTree.
 
@@ -40,17 +151,79 @@ class KernelTree(object):
             fetch_depth:
                     The amount of git history to include with the clone.
                     Smaller depths lead to faster repo clones.
+            mirror_dir:
+                    The directory housing shared bare mirrors of remote
+                    repositories, or None to fetch from remotes directly.
+                    If specified, remote references are fetched into the
+                    mirrors first, and the clone borrows their objects.
+            worktree_repo:
+                    The path to a long-lived bare repository to provision the
+                    working directory from as a "git worktree", sharing
+                    remotes, references and objects with other working
+                    directories. None to create a standalone clone.
+            fetch_filter:
+                    The git object filter to fetch with, making a partial
+                    clone, e.g. "blob:none" or "tree:0". Filtered out objects
+                    are fetched on demand, when needed e.g. for checkout or
+                    merge. None to fetch all objects.
+            seed_bundle:
+                    The path to a git bundle file to fetch objects from
+                    before the first fetch from the remote, so only the
+                    commits added since the bundle was created are fetched
+                    over the network. None to fetch everything from the
+                    remote.
+            patch_index:
+                    True if an index of patch IDs of the recent history of
+                    the checked out reference should be kept in the
+                    repository, and updated on checkout, for
+                    find_merged_patches().
+            check_fresh:
+                    True if remote references should be resolved with a
+                    single "git ls-remote" per remote before fetching, and
+                    only fetched if their heads are missing locally.
         """
         # The git "working directory" (the "checkout")
         self.wdir = wdir
-        # The cloned git repository
+        # The cloned git repository. A file pointing to the repository, in
+        # case of a worktree.
         self.gdir = "%s/.git" % self.wdir
+        # The long-lived repository the working directory is a worktree of,
+        # or None for a standalone clone
+        self.worktree_repo = worktree_repo
+        # The repository holding remotes, references and objects
+        self.common_gdir = worktree_repo if worktree_repo else self.gdir
         # The origin remote's URL
         self.uri = uri
+        # The name of the origin remote. Working directories sharing a
+        # repository get a remote per origin URL.
+        self.remote = "origin"
+        if worktree_repo:
+            self.remote = "origin-%s" % hashlib.sha1(uri).hexdigest()[:12]
         # The remote reference to checkout
         self.ref = ref if ref is not None else "master"
         self.info = []
         self.mergelog = "%s/merge.log" % self.wdir
+        # The long-lived "git cat-file" process, started on first query
+        self.catfile = None
+        # Statistics of executed git commands
+        self.gitstats = skt.gitstats.GitStats()
+        # Lists of (remote name, local reference) tuples of merge references
+        # fetched in advance, indexed by (URI, remote reference) tuples
+        self.fetched_refs = {}
+        # Serializes repository configuration updates by concurrent fetches
+        self.config_lock = threading.Lock()
+        # Remote URLs indexed by names, loaded on first use by get_remotes()
+        self.remotes = None
+        # Remote heads of merge references used in the merge cache key
+        self.merge_cache_heads = None
+        # Number of files changed by the last checkout of a previously
+        # checked out working directory, None if nothing was checked out
+        self.changed_files = None
+        # Names of the remotes fetched from, for repository maintenance
+        self.used_remotes = set()
+        # Heads of remote references resolved with "git ls-remote", or None
+        # for references not found, indexed by (URI, remote reference) tuples
+        self.remote_heads = {}
 
         try:
             os.mkdir(self.wdir)
@@ -62,14 +235,20 @@ class KernelTree(object):
         except OSError:
             pass
 
-        self.git_cmd("init")
+        if self.worktree_repo:
+            self.init_worktree()
+        else:
+            self.init_repo()
 
-        try:
-            self.git_cmd("remote", "set-url", "origin", self.uri)
-        except subprocess.CalledProcessError:
-            self.git_cmd("remote", "add", "origin", self.uri)
+        with self.repo_lock():
+            self.set_remote(self.remote, self.uri)
 
         self.fetch_depth = fetch_depth
+        self.mirror_dir = mirror_dir
+        self.fetch_filter = fetch_filter
+        self.seed_bundle = seed_bundle
+        self.patch_index = patch_index
+        self.check_fresh = check_fresh
 
         logging.info("base repo url: %s", self.uri)
         logging.info("base ref: %s", self.ref)
@@ -79,9 +258,323 @@ class KernelTree(object):
         args = list(["git", "--work-tree", self.wdir, "--git-dir",
                      self.gdir]) + list(args)
         logging.debug("executing: %s", " ".join(args))
-        subprocess.check_call(args,
-                              env=dict(os.environ, **{'LC_ALL': 'C'}),
-                              **kwargs)
+        self.gitstats.check_call(args,
+                                 env=dict(os.environ, **{'LC_ALL': 'C'}),
+                                 **kwargs)
+
+    def init_repo(self):
+        """
+        Create a repository in the working directory, or reinitialize the
+        existing one.
+        """
+        self.git_cmd("init")
+
+    def set_remote(self, remote, uri):
+        """
+        Set the URL of a remote, adding the remote if it doesn't exist.
+
+        Args:
+            remote: The name of the remote.
+            uri:    The Git URI of the remote.
+        """
+        try:
+            self.git_cmd("remote", "set-url", remote, uri)
+        except subprocess.CalledProcessError:
+            self.git_cmd("remote", "add", remote, uri)
+
+    def add_remote(self, remote, uri):
+        """
+        Add a remote, unless a remote with the same name exists.
+
+        Args:
+            remote: The name of the remote.
+            uri:    The Git URI of the remote.
+
+        Returns:
+            True if the remote was added, False if it existed.
+        """
+        try:
+            self.git_cmd("remote", "add", remote, uri,
+                         stderr=subprocess.PIPE)
+        except subprocess.CalledProcessError:
+            return False
+        return True
+
+    @staticmethod
+    def repo_git_cmd(repo, *args):
+        """
+        Execute a git command in a bare repository and return its output.
+
+        Args:
+            repo:   Path to the bare repository.
+            args:   Arguments of the git command.
+
+        Returns:
+            The command output string.
+        """
+        args = list(["git", "--git-dir", repo]) + list(args)
+        logging.debug("executing: %s", " ".join(args))
+        return subprocess.check_output(args,
+                                       env=dict(os.environ, **{'LC_ALL': 'C'}))
+
+    @staticmethod
+    def prune_worktrees(repo):
+        """
+        Remove administrative data of worktrees of a repository, whose
+        working directories no longer exist.
+
+        Args:
+            repo:   Path to the repository.
+        """
+        logging.info("pruning stale worktrees of %s", repo)
+        with skt.file_lock("%s.lock" % repo):
+            KernelTree.repo_git_cmd(repo, "worktree", "prune")
+
+    def repo_lock(self, shared=False):
+        """
+        Get a context manager holding a lock on the long-lived repository the
+        working directory is a worktree of, shared with other processes.
+        Changes of remotes and configuration need the exclusive lock, as do
+        adding and pruning worktrees, which leave them with invalid HEADs
+        for a while. Commands walking the references of all worktrees, such
+        as fetch, need the shared lock. A standalone clone isn't locked.
+
+        Args:
+            shared: True to get the shared lock, False for the exclusive one.
+        """
+        if not self.worktree_repo:
+            return no_lock()
+        return skt.file_lock("%s.lock" % self.worktree_repo, shared)
+
+    def get_tracking_ref(self, remote, ref):
+        """
+        Get the local reference to fetch a remote reference into. Working
+        directories sharing a repository get references private to their
+        worktree, so concurrent jobs can't move each other's.
+
+        Args:
+            remote: The name of the remote.
+            ref:    The remote reference.
+
+        Returns:
+            The full name of the local reference.
+        """
+        name = "remotes/%s/%s" % (remote, ref.split('/')[-1])
+        if self.worktree_repo:
+            return "refs/worktree/%s" % name
+        return "refs/%s" % name
+
+    def init_worktree(self):
+        """
+        Provision the working directory as a worktree of the long-lived
+        repository, creating the repository if it doesn't exist. Reuse the
+        working directory, if it is a worktree already.
+        """
+        repo = self.worktree_repo
+        with skt.file_lock("%s.lock" % repo):
+            if not os.path.isdir(os.path.join(repo, "objects")):
+                logging.info("creating worktree repository %s", repo)
+                subprocess.check_call(["git", "init", "-q", "--bare", repo])
+
+            self.repo_git_cmd(repo, "worktree", "prune")
+            if os.path.exists(self.gdir):
+                return
+
+            # Worktrees can only be added at a commit, and nothing might have
+            # been fetched yet, so use an empty commit as the starting point.
+            base = "refs/skt/worktree-base"
+            try:
+                self.repo_git_cmd(repo, "rev-parse", "-q", "--verify", base)
+            except subprocess.CalledProcessError:
+                tree = self.repo_git_cmd(repo, "hash-object", "-t", "tree",
+                                         "-w", os.devnull).strip()
+                commit = self.repo_git_cmd(
+                    repo, "-c", "user.name=skt", "-c", "user.email=skt@skt",
+                    "commit-tree", "-m", "skt worktree base", tree
+                ).strip()
+                self.repo_git_cmd(repo, "update-ref", base, commit)
+
+            logging.info("adding worktree %s of %s", self.wdir, repo)
+            self.repo_git_cmd(repo, "worktree", "add", "--detach", self.wdir,
+                              base)
+
+    def add_alternate(self, objdir):
+        """
+        Make the repository borrow objects from another object directory,
+        unless it does already.
+
+        Args:
+            objdir: Path to the object directory to borrow objects from.
+        """
+        path = "%s/objects/info/alternates" % self.common_gdir
+        try:
+            with open(path, 'r') as fileh:
+                if objdir in fileh.read().splitlines():
+                    return
+        except IOError:
+            pass
+
+        logging.debug("adding alternate %s", objdir)
+        with open(path, 'a') as fileh:
+            fileh.write(objdir + "\n")
+
+    def fetch_ref(self, remote, uri, ref, dstref, depth=None):
+        """
+        Fetch a remote reference into a local one, through a shared mirror
+        of the remote repository, if a mirror directory was specified.
+
+        Args:
+            remote: The name of the remote to fetch from.
+            uri:    The Git URI of the remote.
+            ref:    The remote reference (or commit hash) to fetch.
+            dstref: The local reference to fetch into.
+            depth:  The amount of git history to fetch, or None for all.
+        """
+        self.used_remotes.add(remote)
+        if self.fetch_filter:
+            # Have objects filtered out of the fetch retrieved from the
+            # remote when they're needed
+            with self.config_lock, self.repo_lock():
+                self.git_cmd("config", "remote.%s.promisor" % remote, "true")
+                self.git_cmd("config",
+                             "remote.%s.partialclonefilter" % remote,
+                             self.fetch_filter)
+
+        args = []
+        if self.mirror_dir:
+            mirror = skt.mirror.GitMirror(self.mirror_dir, uri,
+                                          stats=self.gitstats)
+            ref = mirror.update(ref, depth=depth,
+                                fetch_filter=self.fetch_filter)
+            with self.config_lock, self.repo_lock():
+                self.add_alternate(mirror.objdir)
+            # Objects are already available through alternates, so this only
+            # updates the reference
+            remote = mirror.path
+        elif self.fetch_filter:
+            args.append("--filter=%s" % self.fetch_filter)
+        if self.worktree_repo:
+            # Don't update the shared remote-tracking references of the
+            # remote along with the private one
+            args.append("--refmap=")
+
+        args = ["fetch", "-n"] + args + [remote, "+%s:%s" % (ref, dstref)]
+        # If the user provided extra arguments for the git fetch step, append
+        # them to the existing set of arguments.
+        if depth:
+            args.extend(['--depth', depth])
+
+        # The git_cmd() method expects a list of args, not a list of strings,
+        # so we need to expand our list into args with *. Shallow fetches
+        # update the "shallow" file shared by all worktrees.
+        with self.repo_lock(shared=not depth):
+            self.git_cmd(*args)
+
+    def resolve_remote_heads(self, uri_refs, workers=4):
+        """
+        Resolve remote references to commit hashes with a single
+        "git ls-remote" per remote, querying remotes concurrently. Skip
+        references resolved already. Store the results in "remote_heads",
+        None for references not found, or whose remote couldn't be queried.
+
+        Args:
+            uri_refs:   A list of (URI, remote reference) tuples.
+            workers:    Maximum number of remotes to query at once.
+        """
+        pending = {}
+        for (uri, ref) in uri_refs:
+            if (uri, ref) in self.remote_heads:
+                continue
+            refs = pending.setdefault(uri, [])
+            if ref not in refs:
+                refs.append(ref)
+        if not pending:
+            return
+
+        def resolve(uri):
+            """Resolve the pending references of a remote."""
+            try:
+                return self.get_remote_heads(uri, pending[uri],
+                                             stats=self.gitstats)
+            except subprocess.CalledProcessError:
+                logging.warning("failed to query %s, fetching", uri)
+                return {}
+
+        uris = sorted(pending)
+        pool = ThreadPool(max(1, min(workers, len(uris))))
+        try:
+            results = pool.map(resolve, uris)
+        finally:
+            pool.close()
+            pool.join()
+
+        for (uri, heads) in zip(uris, results):
+            for ref in pending[uri]:
+                self.remote_heads[(uri, ref)] = heads.get(ref)
+
+    def skip_fresh(self, uri, ref, dstref):
+        """
+        Update a local reference to the resolved head of a remote reference,
+        instead of fetching, if the head commit exists locally already.
+        Count the decision in the git statistics, as "fetch-skipped" or
+        "fetch-needed". Must be called after resolve_remote_heads() for the
+        reference, and not concurrently.
+
+        Args:
+            uri:    The Git URI of the remote.
+            ref:    The remote reference (or commit hash).
+            dstref: The local reference to update.
+
+        Returns:
+            True if the local reference was updated and the fetch can be
+            skipped, False if the reference has to be fetched.
+        """
+        head = self.remote_heads.get((uri, ref))
+        if head is not None:
+            try:
+                self.get_commit_hash(head)
+            except Exception:
+                head = None
+
+        if head is None:
+            self.gitstats.count("fetch-needed")
+            return False
+
+        logging.info("%s %s is available locally at %s, not fetching", uri,
+                     ref, head)
+        self.git_cmd("update-ref", dstref, head)
+        self.gitstats.count("fetch-skipped")
+        return True
+
+    def seed(self):
+        """
+        Fetch the references of the seed bundle into "refs/skt-seed/",
+        unless the repository was seeded already. The seed references make
+        later fetches negotiate only the objects missing from the bundle.
+        Failures are logged and ignored, as everything can still be fetched
+        from the remote.
+        """
+        with self.repo_lock():
+            if self.repo_git_cmd(self.common_gdir, "for-each-ref",
+                                 "--count=1", "refs/skt-seed/"):
+                logging.debug("repository seeded already")
+                return
+
+            logging.info("seeding repository from %s", self.seed_bundle)
+            try:
+                heads = self.repo_git_cmd(self.common_gdir, "bundle",
+                                          "list-heads", self.seed_bundle)
+                refspecs = []
+                for line in heads.splitlines():
+                    ref = line.split()[1]
+                    refspecs.append("+%s:refs/skt-seed/%s" %
+                                    (ref, re.sub(r'^refs/', '', ref)))
+                if refspecs:
+                    self.git_cmd("fetch", "-n", self.seed_bundle, *refspecs)
+            except subprocess.CalledProcessError:
+                logging.warning("failed to seed repository from %s, "
+                                "fetching everything from the remote",
+                                self.seed_bundle)
 
     def getpath(self):
         return self.wdir
@@ -102,9 +595,48 @@ class KernelTree(object):
         fpath = '/'.join([self.wdir, fname])
         with open(fpath, 'w') as f:
             for iitem in self.info:
-                f.write(','.join(iitem) + "\n")
+                # FIXME Do proper CSV escaping, or switch data format instead
+                #       of maiming subjects (ha-ha). See issue #119.
+                # Replace commas with semicolons to avoid clashes with CSV
+                # separator. The build manifest has the original values.
+                f.write(','.join(field.replace(',', ';') for field in iitem) +
+                        "\n")
         return fpath
 
+    def get_catfile(self):
+        """
+        Get the long-lived "git cat-file" process of the repository, starting
+        it if necessary.
+
+        Returns:
+            The GitCatFile instance.
+        """
+        if self.catfile is None:
+            self.catfile = GitCatFile(self.wdir, self.gdir)
+        return self.catfile
+
+    def get_commit(self, ref=None):
+        """
+        Get the hash and the raw object of the commit pointed at by the
+        specified reference, or of the currently checked-out commit, if not
+        specified.
+
+        Args:
+            ref:    The reference to the commit, or None, if the currently
+                    checked-out commit should be used instead.
+        Returns:
+            A tuple of the commit's full hash string and its raw object.
+
+        Raises:
+            Exception if the reference doesn't point to a commit.
+        """
+        name = "%s^{commit}" % (ref if ref is not None else "HEAD")
+        result = self.get_catfile().query(name)
+        if result is None:
+            raise Exception("Failed to find commit %s" % name)
+
+        return (result[0], result[2])
+
     def get_commit_date(self, ref=None):
         """
         Get the committer date of the commit pointed at by the specified
@@ -117,21 +649,15 @@ class KernelTree(object):
         Returns:
             The epoch timestamp string of the commit's committer date.
         """
-        args = ["git",
-                "--work-tree", self.wdir,
-                "--git-dir", self.gdir,
-                "show",
-                "--format=%ct",
-                "-s"]
-
-        if ref is not None:
-            args.append(ref)
-
-        logging.debug("git_commit_date: %s", args)
-        grs = subprocess.Popen(args, stdout=subprocess.PIPE)
-        (stdout, _) = grs.communicate()
+        (_, content) = self.get_commit(ref)
+        for line in content.split("\n"):
+            if line.startswith("committer "):
+                # The date follows the committer e-mail, before the timezone
+                return int(line.rsplit(" ", 2)[1])
+            if not line:
+                break
 
-        return int(stdout.rstrip())
+        raise Exception("Failed to find committer of %s" % ref)
 
     def get_commit_hash(self, ref=None):
         """
@@ -144,21 +670,24 @@ class KernelTree(object):
         Returns:
             The commit's full hash string.
         """
-        args = ["git",
-                "--work-tree", self.wdir,
-                "--git-dir", self.gdir,
-                "show",
-                "--format=%H",
-                "-s"]
+        return self.get_commit(ref)[0]
 
-        if ref is not None:
-            args.append(ref)
+    def get_changed_paths(self, base, ref="HEAD"):
+        """
+        Get the paths changed between two commits.
 
-        logging.debug("git_commit: %s", args)
-        grs = subprocess.Popen(args, stdout=subprocess.PIPE)
-        (stdout, _) = grs.communicate()
+        Args:
+            base:   The reference to the commit to compare against.
+            ref:    The reference to the commit with the changes, the
+                    currently checked-out commit by default.
 
-        return stdout.rstrip()
+        Returns:
+            A sorted list of changed paths, with both the old and the new
+            path of renamed files.
+        """
+        output = self.repo_git_cmd(self.gdir, "diff", "--name-only", "-z",
+                                   "--no-renames", base, ref)
+        return sorted(path for path in output.split('\0') if path)
 
     def checkout(self):
         """
@@ -169,56 +698,127 @@ class KernelTree(object):
         Returns:
             Full hash of the last commit.
         """
-        dstref = "refs/remotes/origin/%s" % (self.ref.split('/')[-1])
-        logging.info("fetching base repo")
-        git_fetch_args = [
-            "fetch", "-n", "origin",
-            "+%s:%s" % (self.ref, dstref)
-        ]
-        # If the user provided extra arguments for the git fetch step, append
-        # them to the existing set of arguments.
-        if self.fetch_depth:
-            git_fetch_args.extend(['--depth', self.fetch_depth])
+        dstref = self.get_tracking_ref(self.remote, self.ref)
+        if self.seed_bundle:
+            self.seed()
 
-        # The git_cmd() method expects a list of args, not a list of strings,
-        # so we need to expand our list into args with *.
-        self.git_cmd(*git_fetch_args)
+        if self.check_fresh:
+            self.resolve_remote_heads([(self.uri, self.ref)])
+        if self.check_fresh and self.skip_fresh(self.uri, self.ref, dstref):
+            self.used_remotes.add(self.remote)
+        else:
+            logging.info("fetching base repo")
+            self.fetch_ref(self.remote, self.uri, self.ref, dstref,
+                           depth=self.fetch_depth)
 
         logging.info("checking out %s", self.ref)
-        self.git_cmd("checkout", "-q", "--detach", dstref)
-        self.git_cmd("reset", "--hard", dstref)
+        self.sync_checkout(dstref)
 
         head = self.get_commit_hash()
+        if self.patch_index:
+            self.get_patch_index().update(head)
         self.info.append(("base", self.uri, head))
         logging.info("baserepo %s: %s", self.ref, head)
         return str(head).rstrip()
 
+    def sync_checkout(self, ref):
+        """
+        Check out a reference, rewriting only the files which differ from
+        it, so other files keep their modification times, and builds in a
+        reused working directory stay incremental. Discard any local
+        modifications. Set "changed_files" to the number of changed files,
+        if something was checked out before.
+
+        Args:
+            ref:    The reference to check out.
+        """
+        (retcode, _) = self.check_cmd(["rev-parse", "-q", "--verify",
+                                       "HEAD"])
+        if retcode != 0:
+            self.changed_files = None
+            self.git_cmd("checkout", "-q", "--detach", ref)
+            return
+
+        # Files touched without changing, e.g. by a build, look modified
+        # until the index is refreshed, and would be rewritten otherwise
+        self.git_cmd("update-index", "-q", "--refresh")
+        (dirty, _) = self.check_cmd(["diff-index", "--quiet", "HEAD", "--"])
+        (retcode, output) = self.check_cmd(["diff", "--name-only", "-z",
+                                            "--no-renames", ref, "--"])
+        if retcode != 0:
+            raise Exception("Failed to compare the working directory to "
+                            "%s: %s" % (ref, output))
+        self.changed_files = len([path for path in output.split('\0')
+                                  if path])
+
+        if dirty:
+            logging.info("discarding local modifications")
+            self.git_cmd("checkout", "-q", "-f", "--detach", ref)
+        else:
+            self.git_cmd("checkout", "-q", "--detach", ref)
+        logging.info("checkout changed %d files", self.changed_files)
+
     def cleanup(self):
         logging.info("cleaning up %s", self.wdir)
+        if self.catfile is not None:
+            self.catfile.close()
+            self.catfile = None
         shutil.rmtree(self.wdir)
+        if self.worktree_repo:
+            self.prune_worktrees(self.worktree_repo)
+
+    def get_remotes(self):
+        """
+        Get the configured remotes, reading the repository configuration on
+        first call only. Remotes added with add_merge_remote() are included.
+
+        Returns:
+            A dictionary of remote URLs, indexed by remote names.
+        """
+        if self.remotes is None:
+            self.remotes = {}
+            args = ["git", "--git-dir", self.gdir, "config", "--get-regexp",
+                    r"^remote\..*\.url$"]
+            logging.debug("executing: %s", " ".join(args))
+            proc = subprocess.Popen(args,
+                                    stdout=subprocess.PIPE,
+                                    env=dict(os.environ, **{'LC_ALL': 'C'}))
+            (stdout, _) = proc.communicate()
+            # Exits with 1 if there are no remotes
+            for line in stdout.splitlines():
+                (key, url) = line.split(" ", 1)
+                self.remotes[key[len("remote."):-len(".url")]] = url
+
+        return self.remotes
 
     def get_remote_url(self, remote):
-        rurl = None
-        grs = subprocess.Popen(["git",
-                                "--work-tree", self.wdir,
-                                "--git-dir", self.gdir,
-                                "remote", "show", remote],
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-        (stdout, _) = grs.communicate()
-        for line in stdout.split("\n"):
-            m = re.match('Fetch URL: (.*)', line)
-            if m:
-                rurl = m.group(1)
-                break
+        """
+        Get the URL of a configured remote.
+
+        Args:
+            remote: The name of the remote.
 
-        return rurl
+        Returns:
+            The URL of the remote, or None if it doesn't exist.
+        """
+        return self.get_remotes().get(remote)
 
     def getrname(self, uri):
+        """
+        Get the name of the remote to use for fetching from a URI: the
+        existing remote named after the repository with the same URI, or a
+        name not taken by remotes with other URIs.
+
+        Args:
+            uri:    The Git URI of the remote.
+
+        Returns:
+            The remote name.
+        """
         rname = (uri.split('/')[-1].replace('.git', '')
                  if not uri.endswith('/')
                  else uri.split('/')[-2].replace('.git', ''))
-        while self.get_remote_url(rname) == uri:
+        while self.get_remote_url(rname) not in [None, uri]:
             logging.warning(
                 "remote '%s' already exists with a different uri, adding '_'",
                 rname
@@ -227,19 +827,534 @@ class KernelTree(object):
 
         return rname
 
-    def merge_git_ref(self, uri, ref="master"):
-        rname = self.getrname(uri)
-        head = None
+    def add_merge_remote(self, uri, ref="master"):
+        """
+        Add a remote to fetch a reference to merge from.
+
+        Args:
+            uri:    The Git URI of the remote.
+            ref:    The remote reference to merge.
+
+        Returns:
+            A tuple of the added remote name and the local reference to fetch
+            the remote reference into.
+        """
+        with self.repo_lock():
+            if self.worktree_repo:
+                # Other jobs might have added remotes meanwhile
+                self.remotes = None
+            rname = self.getrname(uri)
+
+            if self.get_remote_url(rname) is None and \
+                    self.add_remote(rname, uri):
+                self.get_remotes()[rname] = uri
 
+        return (rname, self.get_tracking_ref(rname, ref))
+
+    def fetch_git_refs(self, merge_refs, workers=4):
+        """
+        Fetch references to merge concurrently, in advance of merging them
+        with merge_git_ref().
+
+        Args:
+            merge_refs: A list of lists, each containing a Git URI of a
+                        remote, optionally followed by the remote reference
+                        to merge, "master" if not specified.
+            workers:    Maximum number of fetches to run at once.
+
+        Raises:
+            subprocess.CalledProcessError, if any of the fetches failed.
+        """
+        fetches = []
+        # Remote names depend on the remotes added before, so add serially
+        for mdesc in merge_refs:
+            (uri, ref) = (mdesc[0], mdesc[1] if len(mdesc) > 1 else "master")
+            (rname, dstref) = self.add_merge_remote(uri, ref)
+            fetches.append((rname, uri, ref, dstref))
+
+        if not fetches:
+            return
+
+        # Fetching the same reference concurrently would race for its lock
+        unique_fetches = sorted(set(fetches), key=fetches.index)
+        if self.check_fresh:
+            self.resolve_remote_heads([(f_uri, f_ref)
+                                       for (_, f_uri, f_ref, _)
+                                       in unique_fetches], workers)
+            needed = []
+            for (rname, uri, ref, dstref) in unique_fetches:
+                if self.skip_fresh(uri, ref, dstref):
+                    self.used_remotes.add(rname)
+                else:
+                    needed.append((rname, uri, ref, dstref))
+            unique_fetches = needed
+
+        if unique_fetches:
+            logging.info("fetching %d references to merge",
+                         len(unique_fetches))
+            pool = ThreadPool(max(1, min(workers, len(unique_fetches))))
+            try:
+                results = [pool.apply_async(self.fetch_ref, fetch)
+                           for fetch in unique_fetches]
+                for result in results:
+                    result.get()
+            finally:
+                pool.close()
+                pool.join()
+
+        for (rname, uri, ref, dstref) in fetches:
+            self.fetched_refs.setdefault((uri, ref), []).append(
+                (rname, dstref)
+            )
+
+    def check_cmd(self, args, stdin=None, env=None):
+        """
+        Execute a git command checking whether something applies, capturing
+        its output.
+
+        Args:
+            args:   Arguments of the git command.
+            stdin:  A file object to use as the command's standard input, or
+                    None to inherit it.
+            env:    A dictionary of extra environment variables to set.
+
+        Returns:
+            A tuple of the command exit status and its combined output.
+        """
+        args = ["git", "--work-tree", self.wdir, "--git-dir",
+                self.gdir] + list(args)
+        logging.debug("executing: %s", " ".join(args))
+        start = time.time()
+        proc = subprocess.Popen(args,
+                                stdin=stdin,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                env=dict(os.environ, LC_ALL='C',
+                                         **(env or {})))
+        (stdout, _) = proc.communicate()
+        self.gitstats.record(args, time.time() - start, proc.returncode)
+        return (proc.returncode, stdout)
+
+    def check_applies(self, args, stdin=None, env=None):
+        """
+        Execute a git command checking whether something applies, telling
+        a conflict, reported with exit status 1, from any other failure.
+
+        Args:
+            args:   Arguments of the git command.
+            stdin:  A file object to use as the command's standard input, or
+                    None to inherit it.
+            env:    A dictionary of extra environment variables to set.
+
+        Returns:
+            A tuple of a boolean, True if it applies, and False if it
+            conflicts, and the command's combined output.
+
+        Raises:
+            subprocess.CalledProcessError, if the command failed otherwise,
+            e.g. with usage errors on git versions not supporting it, or
+            repository errors.
+        """
+        (retcode, output) = self.check_cmd(args, stdin=stdin, env=env)
+        if retcode not in (0, 1):
+            raise subprocess.CalledProcessError(retcode, ["git"] + list(args),
+                                                output)
+        return (retcode == 0, output)
+
+    def precheck(self, merge_refs=None, patches=None, workers=4):
+        """
+        Check that references to merge and patches apply on top of the
+        checked-out commit, without touching the working directory, so a
+        conflict is found before any work is done. The references are merged
+        in memory in parallel, each on its own. The patches are applied in
+        order to a temporary index, on top of all the references merged
+        together. Writes the output of the first failing check to the merge
+        log.
+
+        Args:
+            merge_refs: A list of lists, each containing a Git URI of a
+                        remote, optionally followed by the remote reference
+                        to merge, "master" if not specified. Must have been
+                        fetched with fetch_git_refs() before.
+            patches:    A list of tuples, each containing a patch name and
+                        either a path to a patch file, or a file object with
+                        the patch or mbox, positioned at the start.
+            workers:    Maximum number of merges to check at once.
+
+        Returns:
+            The name of the first reference (URI and reference, separated by
+            space) or patch failing to apply, or None if all apply.
+
+        Raises:
+            subprocess.CalledProcessError, if a check failed for a reason
+            other than a conflict.
+        """
+        dstrefs = []
+        used = {}
+        for mdesc in merge_refs or []:
+            key = (mdesc[0], mdesc[1] if len(mdesc) > 1 else "master")
+            fetched = self.fetched_refs.get(key, [])
+            if used.get(key, 0) >= len(fetched):
+                raise Exception("%s %s wasn't fetched" % key)
+            dstrefs.append(("%s %s" % key, fetched[used.get(key, 0)][1]))
+            used[key] = used.get(key, 0) + 1
+
+        if dstrefs:
+            logging.info("checking %d references merge", len(dstrefs))
+            pool = ThreadPool(max(1, min(workers, len(dstrefs))))
+            try:
+                results = pool.map(
+                    lambda dstref: self.check_applies(
+                        ["merge-tree", "--write-tree", "HEAD", dstref]
+                    ),
+                    [dstref for (_, dstref) in dstrefs]
+                )
+            finally:
+                pool.close()
+                pool.join()
+
+            for ((name, _), (applies, output)) in zip(dstrefs, results):
+                if not applies:
+                    return self.precheck_failed(name, output)
+
+        if not patches:
+            return None
+
+        # Merge all the references together for the patches to apply to
+        commit = "HEAD"
+        for (name, dstref) in dstrefs:
+            (applies, output) = self.check_applies(
+                ["merge-tree", "--write-tree", commit, dstref]
+            )
+            if not applies:
+                return self.precheck_failed(name, output)
+            (retcode, output) = self.check_cmd(
+                ["-c", "user.name=skt", "-c", "user.email=skt@skt",
+                 "commit-tree", "-m", "skt precheck", "-p", commit,
+                 "-p", dstref, output.split("\n")[0]]
+            )
+            if retcode != 0:
+                raise Exception("Failed to commit merge of %s: %s" %
+                                (name, output))
+            commit = output.strip()
+
+        logging.info("checking %d patches apply", len(patches))
+        tmpdir = tempfile.mkdtemp()
+        env = {'GIT_INDEX_FILE': os.path.join(tmpdir, "index")}
         try:
-            self.git_cmd("remote", "add", rname, uri, stderr=subprocess.PIPE)
-        except subprocess.CalledProcessError:
-            pass
+            (retcode, output) = self.check_cmd(["read-tree", commit],
+                                               env=env)
+            if retcode != 0:
+                raise Exception("Failed to read tree of %s: %s" %
+                                (commit, output))
+            for (name, patch) in patches:
+                if isinstance(patch, basestring):
+                    (applies, output) = self.check_applies(
+                        ["apply", "--cached", patch], env=env
+                    )
+                else:
+                    (applies, output) = self.check_applies(
+                        ["apply", "--cached", "-"], stdin=patch, env=env
+                    )
+                    patch.seek(0)
+                if not applies:
+                    return self.precheck_failed(name, output)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        return None
+
+    def precheck_failed(self, name, output):
+        """
+        Record the output of a failed pre-check in the merge log.
+
+        Args:
+            name:   Name of the item failing to apply.
+            output: Output of the failed check.
+
+        Returns:
+            The name of the item.
+        """
+        logging.warning("pre-check failed: %s doesn't apply", name)
+        with open(self.mergelog, "w") as fileh:
+            fileh.write("%s doesn't apply:\n%s" % (name, output))
 
-        dstref = "refs/remotes/%s/%s" % (rname, ref.split('/')[-1])
-        logging.info("fetching %s", dstref)
-        self.git_cmd("fetch", "-n", rname,
-                     "+%s:%s" % (ref, dstref))
+        return name
+
+    @staticmethod
+    def get_remote_head(uri, ref):
+        """
+        Get the commit a remote reference points to, without fetching it.
+
+        Args:
+            uri:    The Git URI of the remote.
+            ref:    The remote reference, or a full commit hash.
+
+        Returns:
+            The full hash of the commit, or None if the reference wasn't
+            found.
+        """
+        return KernelTree.get_remote_heads(uri, [ref])[ref]
+
+    @staticmethod
+    def get_remote_heads(uri, refs, stats=None):
+        """
+        Get the commits remote references point to, without fetching them,
+        with a single "git ls-remote".
+
+        Args:
+            uri:    The Git URI of the remote.
+            refs:   A list of remote references, or full commit hashes.
+            stats:  The skt.gitstats.GitStats object to record the command
+                    in, or None to not record it.
+
+        Returns:
+            A dictionary of full commit hashes indexed by the references,
+            with None for references which weren't found.
+        """
+        result = {}
+        names = []
+        for ref in refs:
+            if re.match(r'^[0-9a-f]{40}$', ref):
+                result[ref] = ref
+            elif ref not in names:
+                names.append(ref)
+        if not names:
+            return result
+
+        args = ["git", "ls-remote", uri] + names
+        logging.debug("executing: %s", " ".join(args))
+        start = time.time()
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                env=dict(os.environ, **{'LC_ALL': 'C'}))
+        (output, _) = proc.communicate()
+        if stats is not None:
+            stats.record(args, time.time() - start, proc.returncode)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, args)
+
+        heads = dict(reversed(line.split("\t", 1))
+                     for line in output.splitlines())
+        for ref in names:
+            result[ref] = None
+            # Follow the order git uses to resolve short reference names,
+            # and prefer peeled tags
+            for name in [ref, "refs/%s" % ref, "refs/tags/%s" % ref,
+                         "refs/heads/%s" % ref]:
+                for peeled in [name + "^{}", name]:
+                    if result[ref] is None and peeled in heads:
+                        result[ref] = heads[peeled]
+
+        return result
+
+    def get_patch_index(self):
+        """
+        Get the patch ID index of the checked out reference.
+
+        Returns:
+            The skt.patchindex.PatchIdIndex object.
+        """
+        name = hashlib.sha1("%s\0%s" % (self.uri, self.ref)).hexdigest()
+        return skt.patchindex.PatchIdIndex(
+            os.path.join(self.common_gdir, "skt-patch-ids",
+                         "%s.json" % name),
+            self.gdir,
+            stats=self.gitstats
+        )
+
+    def get_maintenance(self, max_age=skt.maintenance.DEFAULT_MAX_AGE):
+        """
+        Get the maintenance bookkeeping of the repository.
+
+        Args:
+            max_age:    Number of seconds a remote or a merge cache entry
+                        can go unused before maintenance removes it.
+
+        Returns:
+            The skt.maintenance.RepoMaintenance object.
+        """
+        return skt.maintenance.RepoMaintenance(self.common_gdir,
+                                               max_age=max_age,
+                                               stats=self.gitstats)
+
+    def find_merged_patches(self, patches):
+        """
+        Find the commits of the checked out reference's recent history
+        containing the same changes as patches, using the patch ID index.
+        Commits indexed before the history was rewritten, which are no
+        longer reachable from the checked out commit, aren't considered
+        merged.
+
+        Args:
+            patches:    A list of tuples, each containing a patch name and
+                        either a path to a patch file, or a file object with
+                        the patch or mbox, positioned at the start.
+
+        Returns:
+            A list of the commits, in order of the patches, if all the
+            patches were found, None otherwise.
+        """
+        if not patches:
+            return None
+
+        files = [open(patch, 'rb') if isinstance(patch, basestring)
+                 else patch for (_, patch) in patches]
+        try:
+            patch_ids = skt.patchindex.get_patch_ids(files, self.gitstats)
+        finally:
+            for ((_, patch), fileh) in zip(patches, files):
+                if fileh is patch:
+                    patch.seek(0)
+                else:
+                    fileh.close()
+        # Patches without changes can't be found
+        if not all(patch_ids):
+            return None
+        patch_ids = sum(patch_ids, [])
+        commits = self.get_patch_index().lookup(patch_ids)
+        if len(commits) != len(patch_ids):
+            return None
+        commits = [commits[patch_id] for patch_id in patch_ids]
+
+        # The index keeps commits dropped by rebases of the branch
+        for commit in set(commits):
+            (retcode, _) = self.check_cmd(["merge-base", "--is-ancestor",
+                                           commit, "HEAD"])
+            if retcode != 0:
+                logging.info("indexed commit %s is no longer merged", commit)
+                return None
+
+        return commits
+
+    def get_merge_cache_key(self, merge_refs, patches, workers=4):
+        """
+        Get the key identifying the result of merging references and applying
+        patches on top of the checked-out commit in the merge cache. Resolves
+        the merge references remotely, without fetching.
+
+        Args:
+            merge_refs: A list of lists, each containing a Git URI of a
+                        remote, optionally followed by the remote reference
+                        to merge, "master" if not specified.
+            patches:    A list of tuples, each containing a patch name and
+                        either a path to a patch file, or a file object with
+                        the patch or mbox, positioned at the start.
+            workers:    Maximum number of remotes to query at once.
+
+        Returns:
+            The key string, or None if a merge reference wasn't found.
+        """
+        mdescs = [(mdesc[0], mdesc[1] if len(mdesc) > 1 else "master")
+                  for mdesc in merge_refs]
+        heads = []
+        if mdescs:
+            pool = ThreadPool(max(1, min(workers, len(mdescs))))
+            try:
+                heads = pool.map(lambda mdesc: self.get_remote_head(*mdesc),
+                                 mdescs)
+            finally:
+                pool.close()
+                pool.join()
+        if None in heads:
+            return None
+        self.merge_cache_heads = heads
+        # Let freshness checks reuse the heads the key was computed for
+        self.remote_heads.update(zip(mdescs, heads))
+
+        digests = []
+        for (_, patch) in patches:
+            digest = hashlib.sha256()
+            fileh = open(patch, 'rb') if isinstance(patch, basestring) \
+                else patch
+            for chunk in iter(lambda: fileh.read(skt.MBOX_CHUNK_SIZE), ''):
+                digest.update(chunk)
+            if fileh is patch:
+                patch.seek(0)
+            else:
+                fileh.close()
+            digests.append(digest.hexdigest())
+
+        return hashlib.sha256(json.dumps([
+            self.get_commit_hash(),
+            [list(mdesc) + [head] for (mdesc, head) in zip(mdescs, heads)],
+            digests
+        ])).hexdigest()
+
+    def load_merge_cache(self, key):
+        """
+        Check out the cached result of a merge, and restore its build
+        information.
+
+        Args:
+            key:    The merge cache key, see get_merge_cache_key().
+
+        Returns:
+            The data stored with the result by save_merge_cache(), or None
+            if the result wasn't cached.
+        """
+        catfile = self.get_catfile()
+        commit = catfile.query("refs/skt/merge-cache/%s^{commit}" % key)
+        blob = catfile.query("refs/skt/merge-cache-info/%s^{blob}" % key)
+        if commit is None or blob is None:
+            logging.info("merge cache miss: %s", key)
+            return None
+
+        logging.info("merge cache hit: %s -> %s", key, commit[0])
+        self.git_cmd("checkout", "-q", "--detach", commit[0])
+        self.git_cmd("reset", "--hard", commit[0])
+        entry = json.loads(blob[2])
+        self.info = [tuple(info) for info in entry['info']]
+
+        return entry['data']
+
+    def save_merge_cache(self, key, data):
+        """
+        Store the checked-out result of a merge and its build information in
+        the merge cache, as references in the repository. Skipped if any of
+        the merge references changed remotely since the key was computed.
+
+        Args:
+            key:    The merge cache key, see get_merge_cache_key().
+            data:   Additional JSON-serializable data to store.
+        """
+        merged = [info[2] for info in self.info if info[0] == "git"]
+        if merged != self.merge_cache_heads:
+            logging.info("merge references changed, not caching the merge")
+            return
+
+        proc = subprocess.Popen(["git", "--git-dir", self.gdir, "hash-object",
+                                 "-w", "--stdin"],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+        # Maintenance ages the entry by its creation time, as the cached
+        # commit can be old, e.g. the base commit itself, with no changes
+        (blob, _) = proc.communicate(json.dumps({'info': self.info,
+                                                 'data': data,
+                                                 'created': int(time.time())}))
+        if proc.returncode != 0:
+            raise Exception("Failed to store merge cache entry %s" % key)
+
+        with self.repo_lock():
+            self.git_cmd("update-ref", "refs/skt/merge-cache-info/%s" % key,
+                         blob.strip())
+            self.git_cmd("update-ref", "refs/skt/merge-cache/%s" % key,
+                         "HEAD")
+        logging.info("merge cached: %s", key)
+
+    def merge_git_ref(self, uri, ref="master"):
+        head = None
+
+        if self.fetched_refs.get((uri, ref)):
+            (rname, dstref) = self.fetched_refs[(uri, ref)].pop(0)
+        else:
+            (rname, dstref) = self.add_merge_remote(uri, ref)
+            if self.check_fresh:
+                self.resolve_remote_heads([(uri, ref)])
+            if self.check_fresh and self.skip_fresh(uri, ref, dstref):
+                self.used_remotes.add(rname)
+            else:
+                logging.info("fetching %s", dstref)
+                self.fetch_ref(rname, uri, ref, dstref)
 
         logging.info("merging %s: %s", rname, ref)
         try:
@@ -258,22 +1373,96 @@ class KernelTree(object):
 
         return (0, head)
 
-    def merge_patchwork_patch(self, uri):
-        patch_content = skt.get_patch_mbox(uri)
+    def merge_patchwork_patch(self, uri, mbox=None):
+        """
+        Apply a patch from Patchwork on top of the checked-out tree. The mbox
+        is streamed to "git am" from a file, so the patch is never held in
+        memory as a whole.
+
+        Args:
+            uri:    Patchwork URL of the patch.
+            mbox:   A file object with the already-downloaded mbox of the
+                    patch, such as returned by skt.download_patch_mbox(), or
+                    None if it should be downloaded from the URL.
+        """
+        if mbox is None:
+            mbox = skt.download_patch_mbox(uri)
+        mbox.seek(0)
+        # Read the name first, as "git am" leaves the file at its end
+        patchname = skt.read_patch_name(mbox)
 
         logging.info("Applying %s", uri)
+        self.apply_mbox(mbox, uri)
+
+        self.info.append(("patchwork", uri, patchname))
+
+    def merge_patchwork_series(self, uri, mbox=None):
+        """
+        Apply a whole series from Patchwork on top of the checked-out tree,
+        downloading the series mbox and running "git am" only once.
+
+        Args:
+            uri:    Patchwork URL of the series, e.g.
+                    "https://patchwork.example.com/series/123/".
+            mbox:   A file object with the already-downloaded mbox of the
+                    series, such as returned by skt.download_patch_mbox(), or
+                    None if it should be downloaded from the URL.
+
+        Returns:
+            A list of Patchwork URLs of the applied patches, in order. The
+            series URL is used for patches without an "X-Patchwork-Id"
+            header.
+        """
+        if mbox is None:
+            mbox = skt.download_patch_mbox(uri)
+        mbox.seek(0)
+
+        logging.info("Applying series %s", uri)
+        self.apply_mbox(mbox, uri)
+
+        mbox.seek(0)
+        patch_uris = []
+        for headers in skt.read_mbox_headers(mbox):
+            patch_uri = uri
+            if headers['X-Patchwork-Id']:
+                patch_uri = re.sub(r'series/\d+/?$',
+                                   'patch/%s/' %
+                                   headers['X-Patchwork-Id'].strip(),
+                                   uri)
+            patchname = skt.decode_patch_subject(headers['Subject'])
+            self.info.append(("patchwork", patch_uri, patchname))
+            patch_uris.append(patch_uri)
+
+        return patch_uris
+
+    def apply_mbox(self, mbox, uri):
+        """
+        Apply patches from an mbox file with "git am", writing the output
+        to the merge log and aborting the application on failure.
+
+        Args:
+            mbox:   A file object containing the mbox, positioned at the
+                    start. Passed to "git am" as its standard input.
+            uri:    URL the mbox was retrieved from, used in the error
+                    message.
 
+        Raises:
+            Exception if the patches failed to apply.
+        """
+        args = ["git", "am", "-"]
+        start = time.time()
         gam = subprocess.Popen(
-            ["git", "am", "-"],
+            args,
             cwd=self.wdir,
-            stdin=subprocess.PIPE,
+            stdin=mbox,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             env=dict(os.environ, **{'LC_ALL': 'C'})
         )
 
-        (stdout, _) = gam.communicate(patch_content)
+        (stdout, _) = gam.communicate()
         retcode = gam.wait()
+        self.gitstats.record(args, time.time() - start, retcode)
 
         if retcode != 0:
             self.git_cmd("am", "--abort")
@@ -284,21 +1473,18 @@ class KernelTree(object):
             raise Exception("Failed to apply patch %s" %
                             os.path.basename(os.path.normpath(uri)))
 
-        patchname = skt.get_patch_name(patch_content)
-        # FIXME Do proper CSV escaping, or switch data format instead of
-        #       maiming subjects (ha-ha). See issue #119.
-        # Replace commas with semicolons to avoid clashes with CSV separator
-        self.info.append(("patchwork", uri, patchname.replace(',', ';')))
-
     def merge_patch_file(self, path):
         if not os.path.exists(path):
             raise Exception("Patch %s not found" % path)
         args = ["git", "am", path]
+        start = time.time()
         try:
             subprocess.check_output(args,
                                     cwd=self.wdir,
                                     env=dict(os.environ, **{'LC_ALL': 'C'}))
+            self.gitstats.record(args, time.time() - start, 0)
         except subprocess.CalledProcessError as exc:
+            self.gitstats.record(args, time.time() - start, exc.returncode)
             self.git_cmd("am", "--abort")
 
             with open(self.mergelog, "w") as fileh:
@@ -0,0 +1,417 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Maintenance of long-lived repositories used by many skt runs"""
+import glob
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+import skt
+import skt.gitstats
+
+# Default number of seconds a remote can go unused before it's removed
+DEFAULT_MAX_AGE = 14 * 24 * 60 * 60
+
+# Subcommands whose timings are compared before and after maintenance
+TIMED_COMMANDS = ["fetch", "merge"]
+
+
+def get_incremental_batch_size(packdir):
+    """
+    Get the batch size for an incremental repack of a pack directory: one
+    byte more than the second largest pack, so the small packs accumulated
+    since the largest one (e.g. from the initial clone) get combined, without
+    rewriting the largest one.
+
+    Args:
+        packdir:    Path to the pack directory.
+
+    Returns:
+        The batch size in bytes, or None if there are less than two packs.
+    """
+    sizes = sorted(os.path.getsize(path)
+                   for path in glob.glob(os.path.join(packdir, "*.pack")))
+    if len(sizes) < 2:
+        return None
+    return sizes[-2] + 1
+
+
+class RepoMaintenance(object):
+    """
+    RepoMaintenance - bookkeeping and maintenance of a repository reused by
+    many skt runs, e.g. a working directory from a pool, or a worktree
+    repository. Runs record the remotes they used, and the timings of their
+    fetches and merges. Maintenance removes remotes unused for a while, and
+    stale skt references, and optimizes the object storage. Safe for use by
+    concurrent skt processes.
+    """
+
+    def __init__(self, gdir, max_age=DEFAULT_MAX_AGE, stats=None):
+        """
+        Initialize repository maintenance. The bookkeeping file is created
+        on the first recorded run.
+
+        Args:
+            gdir:       The git repository to maintain.
+            max_age:    Number of seconds a remote or a merge cache entry
+                        can go unused before it's removed.
+            stats:      The skt.gitstats.GitStats object to record executed
+                        git commands into, or None to create a new one.
+        """
+        self.gdir = gdir
+        self.max_age = max_age
+        self.path = os.path.join(gdir, "skt-maintenance.json")
+        self.lockpath = "%s.lock" % self.path
+        # Statistics of executed git commands
+        self.stats = stats if stats is not None else skt.gitstats.GitStats()
+
+    def git_cmd(self, *args):
+        args = list(["git", "--git-dir", self.gdir]) + list(args)
+        logging.debug("executing: %s", " ".join(args))
+        self.stats.check_call(args, env=dict(os.environ, **{'LC_ALL': 'C'}))
+
+    def git_output(self, *args, **kwargs):
+        """
+        Execute a git command and return its output.
+
+        Args:
+            args:   Arguments of the git command.
+            gdir:   The git directory to execute the command in, e.g. the
+                    administrative directory of a worktree, the maintained
+                    repository if not specified.
+
+        Returns:
+            The command output string.
+        """
+        args = list(["git", "--git-dir", kwargs.get('gdir') or self.gdir]) + \
+            list(args)
+        logging.debug("executing: %s", " ".join(args))
+        return subprocess.check_output(args,
+                                       env=dict(os.environ, **{'LC_ALL': 'C'}))
+
+    def load(self):
+        """
+        Load the bookkeeping data.
+
+        Returns:
+            The bookkeeping dictionary, with the number of runs since the
+            last maintenance under "runs", the last use time of remotes,
+            indexed by name, under "remotes", and the total count and
+            seconds of timed git commands per subcommand, recorded since the
+            last maintenance, and between the two last maintenances, under
+            "after" and "before" respectively.
+        """
+        try:
+            with open(self.path, 'r') as fileh:
+                return json.load(fileh)
+        except (IOError, ValueError):
+            return {'runs': 0, 'remotes': {}, 'after': {}, 'before': {}}
+
+    def save(self, data):
+        """
+        Atomically write the bookkeeping data.
+
+        Args:
+            data:   The bookkeeping dictionary, see load().
+        """
+        (fd, tmppath) = tempfile.mkstemp(dir=self.gdir)
+        try:
+            with os.fdopen(fd, 'w') as fileh:
+                json.dump(data, fileh)
+            os.rename(tmppath, self.path)
+        except Exception:
+            os.unlink(tmppath)
+            raise
+
+    def record_run(self, remotes, summary):
+        """
+        Record a run using the repository.
+
+        Args:
+            remotes:    The names of the remotes the run fetched from.
+            summary:    The per-subcommand summary of the git commands the
+                        run executed, see skt.gitstats.GitStats.get_summary().
+        """
+        now = int(time.time())
+        with skt.file_lock(self.lockpath):
+            data = self.load()
+            data['runs'] += 1
+            for remote in remotes:
+                data['remotes'][remote] = now
+            for command in TIMED_COMMANDS:
+                if command not in summary:
+                    continue
+                timing = data['after'].setdefault(command,
+                                                  {'count': 0, 'seconds': 0})
+                timing['count'] += summary[command]['count']
+                timing['seconds'] += summary[command]['seconds']
+            self.save(data)
+
+    def is_due(self, interval):
+        """
+        Check if maintenance is due.
+
+        Args:
+            interval:   The number of runs between maintenances.
+
+        Returns:
+            True if at least the specified number of runs was recorded since
+            the last maintenance.
+        """
+        return self.load()['runs'] >= interval
+
+    def prune_remotes(self, remote_times):
+        """
+        Remove remotes not used for longer than the maximum age, along with
+        their remote-tracking references, and remote-tracking references
+        left behind by removed remotes. Remotes not known yet are considered
+        used now.
+
+        Args:
+            remote_times:   A dictionary of last use times of remotes,
+                            indexed by name. Updated with the remotes not
+                            known yet, and stripped of the removed and the
+                            missing ones.
+
+        Returns:
+            The list of names of the removed and the missing remotes.
+        """
+        now = int(time.time())
+        remotes = set()
+        try:
+            output = self.git_output("config", "--get-regexp",
+                                     r"^remote\..*\.url$")
+        except subprocess.CalledProcessError:
+            # Exits with 1 if there are no remotes
+            output = ""
+        for line in output.splitlines():
+            remotes.add(line.split(" ", 1)[0][len("remote."):-len(".url")])
+
+        for remote in sorted(remotes):
+            used = remote_times.setdefault(remote, now)
+            if now - used > self.max_age:
+                logging.info("removing remote %s, unused since %s", remote,
+                             time.ctime(used))
+                self.git_cmd("remote", "remove", remote)
+                remotes.remove(remote)
+
+        removed = [remote for remote in remote_times if remote not in remotes]
+        for remote in removed:
+            del remote_times[remote]
+
+        stale = [ref for ref in self.git_output(
+            "for-each-ref", "--format=%(refname)", "refs/remotes/",
+            "refs/worktree/remotes/"
+        ).splitlines() if re.sub(r'^refs/(worktree/)?remotes/', '',
+                                 ref).split('/')[0] not in remotes]
+        self.delete_refs(stale)
+
+        # Worktrees keep their remote-tracking references private, visible
+        # only in their administrative directories
+        for wgdir in self.get_worktree_gdirs():
+            stale = [ref for ref in self.git_output(
+                "for-each-ref", "--format=%(refname)",
+                "refs/worktree/remotes/", gdir=wgdir
+            ).splitlines() if ref.split('/')[3] not in remotes]
+            self.delete_refs(stale, wgdir)
+
+        return removed
+
+    def get_worktree_gdirs(self):
+        """
+        Get the administrative directories of the linked worktrees of the
+        repository.
+
+        Returns:
+            A sorted list of paths to the directories.
+        """
+        return sorted(path for path in
+                      glob.glob(os.path.join(self.gdir, "worktrees", "*"))
+                      if os.path.isdir(path))
+
+    def read_blobs(self, objects):
+        """
+        Read the contents of objects, with a single git command.
+
+        Args:
+            objects:    The list of names of the objects to read.
+
+        Returns:
+            The list of the contents strings, in order of the names.
+        """
+        if not objects:
+            return []
+
+        args = ["git", "--git-dir", self.gdir, "cat-file", "--batch"]
+        logging.debug("executing: %s", " ".join(args))
+        start = time.time()
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                env=dict(os.environ, **{'LC_ALL': 'C'}))
+        (output, _) = proc.communicate("".join("%s\n" % name
+                                               for name in objects))
+        self.stats.record(args, time.time() - start, proc.returncode)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, args)
+
+        contents = []
+        pos = 0
+        for _ in objects:
+            end = output.index("\n", pos)
+            # Each object is "<name> <type> <size>" and the contents
+            size = int(output[pos:end].split(" ")[2])
+            contents.append(output[end + 1:end + 1 + size])
+            pos = end + 1 + size + 1
+        return contents
+
+    def prune_merge_cache(self):
+        """
+        Remove merge cache entries created longer than the maximum age ago.
+        Entries stored without their creation time are aged by the committer
+        date of the cached commit instead.
+        """
+        deadline = int(time.time()) - self.max_age
+        created = {}
+        for line in self.git_output(
+                "for-each-ref", "--format=%(committerdate:unix) %(refname)",
+                "refs/skt/merge-cache/"
+        ).splitlines():
+            (date, ref) = line.split(" ", 1)
+            created[ref.split('/')[-1]] = int(date)
+
+        infos = [line.split(" ", 1) for line in self.git_output(
+            "for-each-ref", "--format=%(objectname) %(refname)",
+            "refs/skt/merge-cache-info/"
+        ).splitlines()]
+        for ((_, ref), content) in zip(
+                infos, self.read_blobs([name for (name, _) in infos])
+        ):
+            key = ref.split('/')[-1]
+            try:
+                date = json.loads(content).get('created')
+            except ValueError:
+                date = None
+            if key in created and date is not None:
+                created[key] = date
+
+        stale = []
+        for (key, date) in sorted(created.items()):
+            if date < deadline:
+                stale.extend(["refs/skt/merge-cache/%s" % key,
+                              "refs/skt/merge-cache-info/%s" % key])
+        self.delete_refs(stale)
+
+    def delete_refs(self, refs, gdir=None):
+        """
+        Delete references, with a single git command.
+
+        Args:
+            refs:   The list of full reference names to delete.
+            gdir:   The git directory to delete the references in, e.g. the
+                    administrative directory of a worktree, the maintained
+                    repository if not specified.
+        """
+        if not refs:
+            return
+
+        logging.info("deleting %d stale references", len(refs))
+        args = ["git", "--git-dir", gdir or self.gdir, "update-ref",
+                "--stdin"]
+        logging.debug("executing: %s", " ".join(args))
+        start = time.time()
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                env=dict(os.environ, **{'LC_ALL': 'C'}))
+        proc.communicate("".join("delete %s\n" % ref for ref in refs))
+        self.stats.record(args, time.time() - start, proc.returncode)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, args)
+
+    def optimize(self):
+        """
+        Optimize the object storage incrementally: pack loose objects,
+        combine small packs under a multi-pack-index, and write the commit
+        graph for the new commits. Never removes unreachable objects, as
+        other repositories might borrow them.
+        """
+        self.git_cmd("pack-refs", "--all")
+        # Pack only local loose objects, e.g. left by "git am", without
+        # touching existing packs
+        self.git_cmd("repack", "-d", "-l", "-q")
+        self.git_cmd("multi-pack-index", "write")
+        # Remove the packs a previous repack made redundant
+        self.git_cmd("multi-pack-index", "expire")
+        batch_size = get_incremental_batch_size(
+            os.path.join(self.gdir, "objects", "pack")
+        )
+        if batch_size is not None:
+            self.git_cmd("multi-pack-index", "repack",
+                         "--batch-size=%d" % batch_size)
+        self.git_cmd("commit-graph", "write", "--reachable", "--split")
+
+    def log_timings(self, data):
+        """
+        Log the average duration of timed git commands recorded before and
+        after the previous maintenance.
+
+        Args:
+            data:   The bookkeeping dictionary, see load().
+        """
+        for command in TIMED_COMMANDS:
+            averages = []
+            for window in ['before', 'after']:
+                timing = data[window].get(command)
+                if timing and timing['count']:
+                    averages.append("%.3fs" %
+                                    (timing['seconds'] / timing['count']))
+                else:
+                    averages.append("unknown")
+            logging.info("git %s average before previous maintenance: %s, "
+                         "after: %s", command, averages[0], averages[1])
+
+    def run(self):
+        """
+        Maintain the repository: remove unused remotes and stale references,
+        and optimize the object storage. Start counting runs and recording
+        timings anew. Runs can be recorded meanwhile, only maintenances are
+        serialized.
+        """
+        logging.info("maintaining repository %s", self.gdir)
+        start = time.time()
+        with skt.file_lock("%s.run.lock" % self.path):
+            data = self.load()
+            self.log_timings(data)
+            remote_times = dict(data['remotes'])
+            removed = self.prune_remotes(remote_times)
+            self.prune_merge_cache()
+            self.optimize()
+
+            with skt.file_lock(self.lockpath):
+                current = self.load()
+                current['runs'] = max(0, current['runs'] - data['runs'])
+                for (remote, used) in remote_times.items():
+                    current['remotes'].setdefault(remote, used)
+                for remote in removed:
+                    # Keep remotes added again and used meanwhile
+                    if current['remotes'].get(remote, 0) < start:
+                        current['remotes'].pop(remote, None)
+                current['before'] = data['after']
+                current['after'] = {}
+                self.save(current)
+
+        logging.info("maintained repository %s in %.3fs", self.gdir,
+                     time.time() - start)
@@ -0,0 +1,128 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""
+Build manifest: a single gzip-compressed JSON document describing a build,
+published along with the kernel tarball.
+
+The manifest is a JSON object with the following members, all optional
+except "version":
+
+    version:    Manifest format version, currently 1.
+    buildinfo:  List of build information entries, each a list starting
+                with the entry type, see KernelTree.info.
+    config:     Text of the kernel configuration the kernel was built with.
+    krelease:   Kernel release string of the build.
+    checksums:  Object with SHA256 hex digests of the published artifacts,
+                indexed by their file names.
+"""
+import gzip
+import hashlib
+import json
+import os
+import StringIO
+import tempfile
+
+# Current manifest format version
+VERSION = 1
+
+
+def checksum(path):
+    """
+    Calculate the SHA256 checksum of a file.
+
+    Args:
+        path:   Path to the file.
+
+    Returns:
+        The SHA256 hex digest string of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fileh:
+        for chunk in iter(lambda: fileh.read(64 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def loads(data):
+    """
+    Load a manifest from its compressed representation.
+
+    Args:
+        data:   The gzip-compressed manifest string.
+
+    Returns:
+        The manifest dictionary.
+
+    Raises:
+        Exception if the manifest version is not supported.
+    """
+    with gzip.GzipFile(fileobj=StringIO.StringIO(data), mode='rb') as fileh:
+        manifest = json.load(fileh)
+
+    if manifest.get('version') != VERSION:
+        raise Exception("Unsupported manifest version: %s" %
+                        manifest.get('version'))
+
+    return manifest
+
+
+def read(path):
+    """
+    Read a manifest from a file.
+
+    Args:
+        path:   Path to the manifest file.
+
+    Returns:
+        The manifest dictionary.
+    """
+    with open(path, 'rb') as fileh:
+        return loads(fileh.read())
+
+
+def write(path, manifest):
+    """
+    Atomically write a manifest to a file.
+
+    Args:
+        path:       Path to the manifest file.
+        manifest:   The manifest dictionary, without the version.
+    """
+    manifest = dict(manifest, version=VERSION)
+    (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as fileh:
+            with gzip.GzipFile(fileobj=fileh, mode='wb') as gzfileh:
+                json.dump(manifest, gzfileh, sort_keys=True)
+        # Make the manifest as readable as other published files
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmppath, 0o666 & ~umask)
+        os.rename(tmppath, path)
+    except Exception:
+        os.unlink(tmppath)
+        raise
+
+
+def update(path, **kwargs):
+    """
+    Update members of a manifest stored in a file.
+
+    Args:
+        path:   Path to the manifest file.
+        kwargs: Manifest members to set.
+    """
+    manifest = read(path)
+    manifest.update(kwargs)
+    write(path, manifest)
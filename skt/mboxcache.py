@@ -0,0 +1,272 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Persistent on-disk cache for Patchwork mbox downloads"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import requests
+
+import skt
+import skt.httpsession
+
+
+class MboxCache(object):
+    """
+    A content-addressed disk cache of mbox downloads, keyed by URL.
+
+    The cache directory contains two subdirectories: "objects", holding
+    downloaded bodies named by the SHA256 of their content, and "index",
+    holding one JSON entry per URL, named by the SHA256 of the URL. An entry
+    records the object the URL resolved to and the validators (ETag and
+    Last-Modified) the server sent with it. The modification time of an index
+    entry is its last access time, and is used for LRU eviction. The "lock"
+    file serializes adding and evicting objects between processes.
+    """
+
+    # Size of chunks to read HTTP responses and files in, bytes
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, cachedir, max_size=256 * 1024 * 1024):
+        """
+        Initialize an mbox cache.
+
+        Args:
+            cachedir:   Directory to store the cache in. Created if missing.
+            max_size:   Maximum total size of cached bodies, in bytes. Least
+                        recently used entries are evicted past this size.
+        """
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self.objdir = os.path.join(cachedir, "objects")
+        self.idxdir = os.path.join(cachedir, "index")
+        self.lockpath = os.path.join(cachedir, "lock")
+        # Requests answered from the cache, including revalidated ones
+        self.hits = 0
+        # Requests which had to download the body
+        self.misses = 0
+
+        for path in [self.objdir, self.idxdir]:
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+
+    def get_stats(self):
+        """
+        Get cache hit/miss counters.
+
+        Returns:
+            A dictionary with "hits" and "misses" counts.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _idxpath(self, url):
+        return os.path.join(self.idxdir,
+                            hashlib.sha256(url).hexdigest() + ".json")
+
+    def _objpath(self, digest):
+        return os.path.join(self.objdir, digest)
+
+    def _read_entry(self, url):
+        """
+        Read the index entry for a URL.
+
+        Returns:
+            The entry dictionary, or None if there is no usable entry.
+        """
+        try:
+            with open(self._idxpath(url), 'r') as fileh:
+                entry = json.load(fileh)
+        except (IOError, ValueError):
+            return None
+
+        if entry.get('url') != url or \
+                not os.path.isfile(self._objpath(entry.get('digest'))):
+            return None
+
+        return entry
+
+    def _write_entry(self, url, entry):
+        """Atomically write the index entry for a URL."""
+        (fd, tmppath) = tempfile.mkstemp(dir=self.idxdir)
+        with os.fdopen(fd, 'w') as fileh:
+            json.dump(entry, fileh)
+        os.rename(tmppath, self._idxpath(url))
+
+    def _store(self, response):
+        """
+        Stream a response body into a temporary file in the object store.
+        The temporary file name is never a valid digest, so eviction leaves
+        it alone.
+
+        Args:
+            response:   A streamed requests response with the body.
+
+        Returns:
+            A tuple of the temporary file path, the SHA256 hex digest and the
+            size of the body.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        (fd, tmppath) = tempfile.mkstemp(dir=self.objdir)
+        try:
+            with os.fdopen(fd, 'wb') as fileh:
+                for chunk in response.iter_content(self.CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    fileh.write(chunk)
+        except Exception:
+            os.unlink(tmppath)
+            raise
+
+        return (tmppath, digest.hexdigest(), size)
+
+    def fetch(self, url):
+        """
+        Make sure the body of a URL is cached and fresh, revalidating a cached
+        copy with the server, or downloading the body, if not cached.
+
+        Args:
+            url:    The URL to fetch.
+
+        Returns:
+            A file object open for reading the body, positioned at the start.
+            The body stays readable through it even if it's evicted later.
+
+        Raises:
+            Exception if the server responded with an unexpected status.
+        """
+        entry = self._read_entry(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = skt.httpsession.get(url, headers=headers, stream=True)
+        try:
+            if entry and response.status_code == requests.codes.not_modified:
+                with self.lock():
+                    try:
+                        fileh = open(self._objpath(entry['digest']), 'rb')
+                    except IOError:
+                        fileh = None
+                    else:
+                        # Bump the access time used for LRU eviction
+                        os.utime(self._idxpath(url), None)
+                if fileh is None:
+                    # Evicted since the entry was read, download it again
+                    logging.debug("mbox cache entry evicted: %s", url)
+                    response.close()
+                    return self.fetch(url)
+                logging.debug("mbox cache hit: %s", url)
+                self.hits += 1
+                return fileh
+
+            if response.status_code != requests.codes.ok:
+                raise Exception('Failed to retrieve %s, returned %d' %
+                                (url, response.status_code))
+
+            logging.debug("mbox cache miss: %s", url)
+            self.misses += 1
+            (tmppath, digest, size) = self._store(response)
+        finally:
+            response.close()
+
+        # Publish the body and its entry and open it before any eviction
+        # can consider it unreferenced
+        with self.lock():
+            os.rename(tmppath, self._objpath(digest))
+            self._write_entry(url, {
+                'url': url,
+                'digest': digest,
+                'size': size,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            })
+            fileh = open(self._objpath(digest), 'rb')
+            self._evict()
+
+        return fileh
+
+    def get(self, url):
+        """
+        Get the body of a URL, using the cache.
+
+        Args:
+            url:    The URL to fetch.
+
+        Returns:
+            String containing the body.
+        """
+        with self.fetch(url) as fileh:
+            return fileh.read()
+
+    def lock(self):
+        """
+        Get a context manager holding an exclusive lock on the cache, shared
+        with other processes and threads. Objects are only added to, and
+        removed from the store with the lock held.
+        """
+        return skt.file_lock(self.lockpath)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the total size of cached
+        bodies is within the limit, and remove bodies no longer referenced.
+        """
+        with self.lock():
+            self._evict()
+
+    def _evict(self):
+        """Evict entries and bodies, with the lock held. See evict()."""
+        entries = []
+        for name in os.listdir(self.idxdir):
+            path = os.path.join(self.idxdir, name)
+            try:
+                with open(path, 'r') as fileh:
+                    entry = json.load(fileh)
+                entries.append((os.path.getmtime(path), path, entry))
+            except (IOError, OSError, ValueError):
+                continue
+
+        # Most recently used first
+        entries.sort(reverse=True)
+        referenced = set()
+        total = 0
+        for (_, path, entry) in entries:
+            if entry['digest'] not in referenced:
+                if total + entry['size'] > self.max_size and referenced:
+                    logging.debug("mbox cache evicting %s", entry['url'])
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                    continue
+                total += entry['size']
+            referenced.add(entry['digest'])
+
+        for name in os.listdir(self.objdir):
+            # Skip unreferenced bodies and in-progress downloads alike, as
+            # temporary files are never valid digests.
+            if name not in referenced and len(name) == 64:
+                try:
+                    os.unlink(self._objpath(name))
+                except OSError:
+                    pass
@@ -0,0 +1,164 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Class for managing shared local mirrors of remote git repositories"""
+import hashlib
+import logging
+import os
+import re
+
+import skt
+import skt.gitstats
+
+
+class GitMirror(object):
+    """
+    GitMirror - a bare repository under a shared mirror directory, holding
+    objects of a single upstream repository for working directories to
+    borrow via git alternates. Safe for use by concurrent skt processes.
+    """
+
+    def __init__(self, mirrordir, uri, stats=None):
+        """
+        Initialize a GitMirror. The repository is created on first update.
+
+        Args:
+            mirrordir:  The directory housing all the mirrors.
+            uri:        The Git URI of the upstream repository.
+            stats:      The skt.gitstats.GitStats object to record executed
+                        git commands into, or None to create a new one.
+        """
+        self.uri = uri
+        # Statistics of executed git commands
+        self.stats = stats if stats is not None else skt.gitstats.GitStats()
+        # Name the mirror after the repository for readability, and after
+        # the URI hash for uniqueness
+        name = re.sub(r'[^\w.-]', '_',
+                      uri.rstrip('/').split('/')[-1].replace('.git', ''))
+        self.path = os.path.join(
+            mirrordir,
+            "%s-%s.git" % (name, hashlib.sha1(uri).hexdigest()[:12])
+        )
+        # The object directory to add to alternates of working directories
+        self.objdir = os.path.join(self.path, "objects")
+        self.lockpath = "%s.lock" % self.path
+
+        try:
+            os.makedirs(mirrordir)
+        except OSError:
+            if not os.path.isdir(mirrordir):
+                raise
+
+    def git_cmd(self, *args, **kwargs):
+        args = list(["git", "--git-dir", self.path]) + list(args)
+        logging.debug("executing: %s", " ".join(args))
+        self.stats.check_call(args,
+                              env=dict(os.environ, **{'LC_ALL': 'C'}),
+                              **kwargs)
+
+    def lock(self):
+        """
+        Get a context manager holding an exclusive lock on the mirror, shared
+        with other processes.
+        """
+        return skt.file_lock(self.lockpath)
+
+    def init(self):
+        """
+        Create the bare repository, if it doesn't exist yet. Must be called
+        with the lock held.
+        """
+        if os.path.isdir(self.objdir):
+            return
+
+        logging.info("creating mirror of %s in %s", self.uri, self.path)
+        self.git_cmd("init", "-q", "--bare")
+        # Only set the URL, without the default fetch refspec, so only
+        # requested references are fetched and stored
+        self.git_cmd("config", "remote.origin.url", self.uri)
+        # Working directories borrow objects from the mirror, so objects
+        # must never be removed from it, even if they become unreachable.
+        self.git_cmd("config", "gc.auto", "0")
+        self.git_cmd("config", "gc.pruneExpire", "never")
+
+    @staticmethod
+    def get_mirror_ref(ref):
+        """
+        Get the name of the mirror reference holding an upstream reference.
+
+        Args:
+            ref:    The upstream reference (or commit hash).
+
+        Returns:
+            The full name of the mirror reference.
+        """
+        return "refs/mirror/%s" % ref
+
+    def update(self, ref, depth=None, fetch_filter=None):
+        """
+        Fetch a reference from upstream into the mirror.
+
+        Args:
+            ref:            The upstream reference (or commit hash) to fetch.
+            depth:          The amount of git history to fetch, or None for
+                            all.
+            fetch_filter:   The git object filter to fetch with, making the
+                            mirror a partial clone, or None to fetch all
+                            objects.
+
+        Returns:
+            The name of the mirror reference the upstream one was fetched
+            to, see get_mirror_ref().
+        """
+        mref = self.get_mirror_ref(ref)
+        args = ["fetch", "-n", "origin", "+%s:%s" % (ref, mref)]
+        if depth:
+            args.extend(["--depth", str(depth)])
+        if fetch_filter:
+            args.append("--filter=%s" % fetch_filter)
+
+        with self.lock():
+            self.init()
+            logging.info("updating mirror of %s: %s", self.uri, ref)
+            self.git_cmd(*args)
+
+        return mref
+
+    def sync(self, refs):
+        """
+        Fetch references from upstream into the mirror with their complete
+        history, using a single fetch. Meant to keep the mirror fresh outside
+        of the critical path, so updates by update() only need small deltas.
+        Completes the history of a mirror made shallow by update().
+
+        Args:
+            refs:   The list of upstream references (or commit hashes) to
+                    fetch.
+
+        Returns:
+            The list of mirror references the upstream ones were fetched to,
+            see get_mirror_ref().
+        """
+        mrefs = [self.get_mirror_ref(ref) for ref in refs]
+        args = ["fetch", "-n", "origin"] + \
+            ["+%s:%s" % (ref, mref) for (ref, mref) in zip(refs, mrefs)]
+
+        with self.lock():
+            self.init()
+            if os.path.isfile(os.path.join(self.path, "shallow")):
+                args.append("--unshallow")
+            logging.info("syncing mirror of %s: %s", self.uri,
+                         " ".join(refs))
+            self.git_cmd(*args)
+
+        return mrefs
@@ -0,0 +1,266 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Index of patch IDs of recent history, to find patches merged already"""
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+import skt
+import skt.gitstats
+
+# Default number of most recent commits to index
+DEFAULT_SIZE = 10000
+
+# Number of previously indexed heads to remember, limiting the history
+# walked by updates
+TIPS = 16
+
+
+def patch_id_cmd(args, stdin, stats):
+    """
+    Execute "git patch-id --stable" over a stream of patches.
+
+    Args:
+        args:   The command line producing the patches on its standard
+                output, or None to read the patches from the stdin file.
+        stdin:  The file object with patches to read, positioned at the
+                start, if args is None.
+        stats:  The skt.gitstats.GitStats object to record the commands in.
+
+    Returns:
+        A list of (patch ID, commit) tuples, in order of the patches. The
+        commit is the hash from the "commit <hash>" line preceding each
+        patch.
+    """
+    env = dict(os.environ, **{'LC_ALL': 'C'})
+    producer = None
+    start = time.time()
+    if args is not None:
+        logging.debug("executing: %s", " ".join(args))
+        producer = subprocess.Popen(args, stdout=subprocess.PIPE, env=env)
+    pid_args = ["git", "patch-id", "--stable"]
+    proc = subprocess.Popen(
+        pid_args,
+        stdin=producer.stdout if producer else stdin,
+        stdout=subprocess.PIPE,
+        env=env
+    )
+    if producer:
+        # Let the producer get SIGPIPE if patch-id exits early
+        producer.stdout.close()
+    (output, _) = proc.communicate()
+    seconds = time.time() - start
+
+    if producer:
+        stats.record(args, seconds, producer.wait())
+        if producer.returncode != 0:
+            raise subprocess.CalledProcessError(producer.returncode, args)
+    stats.record(pid_args, seconds, proc.returncode)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, pid_args)
+
+    return [tuple(line.split()) for line in output.splitlines()]
+
+
+def get_patch_ids(patches, stats=None):
+    """
+    Get the stable patch IDs of patches, streaming them to "git patch-id"
+    through a temporary file, line by line.
+
+    Args:
+        patches:    A list of file objects, each containing a patch, or an
+                    mbox with one or more patches, e.g. a Patchwork series,
+                    positioned at the start. They're read to the end.
+        stats:      The skt.gitstats.GitStats object to record the commands
+                    in, or None to not record them.
+
+    Returns:
+        A list with a list of patch IDs for each file, in order of the
+        patches. Messages without changes, e.g. cover letters, have none.
+    """
+    stats = stats if stats is not None else skt.gitstats.GitStats()
+    # Replace the "From " line of each message with a numbered "commit"
+    # line, which patch-id uses to tell patches apart, and reports along
+    # with their IDs
+    messages = []
+    with tempfile.TemporaryFile() as stream:
+        for (index, fileh) in enumerate(patches):
+            stream.write("commit %040x\n" % len(messages))
+            messages.append(index)
+            # The empty line preceding a "From " line separates messages
+            separator = None
+            line = None
+            for (number, line) in enumerate(fileh):
+                if line.startswith("From ") and \
+                        (number == 0 or separator is not None):
+                    if number > 0:
+                        stream.write("commit %040x\n" % len(messages))
+                        messages.append(index)
+                    separator = None
+                    continue
+                if separator is not None:
+                    stream.write(separator)
+                separator = line if line in ("\n", "\r\n") else None
+                if separator is None:
+                    stream.write(line)
+            if separator is not None:
+                stream.write(separator)
+            if line is not None and not line.endswith("\n"):
+                stream.write("\n")
+        stream.seek(0)
+        output = patch_id_cmd(None, stream, stats)
+
+    patch_ids = [[] for _ in patches]
+    for (patch_id, commit) in output:
+        patch_ids[messages[int(commit, 16)]].append(patch_id)
+
+    return patch_ids
+
+
+class PatchIdIndex(object):
+    """
+    PatchIdIndex - a file mapping stable patch IDs of the most recent
+    non-merge commits of a branch to the commits, updated incrementally with
+    each new head of the branch. Safe for use by concurrent skt processes.
+    """
+
+    def __init__(self, path, gdir, size=DEFAULT_SIZE, stats=None):
+        """
+        Initialize a patch ID index. The index file is created on first
+        update.
+
+        Args:
+            path:   The path to the index file.
+            gdir:   The git repository containing the indexed commits.
+            size:   The maximum number of commits to index.
+            stats:  The skt.gitstats.GitStats object to record executed git
+                    commands into, or None to create a new one.
+        """
+        self.path = path
+        self.gdir = gdir
+        self.size = size
+        self.lockpath = "%s.lock" % path
+        # Statistics of executed git commands
+        self.stats = stats if stats is not None else skt.gitstats.GitStats()
+
+    def load(self):
+        """
+        Load the index.
+
+        Returns:
+            The index dictionary, with the list of the most recently indexed
+            heads under "tips", and the list of (patch ID, commit) lists,
+            oldest first, under "patches".
+        """
+        try:
+            with open(self.path, 'r') as fileh:
+                return json.load(fileh)
+        except (IOError, ValueError):
+            return {'tips': [], 'patches': []}
+
+    def save(self, index):
+        """
+        Atomically write the index.
+
+        Args:
+            index:  The index dictionary, see load().
+        """
+        (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'w') as fileh:
+                json.dump(index, fileh)
+            os.rename(tmppath, self.path)
+        except Exception:
+            os.unlink(tmppath)
+            raise
+
+    def is_partial(self):
+        """
+        Check if the repository is a partial clone, which would have to
+        download the missing blobs of all the indexed commits.
+
+        Returns:
+            True if the repository has a promisor remote.
+        """
+        args = ["git", "--git-dir", self.gdir, "config", "--get-regexp",
+                r"^(extensions\.partialclone|remote\..*\.promisor)$"]
+        logging.debug("executing: %s", " ".join(args))
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                env=dict(os.environ, **{'LC_ALL': 'C'}))
+        (stdout, _) = proc.communicate()
+        # Exits with 1 if nothing matches
+        return any(line.split(" ", 1)[0].startswith("extensions.") or
+                   line.endswith(" true")
+                   for line in stdout.splitlines())
+
+    def update(self, head):
+        """
+        Add the commits reachable from a head, which aren't reachable from
+        previously indexed heads, to the index, keeping the most recent ones
+        only. Partial clones aren't indexed.
+
+        Args:
+            head:   The full hash of the head commit.
+
+        Returns:
+            True if the index is up to date, False if the repository is a
+            partial clone and wasn't indexed.
+        """
+        if self.is_partial():
+            logging.warning("not indexing patch IDs of partial clone %s",
+                            self.gdir)
+            return False
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with skt.file_lock(self.lockpath):
+            index = self.load()
+            if head in index['tips']:
+                return True
+
+            args = ["git", "--git-dir", self.gdir, "log", "-p",
+                    "--no-merges", "--no-color", "--no-ext-diff",
+                    "--ignore-missing", "--max-count=%d" % self.size,
+                    head, "--not"] + index['tips']
+            added = patch_id_cmd(args, None, self.stats)
+            # The log lists the newest commits first
+            index['patches'] = (index['patches'] +
+                                [list(entry) for entry in reversed(added)])
+            index['patches'] = index['patches'][-self.size:]
+            index['tips'] = [head] + index['tips'][:TIPS - 1]
+            self.save(index)
+
+        logging.info("indexed patch IDs of %d commits up to %s", len(added),
+                     head)
+        return True
+
+    def lookup(self, patch_ids):
+        """
+        Find the commits of patch IDs.
+
+        Args:
+            patch_ids:  A list of patch IDs.
+
+        Returns:
+            A dictionary of commits indexed by patch IDs, containing the
+            found patch IDs only.
+        """
+        patches = dict(self.load()['patches'])
+        return {patch_id: patches[patch_id] for patch_id in patch_ids
+                if patch_id in patches}
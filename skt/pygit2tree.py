@@ -0,0 +1,155 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Kernel source tree using libgit2 for repository queries"""
+import logging
+
+import pygit2
+
+from skt.kerneltree import KernelTree
+
+
+class Pygit2KernelTree(KernelTree):
+    """
+    Pygit2KernelTree - a KernelTree performing repository initialization,
+    remote management, reference resolution and commit lookups in-process,
+    with libgit2, instead of executing git. Fetching, checking out, merging
+    and applying patches is still done by git.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize a Pygit2KernelTree. Accepts the same arguments as
+        KernelTree.
+        """
+        # The libgit2 repository, opened on first use
+        self.repository = None
+        super(Pygit2KernelTree, self).__init__(*args, **kwargs)
+
+    def get_repository(self):
+        """
+        Get the libgit2 repository of the working directory, opening it if
+        necessary.
+
+        Returns:
+            The pygit2.Repository object.
+        """
+        if self.repository is None:
+            self.repository = pygit2.Repository(self.wdir)
+        return self.repository
+
+    def init_repo(self):
+        """
+        Create a repository in the working directory, or reinitialize the
+        existing one.
+        """
+        logging.debug("initializing repository in %s", self.wdir)
+        self.repository = pygit2.init_repository(self.wdir)
+
+    def set_remote(self, remote, uri):
+        """
+        Set the URL of a remote, adding the remote if it doesn't exist.
+
+        Args:
+            remote: The name of the remote.
+            uri:    The Git URI of the remote.
+        """
+        remotes = self.get_repository().remotes
+        if remote in [existing.name for existing in remotes]:
+            remotes.set_url(remote, uri)
+        else:
+            remotes.create(remote, uri)
+
+    def add_remote(self, remote, uri):
+        """
+        Add a remote, unless a remote with the same name exists.
+
+        Args:
+            remote: The name of the remote.
+            uri:    The Git URI of the remote.
+
+        Returns:
+            True if the remote was added, False if it existed.
+        """
+        try:
+            self.get_repository().remotes.create(remote, uri)
+        except ValueError:
+            return False
+        return True
+
+    def get_remotes(self):
+        """
+        Get the configured remotes, reading the repository configuration on
+        first call only. Remotes added with add_merge_remote() are included.
+
+        Returns:
+            A dictionary of remote URLs, indexed by remote names.
+        """
+        if self.remotes is None:
+            self.remotes = {remote.name: remote.url
+                            for remote in self.get_repository().remotes}
+        return self.remotes
+
+    def lookup_commit(self, ref=None):
+        """
+        Look up the commit pointed at by the specified reference, or the
+        currently checked-out commit, if not specified.
+
+        Args:
+            ref:    The reference to the commit, or None, if the currently
+                    checked-out commit should be used instead.
+        Returns:
+            The pygit2.Commit object.
+
+        Raises:
+            Exception if the reference doesn't point to a commit.
+        """
+        name = ref if ref is not None else "HEAD"
+        try:
+            return self.get_repository().revparse_single(name).peel(
+                pygit2.Commit
+            )
+        except (KeyError, ValueError, pygit2.GitError):
+            raise Exception("Failed to find commit %s^{commit}" % name)
+
+    def get_commit(self, ref=None):
+        """
+        Get the hash and the raw object of the commit pointed at by the
+        specified reference, or of the currently checked-out commit, if not
+        specified.
+
+        Args:
+            ref:    The reference to the commit, or None, if the currently
+                    checked-out commit should be used instead.
+        Returns:
+            A tuple of the commit's full hash string and its raw object.
+
+        Raises:
+            Exception if the reference doesn't point to a commit.
+        """
+        commit = self.lookup_commit(ref)
+        return (str(commit.id), commit.read_raw())
+
+    def get_commit_date(self, ref=None):
+        """
+        Get the committer date of the commit pointed at by the specified
+        reference, or of the currently checked-out commit, if not specified.
+
+        Args:
+            ref:    The reference to commit to get the committer date of,
+                    or None, if the currently checked-out commit should be
+                    used instead.
+        Returns:
+            The epoch timestamp of the commit's committer date.
+        """
+        return self.lookup_commit(ref).commit_time
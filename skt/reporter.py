@@ -25,6 +25,8 @@ import StringIO
 import requests
 
 import skt
+import skt.httpsession
+import skt.manifest
 import skt.runner
 
 
@@ -133,7 +135,7 @@ class ConsoleLog(object):
         if not self.url:
             return []
 
-        response = requests.get(self.url)
+        response = skt.httpsession.get(self.url)
 
         try:
             str_data = response.text[
@@ -213,21 +215,55 @@ class Reporter(object):
         # TODO Describe
         self.mergedata = None
 
+    @staticmethod
+    def addinfodata(mergedata, idata):
+        """
+        Add a build information entry to merge data.
+
+        Args:
+            mergedata:  The merge data dictionary to update.
+            idata:      The build information entry: a list of strings,
+                        starting with the entry type.
+        """
+        if idata[0] == 'base':
+            mergedata['base'] = (idata[1], idata[2])
+        elif idata[0] == 'git':
+            mergedata['merge_git'].append((idata[1], idata[2]))
+        elif idata[0] == 'patch':
+            mergedata['localpatch'].append(os.path.basename(idata[1]))
+        elif idata[0] == 'patchwork':
+            mergedata['patchwork'].append((idata[1], idata[2]))
+        else:
+            logging.warning("Unknown infotype: %s", idata[0])
+
     def infourldata(self, mergedata):
-        response = requests.get(self.cfg.get("infourl"))
+        response = skt.httpsession.get(self.cfg.get("infourl"))
         for line in response.text.split('\n'):
             if line:
-                idata = line.split(',')
-                if idata[0] == 'base':
-                    mergedata['base'] = (idata[1], idata[2])
-                elif idata[0] == 'git':
-                    mergedata['merge_git'].append((idata[1], idata[2]))
-                elif idata[0] == 'patch':
-                    mergedata['localpatch'].append(os.path.basename(idata[1]))
-                elif idata[0] == 'patchwork':
-                    mergedata['patchwork'].append((idata[1], idata[2]))
-                else:
-                    logging.warning("Unknown infotype: %s", idata[0])
+                self.addinfodata(mergedata, line.split(','))
+
+        return mergedata
+
+    def manifesturldata(self, mergedata):
+        """
+        Fill merge data and the kernel configuration from the published
+        build manifest, with a single request.
+
+        Args:
+            mergedata:  The merge data dictionary to update.
+
+        Returns:
+            The updated merge data dictionary.
+        """
+        response = skt.httpsession.get(self.cfg.get("manifesturl"))
+        if response.status_code != requests.codes.ok:
+            raise Exception('Failed to retrieve %s, returned %d' %
+                            (self.cfg.get("manifesturl"),
+                             response.status_code))
+        manifest = skt.manifest.loads(response.content)
+        for idata in manifest.get('buildinfo', []):
+            self.addinfodata(mergedata, idata)
+        mergedata['config'] = manifest.get('config')
 
         return mergedata
 
@@ -245,8 +281,9 @@ class Reporter(object):
 
         if self.cfg.get("patchworks"):
             for purl in self.cfg.get("patchworks"):
-                patch_mbox = skt.get_patch_mbox(purl)
-                patchname = skt.get_patch_name(patch_mbox)
+                patch_mbox = skt.download_patch_mbox(purl)
+                patchname = skt.read_patch_name(patch_mbox)
+                patch_mbox.close()
                 mergedata['patchwork'].append((purl, patchname))
 
         return mergedata
@@ -260,18 +297,24 @@ class Reporter(object):
             'config': None
         }
 
-        if self.cfg.get("infourl"):
+        if self.cfg.get("manifesturl"):
+            mergedata = self.manifesturldata(mergedata)
+        elif self.cfg.get("infourl"):
             mergedata = self.infourldata(mergedata)
         else:
             mergedata = self.stateconfigdata(mergedata)
 
-        if self.cfg.get("cfgurl"):
-            response = requests.get(self.cfg.get("cfgurl"))
-            if response:
-                mergedata['config'] = response.text
-        else:
-            with open("%s/.config" % self.cfg.get("workdir"), "r") as fileh:
-                mergedata['config'] = fileh.read()
+        # The manifest has the configuration already, and there's none
+        # without a build
+        if mergedata['config'] is None and not self.cfg.get("buildskipped"):
+            if self.cfg.get("cfgurl"):
+                response = skt.httpsession.get(self.cfg.get("cfgurl"))
+                if response:
+                    mergedata['config'] = response.text
+            else:
+                with open("%s/.config" % self.cfg.get("workdir"),
+                          "r") as fileh:
+                    mergedata['config'] = fileh.read()
 
         self.mergedata = mergedata
 
@@ -309,7 +352,8 @@ class Reporter(object):
                       'repository at' % self.mergedata['base'][1][:12],
                       '  %s' % self.mergedata['base'][0]]
 
-        if not self.cfg.get("mergelog"):
+        if not self.cfg.get("mergelog") and \
+                not self.cfg.get("buildskipped"):
             cfgname = "config.gz"
             result.append('\nThe kernel was built with the attached '
                           'configuration (%s).' % cfgname)
@@ -342,6 +386,10 @@ class Reporter(object):
 
         return result
 
+    def getbuildskip(self):
+        return ['\nThe kernel was not built or tested, as %s.' %
+                self.cfg.get("buildskipped")]
+
     def getbuildfailure(self):
         attname = "build.log.gz"
         result = ['However, the build failed. We are attaching the build '
@@ -415,7 +463,7 @@ class Reporter(object):
 
                 if slshwurl is not None:
                     if system not in minfo["short"]:
-                        response = requests.get(slshwurl)
+                        response = skt.httpsession.get(slshwurl)
                         if response:
                             result.append("\nMachine info:")
                             result += response.text.split('\n')
@@ -449,6 +497,8 @@ class Reporter(object):
             msg += self.getmergefailure()
         elif self.cfg.get("buildlog"):
             msg += self.getbuildfailure()
+        elif self.cfg.get("buildskipped"):
+            msg += self.getbuildskip()
         else:
             msg += self.getjobresults()
 
@@ -475,6 +525,8 @@ class Reporter(object):
             subject += "Patch application failed"
         elif self.cfg.get("buildlog"):
             subject += "Build failed"
+        elif self.cfg.get("buildskipped"):
+            subject += "Build and tests not needed"
         else:
             subject += "Report"
 
@@ -0,0 +1,271 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Pool of reusable working directories keeping their build objects"""
+import json
+import logging
+import os
+import re
+import socket
+import subprocess
+import time
+
+import skt
+
+
+class WorkdirPool(object):
+    """
+    WorkdirPool - a fixed number of working directories ("slots") under a
+    pool directory, leased to one job at a time and kept with their checkouts
+    and build objects between jobs, so builds can be incremental. Safe for
+    use by concurrent skt processes.
+
+    Slot N is the "slot-N" directory, leased while a "slot-N.lease" JSON file
+    exists next to it and hasn't expired. The "slot-N.base" file holds the
+    hash of the base commit last checked out in the slot.
+    """
+
+    def __init__(self, pooldir, size=4, lease_time=24 * 60 * 60):
+        """
+        Initialize a working directory pool.
+
+        Args:
+            pooldir:    The directory housing the working directories.
+                        Created if missing.
+            size:       The number of working directories in the pool.
+            lease_time: Number of seconds after which a lease expires, and
+                        the working directory can be leased again, even if
+                        it wasn't released.
+        """
+        self.pooldir = pooldir
+        self.size = size
+        self.lease_time = lease_time
+        self.lockpath = os.path.join(pooldir, "pool.lock")
+
+        try:
+            os.makedirs(pooldir)
+        except OSError:
+            if not os.path.isdir(pooldir):
+                raise
+
+    def get_slot_path(self, slot):
+        """Get the path to the working directory of a slot."""
+        return os.path.join(self.pooldir, "slot-%d" % slot)
+
+    def get_lease_path(self, path):
+        """Get the path to the lease file of a working directory."""
+        return "%s.lease" % path
+
+    def get_base_path(self, path):
+        """Get the path to the base commit file of a working directory."""
+        return "%s.base" % path
+
+    def record_base(self, path, commit):
+        """
+        Record the base commit checked out in a leased working directory, to
+        measure its distance from commits it doesn't have, when leasing.
+
+        Args:
+            path:   The path to the working directory.
+            commit: The full hash of the checked out base commit.
+        """
+        with open(self.get_base_path(path), 'w') as fileh:
+            fileh.write(commit + "\n")
+
+    def get_base(self, path):
+        """
+        Get the base commit last checked out in a working directory.
+
+        Args:
+            path:   The path to the working directory.
+
+        Returns:
+            The full hash of the commit, or None if none was recorded.
+        """
+        try:
+            with open(self.get_base_path(path), 'r') as fileh:
+                return fileh.read().strip() or None
+        except IOError:
+            return None
+
+    def is_leased(self, path):
+        """
+        Check if a working directory is leased. Must be called with the pool
+        lock held.
+
+        Args:
+            path:   The path to the working directory.
+
+        Returns:
+            True if the working directory has an unexpired lease.
+        """
+        try:
+            with open(self.get_lease_path(path), 'r') as fileh:
+                lease = json.load(fileh)
+        except IOError:
+            return False
+        except ValueError:
+            # A lease being written can't be seen, as it's written with the
+            # pool lock held, so this one is broken
+            return False
+
+        return lease.get('expires', 0) > time.time()
+
+    @staticmethod
+    def get_shortstat(args):
+        """
+        Get the number of files a "git diff --shortstat" reports as changed.
+
+        Args:
+            args:   Arguments of the git command, up to and including
+                    "--shortstat" and the commits to compare.
+
+        Returns:
+            The number of changed files, or None if git failed, e.g. because
+            a commit is unknown to the repository.
+        """
+        logging.debug("executing: %s", " ".join(args))
+        proc = subprocess.Popen(args,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                env=dict(os.environ, **{'LC_ALL': 'C'}))
+        (stdout, _) = proc.communicate()
+        if proc.returncode != 0:
+            return None
+
+        match = re.search(r'(\d+) files? changed', stdout)
+        return int(match.group(1)) if match else 0
+
+    def get_distance(self, path, commit, repo=None):
+        """
+        Get the number of files differing between the checkout of a working
+        directory and a commit. If the working directory doesn't have the
+        commit yet, as usual for a new base commit, compare the recorded base
+        commit of the working directory with the commit in a repository
+        having both instead, ignoring the changes merged on top of the base.
+
+        Args:
+            path:   The path to the working directory.
+            commit: The full hash of the commit.
+            repo:   The path to a git directory having the commit and the
+                    base commits the working directories fetched, e.g. a
+                    shared mirror of the base repository, or None if there's
+                    none.
+
+        Returns:
+            The number of differing files, or None if it can't be determined,
+            e.g. because there's no checkout, or the commit is unknown to the
+            repositories.
+        """
+        if not os.path.exists(os.path.join(path, ".git")):
+            return None
+
+        distance = self.get_shortstat(["git", "-C", path, "diff",
+                                       "--shortstat", "HEAD", commit])
+        base = self.get_base(path)
+        if distance is None and repo and base:
+            distance = self.get_shortstat(["git", "--git-dir", repo, "diff",
+                                           "--shortstat", base, commit])
+        return distance
+
+    def lease(self, commit=None, repo=None):
+        """
+        Lease a working directory, preferring the one whose checkout is the
+        closest to a commit.
+
+        Args:
+            commit: The full hash of the commit to be checked out, or None,
+                    if unknown.
+            repo:   The path to a git directory having the commit and the
+                    base commits the working directories fetched, to measure
+                    distances of working directories without the commit in,
+                    or None. See get_distance().
+
+        Returns:
+            The path to the leased working directory.
+
+        Raises:
+            Exception if all the working directories are leased.
+        """
+        with skt.file_lock(self.lockpath):
+            free = [self.get_slot_path(slot) for slot in range(self.size)
+                    if not self.is_leased(self.get_slot_path(slot))]
+            if not free:
+                raise Exception("All %d working directories in %s are leased"
+                                % (self.size, self.pooldir))
+
+            candidates = []
+            for path in free:
+                distance = self.get_distance(path, commit, repo) if commit \
+                    else None
+                logging.debug("working directory %s distance: %s", path,
+                              distance)
+                # Prefer known distances, then existing checkouts
+                candidates.append((
+                    distance is None,
+                    distance,
+                    not os.path.exists(os.path.join(path, ".git")),
+                    path
+                ))
+            path = min(candidates)[-1]
+            self.write_lease(path)
+
+        logging.info("leased working directory %s", path)
+        return path
+
+    def write_lease(self, path):
+        """
+        Write the lease file of a working directory. Must be called with the
+        pool lock held.
+
+        Args:
+            path:   The path to the working directory.
+        """
+        with open(self.get_lease_path(path), 'w') as fileh:
+            json.dump({'host': socket.gethostname(),
+                       'pid': os.getpid(),
+                       'expires': time.time() + self.lease_time}, fileh)
+
+    def lease_free(self):
+        """
+        Lease all free working directories, which have a checkout, e.g. for
+        maintenance.
+
+        Returns:
+            The list of paths to the leased working directories.
+        """
+        leased = []
+        with skt.file_lock(self.lockpath):
+            for slot in range(self.size):
+                path = self.get_slot_path(slot)
+                if os.path.exists(os.path.join(path, ".git")) and \
+                        not self.is_leased(path):
+                    self.write_lease(path)
+                    leased.append(path)
+
+        return leased
+
+    def release(self, path):
+        """
+        Release a leased working directory, keeping its contents.
+
+        Args:
+            path:   The path to the working directory.
+        """
+        with skt.file_lock(self.lockpath):
+            try:
+                os.unlink(self.get_lease_path(path))
+            except OSError:
+                pass
+
+        logging.info("released working directory %s", path)
@@ -0,0 +1,84 @@
+"""
+Test cases for changes module.
+"""
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General Public
+# License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+import unittest
+
+from skt import changes
+
+
+class ChangesTest(unittest.TestCase):
+    """Test cases for changes module."""
+
+    def test_classify_none(self):
+        """Ensure documentation and tools changes are not built."""
+        self.assertEqual(
+            (changes.SCOPE_NONE, None),
+            changes.classify(['Documentation/process/howto.rst',
+                              'MAINTAINERS',
+                              'tools/perf/builtin-top.c'])
+        )
+
+    def test_classify_built_tools(self):
+        """Ensure changes of tools used by the kernel build are built."""
+        self.assertEqual(
+            (changes.SCOPE_FULL, None),
+            changes.classify(['tools/objtool/check.c'])
+        )
+        self.assertEqual(
+            (changes.SCOPE_FULL, None),
+            changes.classify(['tools/perf/builtin-top.c',
+                              'tools/include/linux/bitops.h'])
+        )
+
+    def test_classify_arch(self):
+        """Ensure changes of a single architecture are recognized."""
+        self.assertEqual(
+            (changes.SCOPE_ARCH, 'arm64'),
+            changes.classify(['Documentation/arm64/booting.txt',
+                              'arch/arm64/kernel/head.S',
+                              'arch/arm64/mm/mmu.c'])
+        )
+        self.assertEqual(
+            (changes.SCOPE_FULL, None),
+            changes.classify(['arch/arm64/mm/mmu.c', 'arch/x86/mm/init.c'])
+        )
+
+    def test_classify_module(self):
+        """Ensure changes of a single module directory are recognized."""
+        self.assertEqual(
+            (changes.SCOPE_MODULE, 'drivers/net/ethernet/intel/e1000e'),
+            changes.classify(['drivers/net/ethernet/intel/e1000e/netdev.c',
+                              'drivers/net/ethernet/intel/e1000e/hw.h'])
+        )
+        self.assertEqual(
+            (changes.SCOPE_FULL, None),
+            changes.classify(['drivers/net/ethernet/intel/e1000e/Kconfig'])
+        )
+        self.assertEqual(
+            (changes.SCOPE_FULL, None),
+            changes.classify(['kernel/fork.c'])
+        )
+
+    def test_classify_empty(self):
+        """Ensure unknown changes are considered to affect everything."""
+        self.assertEqual((changes.SCOPE_FULL, None), changes.classify([]))
+
+    def test_get_kernel_arch(self):
+        """Ensure machine names are mapped to architecture directories."""
+        self.assertEqual('x86', changes.get_kernel_arch('x86_64'))
+        self.assertEqual('powerpc', changes.get_kernel_arch('ppc64le'))
+        self.assertEqual('arm', changes.get_kernel_arch('armv7l'))
+        self.assertEqual('arm64', changes.get_kernel_arch('arm64'))
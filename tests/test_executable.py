@@ -15,8 +15,13 @@ Test cases for runner module.
 # this program; if not, write to the Free Software Foundation, Inc., 51
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 import os
+import shutil
+import subprocess
+import tempfile
 import unittest
 
+import mock
+
 from skt import executable
 
 
@@ -36,3 +41,144 @@ class TestExecutable(unittest.TestCase):
         result = executable.full_path("~/{}".format(filename))
         expected_path = "{}/{}".format(os.path.expanduser('~'), filename)
         self.assertEqual(expected_path, result)
+
+    def test_get_mirror_refs(self):
+        """Verify get_mirror_refs() collects and groups mirrored refs"""
+        cfg = {
+            'baserepo': 'git://example.com/base.git',
+            'ref': 'next',
+            'merge_ref': [['git://example.com/merge.git'],
+                          ['git://example.com/base.git', 'master']],
+            'mirror_ref': [['git://example.com/base.git', 'next', 'v4.16']],
+        }
+        self.assertEqual(
+            [('git://example.com/base.git', ['next', 'master', 'v4.16']),
+             ('git://example.com/merge.git', ['master'])],
+            executable.get_mirror_refs(cfg)
+        )
+
+    def test_mirror_sync(self):
+        """Verify cmd_mirror_sync() syncs every mirror despite failures"""
+        cfg = {
+            'mirror_dir': '/nonexistent/mirrors',
+            'baserepo': 'git://example.com/base.git',
+            'merge_ref': [['git://example.com/merge.git', 'for-next']],
+        }
+        mock_sync = mock.patch(
+            'skt.mirror.GitMirror.sync',
+            side_effect=[subprocess.CalledProcessError(1, 'git'), None]
+        )
+        mock_init = mock.patch('skt.mirror.GitMirror.__init__',
+                               return_value=None)
+
+        with mock_init, mock_sync as m_sync, \
+                mock.patch('skt.executable.retcode', 0):
+            executable.cmd_mirror_sync(cfg)
+            self.assertEqual(1, executable.retcode)
+
+        self.assertEqual([mock.call(['master']), mock.call(['for-next'])],
+                         m_sync.call_args_list)
+
+    def test_maintenance(self):
+        """Verify cmd_maintenance() maintains every repository"""
+        tmpdir = tempfile.mkdtemp()
+        cfg = {
+            'worktree_repo': os.path.join(tmpdir, 'repo.git'),
+            'workdir_pool': os.path.join(tmpdir, 'pool'),
+            'workdir_pool_size': 2,
+        }
+        os.makedirs(os.path.join(tmpdir, 'pool', 'slot-1', '.git'))
+        mock_run = mock.patch(
+            'skt.maintenance.RepoMaintenance.run',
+            side_effect=[None, subprocess.CalledProcessError(1, 'git')]
+        )
+
+        try:
+            with mock_run as m_run, mock.patch('skt.executable.retcode', 0):
+                executable.cmd_maintenance(cfg)
+                self.assertEqual(1, executable.retcode)
+            self.assertEqual(2, m_run.call_count)
+            # The worktree repository was locked while maintained
+            self.assertTrue(os.path.exists(os.path.join(tmpdir,
+                                                        'repo.git.lock')))
+            # The maintained working directory is released
+            pool = executable.get_workdir_pool(cfg)
+            self.assertEqual(
+                set([os.path.join(tmpdir, 'pool', 'slot-0'),
+                     os.path.join(tmpdir, 'pool', 'slot-1')]),
+                set([pool.lease(), pool.lease()])
+            )
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_merge_prefetch_before_lease(self):
+        """Verify cmd_merge() starts downloading patches before leasing"""
+        cfg = {
+            'baserepo': 'git://example.com/base.git',
+            'workdir_pool': '/nonexistent/pool',
+            'pw': ['https://pw.example.com/patch/1/'],
+        }
+        calls = mock.Mock()
+        mock_prefetcher = mock.patch('skt.PatchPrefetcher',
+                                     calls.prefetcher)
+        mock_remote_head = mock.patch(
+            'skt.kerneltree.KernelTree.get_remote_head',
+            calls.get_remote_head
+        )
+        calls.get_remote_head.side_effect = \
+            subprocess.CalledProcessError(128, 'git')
+
+        with mock_prefetcher, mock_remote_head:
+            with self.assertRaises(subprocess.CalledProcessError):
+                executable.cmd_merge(cfg)
+
+        self.assertEqual(
+            [mock.call.prefetcher(['https://pw.example.com/patch/1/'], 4),
+             mock.call.get_remote_head('git://example.com/base.git',
+                                       'master'),
+             mock.call.prefetcher().terminate()],
+            calls.mock_calls
+        )
+
+    def test_merge_record_run_failure(self):
+        """Verify cmd_merge() failures aren't hidden by run bookkeeping"""
+        cfg = {
+            'baserepo': 'git://example.com/base.git',
+            'workdir': '/nonexistent/workdir',
+        }
+        ktree = mock.MagicMock()
+        ktree.checkout.return_value = '0123456789abcdef'
+        ktree.gitstats.get_summary.return_value = {}
+        ktree.gitstats.get_counters.return_value = {}
+        ktree.get_maintenance.return_value.record_run.side_effect = \
+            IOError('No space left on device')
+        mock_ktree = mock.patch('skt.executable.get_kerneltree',
+                                return_value=ktree)
+        mock_merge = mock.patch('skt.executable.merge_updates',
+                                side_effect=Exception('merge failed'))
+
+        with mock_ktree, mock_merge:
+            with self.assertRaises(Exception) as context:
+                executable.cmd_merge(cfg)
+
+        self.assertEqual('merge failed', str(context.exception))
+        ktree.get_maintenance.return_value.record_run.assert_called_once()
+
+    def test_get_build_skip_reason(self):
+        """Verify builds are skipped for changes not affecting them"""
+        self.assertIsNone(executable.get_build_skip_reason({}, 'x86_64'))
+        self.assertIsNotNone(executable.get_build_skip_reason(
+            {'redundant': 'abcdef'}, 'x86_64'
+        ))
+        self.assertIsNotNone(executable.get_build_skip_reason(
+            {'changescope': 'none'}, 'x86_64'
+        ))
+        self.assertIsNotNone(executable.get_build_skip_reason(
+            {'changescope': 'arch', 'changetarget': 'arm64'}, 'x86_64'
+        ))
+        self.assertIsNone(executable.get_build_skip_reason(
+            {'changescope': 'arch', 'changetarget': 'x86'}, 'x86_64'
+        ))
+        self.assertIsNone(executable.get_build_skip_reason(
+            {'changescope': 'module', 'changetarget': 'fs/ext4'}, 'x86_64'
+        ))
@@ -0,0 +1,104 @@
+"""
+Test cases for gitstats module.
+"""
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General Public
+# License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from skt import gitstats
+
+
+class GitStatsTest(unittest.TestCase):
+    """Test cases for gitstats module."""
+
+    def test_get_subcommand(self):
+        """Ensure subcommands are found after global options."""
+        self.assertEqual(
+            'fetch',
+            gitstats.get_subcommand(['git', '--work-tree', '/w', '--git-dir',
+                                     '/w/.git', '-c', 'a.b=c', 'fetch', '-n'])
+        )
+        self.assertIsNone(gitstats.get_subcommand(['git', '--version']))
+
+    def test_parse_fetch_progress(self):
+        """Ensure received objects and bytes are parsed from progress."""
+        output = ("remote: Counting objects: 100% (30/30), done.\n"
+                  "Receiving objects:  50% (15/30), 1.00 MiB | 1 MiB/s\r"
+                  "Receiving objects: 100% (30/30), 2.50 MiB | 1 MiB/s, "
+                  "done.\n"
+                  "Resolving deltas: 100% (3/3), done.\n")
+        self.assertEqual((30, int(2.5 * 1024 * 1024)),
+                         gitstats.parse_fetch_progress(output))
+
+    def test_parse_fetch_progress_total(self):
+        """Ensure the remote total is used without receive progress."""
+        output = ("remote: Total 12 (delta 2), reused 0 (delta 0)\n"
+                  " * [new branch]      master     -> refs/x\n")
+        self.assertEqual((12, 0), gitstats.parse_fetch_progress(output))
+        self.assertEqual((0, 0), gitstats.parse_fetch_progress(""))
+
+    def test_summary(self):
+        """Ensure commands are summarized per subcommand."""
+        stats = gitstats.GitStats()
+        stats.record(['git', 'fetch', 'origin'], 1.5, 0, 10, 1000)
+        stats.record(['git', 'fetch', 'origin'], 0.5, 128)
+        stats.record(['git', 'am', '-'], 0.25, 0)
+
+        self.assertEqual(
+            {'fetch': {'count': 2, 'failed': 1, 'seconds': 2.0,
+                       'objects': 10, 'bytes': 1000},
+             'am': {'count': 1, 'failed': 0, 'seconds': 0.25,
+                    'objects': 0, 'bytes': 0}},
+            stats.get_summary()
+        )
+
+    def test_check_call_fetch(self):
+        """Ensure fetches are recorded with the received objects."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            upstream = "%s/upstream" % tmpdir
+            subprocess.check_call(['git', 'init', '-q', upstream])
+            subprocess.check_call(['git', '-C', upstream, '-c',
+                                   'user.name=skt', '-c',
+                                   'user.email=skt@skt', 'commit', '-q',
+                                   '--allow-empty', '-m', 'base'])
+            clone = "%s/clone" % tmpdir
+            subprocess.check_call(['git', 'init', '-q', clone])
+
+            stats = gitstats.GitStats()
+            stats.check_call(['git', '-C', clone, 'fetch', '-q',
+                              'file://%s' % upstream, 'HEAD:refs/base'])
+            with self.assertRaises(subprocess.CalledProcessError):
+                stats.check_call(['git', '-C', clone, 'fetch',
+                                  'file://%s' % upstream, 'missing'])
+
+            summary = stats.get_summary()['fetch']
+            self.assertEqual(2, summary['count'])
+            self.assertEqual(1, summary['failed'])
+            # A commit and its empty tree
+            self.assertEqual(2, summary['objects'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_count(self):
+        """Ensure decisions are counted by name."""
+        stats = gitstats.GitStats()
+        for name in ['fetch-skipped', 'fetch-needed', 'fetch-skipped']:
+            stats.count(name)
+
+        self.assertEqual({'fetch-skipped': 2, 'fetch-needed': 1},
+                         stats.get_counters())
@@ -0,0 +1,103 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Test cases for httpsession module."""
+import unittest
+
+import mock
+
+from skt import httpsession
+
+
+class TestHTTPSession(unittest.TestCase):
+    # (Access to a protected member) pylint: disable=protected-access
+    """Test cases for HTTPSession class"""
+
+    def setUp(self):
+        """Create a session with its network layer mocked."""
+        self.session = httpsession.HTTPSession(max_per_host=2)
+        self.response = mock.Mock()
+        self.response.content = 'abcd'
+        self.session.session.get = mock.Mock(return_value=self.response)
+
+    def test_get(self):
+        """Ensure get() passes arguments and returns the response."""
+        result = self.session.get('http://example.com/a', timeout=5)
+
+        self.assertIs(self.response, result)
+        self.session.session.get.assert_called_once_with(
+            'http://example.com/a', timeout=5
+        )
+
+    def test_stats(self):
+        """Ensure requests and bytes read are accounted per host."""
+        self.response.iter_content = mock.Mock(return_value=iter(['ab',
+                                                                  'cde']))
+        self.session.get('http://example.com/a')
+        response = self.session.get('http://example.com/b', stream=True)
+        self.assertEqual(['ab', 'cde'], list(response.iter_content(1024)))
+        self.session.get('https://example.org/c')
+        stats = self.session.get_stats()
+
+        self.assertEqual(2, stats['example.com']['requests'])
+        self.assertEqual(9, stats['example.com']['bytes'])
+        self.assertEqual(1, stats['example.org']['requests'])
+        self.assertEqual(4, stats['example.org']['bytes'])
+
+    def test_stream_slot(self):
+        """Ensure streamed responses keep their slot until closed."""
+        sem = self.session._get_host_semaphore('example.com')
+        raw_responses = [mock.Mock(), mock.Mock()]
+        self.session.session.get.side_effect = raw_responses
+        close = raw_responses[0].close
+        responses = [self.session.get('http://example.com/a', stream=True)
+                     for _ in range(2)]
+        self.assertFalse(sem.acquire(False))
+
+        responses[0].close()
+        responses[0].close()
+        self.assertEqual(2, close.call_count)
+        self.assertTrue(sem.acquire(False))
+        self.assertFalse(sem.acquire(False))
+        self.assertEqual(1, self.session.get_stats()['example.com'][
+            'requests'
+        ])
+
+    def test_failure(self):
+        """Ensure failed requests are accounted and release their slot."""
+        self.session.session.get.side_effect = IOError('connection failed')
+
+        for _ in range(3):
+            with self.assertRaises(IOError):
+                self.session.get('http://example.com/a')
+
+        stats = self.session.get_stats()
+        self.assertEqual(3, stats['example.com']['requests'])
+        self.assertEqual(3, stats['example.com']['failures'])
+
+    def test_host_semaphore(self):
+        """Ensure each host gets a single semaphore."""
+        sem = self.session._get_host_semaphore('example.com')
+        self.assertIs(sem, self.session._get_host_semaphore('example.com'))
+        self.assertIsNot(sem,
+                         self.session._get_host_semaphore('example.org'))
+
+    def test_retries_mounted(self):
+        """Ensure the adapters retry failed requests."""
+        adapter = self.session.session.get_adapter('https://example.com')
+        self.assertEqual(3, adapter.max_retries.total)
+        self.assertEqual(2, adapter._pool_maxsize)
+
+    def test_shared_session(self):
+        """Ensure get_session() always returns the same session."""
+        self.assertIs(httpsession.get_session(), httpsession.get_session())
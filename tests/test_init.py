@@ -15,8 +15,10 @@ Test cases for __init__.py.
 # this program; if not, write to the Free Software Foundation, Inc., 51
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 from __future__ import division
+import StringIO
 import unittest
 
+import mock
 from requests.exceptions import RequestException
 
 import skt
@@ -58,3 +60,102 @@ class TestIndependent(unittest.TestCase):
                      '==?=')
         self.assertEqual('If you can read this you understand the example.',
                          skt.get_patch_name(mbox_body))
+
+    def test_header_only_subject(self):
+        """Ensure get_patch_name() doesn't look past the header block"""
+        mbox_body = ('From Test Thu May 2 17:49:51 2018\n'
+                     'Subject: GOOD SUBJECT\n\n'
+                     'Subject: BODY SUBJECT\n')
+        self.assertEqual('GOOD SUBJECT', skt.get_patch_name(mbox_body))
+
+    def test_get_patch_names(self):
+        """Ensure get_patch_names() returns subjects of all messages"""
+        mbox_body = ('From 1 Mon Sep 17 00:00:00 2001\r\n'
+                     'Subject: [PATCH 1/3] first\r\n\r\n'
+                     'From: someone in the body\r\n\r\n'
+                     'From 2 Mon Sep 17 00:00:00 2001\r\n'
+                     'From: Someone <someone@example.com>\r\n\r\n'
+                     'body\r\n\r\n'
+                     'From 3 Mon Sep 17 00:00:00 2001\r\n'
+                     'Subject: [PATCH 3/3] third\r\n')
+        self.assertEqual(['[PATCH 1/3] first',
+                          '<SUBJECT MISSING>',
+                          '[PATCH 3/3] third'],
+                         skt.get_patch_names(mbox_body))
+
+    def test_read_mbox_headers(self):
+        """Ensure read_mbox_headers() parses like iter_mbox_headers()"""
+        mbox_body = ('From 1 Mon Sep 17 00:00:00 2001\r\n'
+                     'Subject: [PATCH 1/3] first\r\n'
+                     'X-Patchwork-Id: 1\r\n\r\n'
+                     'From: someone in the body\r\n\r\n'
+                     'From 2 Mon Sep 17 00:00:00 2001\r\n'
+                     'From: Someone <someone@example.com>\r\n\r\n'
+                     'body\r\n\r\n'
+                     'From 3 Mon Sep 17 00:00:00 2001\r\n'
+                     'Subject: [PATCH 3/3] third\r\n')
+        expected = [headers.items()
+                    for headers in skt.iter_mbox_headers(mbox_body)]
+        self.assertEqual(3, len(expected))
+        self.assertEqual(expected,
+                         [headers.items() for headers in
+                          skt.read_mbox_headers(StringIO.StringIO(mbox_body))])
+        self.assertEqual([[]],
+                         [headers.items() for headers in
+                          skt.read_mbox_headers(StringIO.StringIO(''))])
+
+    def test_read_patch_name(self):
+        """Ensure read_patch_name() reads the name and rewinds the file"""
+        mbox = StringIO.StringIO('From Test Thu May 2 17:49:51 2018\n'
+                                 'Subject: GOOD SUBJECT\n\n' +
+                                 'x' * (2 * skt.MBOX_CHUNK_SIZE))
+        self.assertEqual('GOOD SUBJECT', skt.read_patch_name(mbox))
+        self.assertEqual(0, mbox.tell())
+
+    def test_download_patch_mbox(self):
+        """Ensure download_patch_mbox() streams the mbox into a file"""
+        response = mock.Mock()
+        response.status_code = 200
+        response.iter_content = mock.Mock(return_value=iter(['ab', 'cd']))
+        with mock.patch('skt.httpsession.get',
+                        return_value=response) as m_get:
+            mbox = skt.download_patch_mbox('http://example.com/patch/1')
+
+        m_get.assert_called_once_with('http://example.com/patch/1/mbox',
+                                      stream=True)
+        self.assertEqual('abcd', mbox.read())
+
+    def test_download_patch_mbox_failure(self):
+        """Ensure download_patch_mbox() fails on unexpected status"""
+        response = mock.Mock()
+        response.status_code = 404
+        with mock.patch('skt.httpsession.get', return_value=response):
+            with self.assertRaises(Exception):
+                skt.download_patch_mbox('http://example.com/patch/1')
+
+
+class TestPatchPrefetcher(unittest.TestCase):
+    """Test cases for PatchPrefetcher class"""
+
+    def test_get(self):
+        """Ensure get() returns each downloaded mbox, once per URL"""
+        with mock.patch(
+            'skt.download_patch_mbox',
+            side_effect=lambda url: StringIO.StringIO('mbox of %s' % url)
+        ) as m_gpm:
+            prefetcher = skt.PatchPrefetcher(['a', 'b', 'a'], workers=2)
+            self.assertEqual('mbox of b', prefetcher.get('b').read())
+            self.assertEqual('mbox of a', prefetcher.get('a').read())
+            self.assertEqual('mbox of a', prefetcher.get('a').read())
+            prefetcher.terminate()
+
+        self.assertEqual(2, m_gpm.call_count)
+
+    def test_get_failure(self):
+        """Ensure get() raises the exception the download failed with"""
+        with mock.patch('skt.download_patch_mbox',
+                        side_effect=RequestException('failed')):
+            prefetcher = skt.PatchPrefetcher(['a'])
+            with self.assertRaises(RequestException):
+                prefetcher.get('a')
+            prefetcher.terminate()
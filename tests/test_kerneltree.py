@@ -19,10 +19,24 @@ import tempfile
 import shutil
 import os
 import subprocess
+import StringIO
+import json
+import time
 import mock
 from mock import Mock
 
-from skt.kerneltree import KernelTree
+from skt.kerneltree import KernelTree, get_kerneltree
+
+
+def commit_file(repo, name, content):
+    """Write a file to a git repository and commit it."""
+    env = dict(os.environ, GIT_AUTHOR_NAME='A', GIT_AUTHOR_EMAIL='a@a',
+               GIT_COMMITTER_NAME='C', GIT_COMMITTER_EMAIL='c@c')
+    with open(os.path.join(repo, name), 'w') as fileh:
+        fileh.write(content)
+    subprocess.check_call(['git', '-C', repo, 'add', name])
+    subprocess.check_call(['git', '-C', repo, 'commit', '-q', '-m', content],
+                          env=env)
 
 
 def make_process_exception(*args, **kwargs):
@@ -83,18 +97,413 @@ class KernelTreeTest(unittest.TestCase):
 
     def test_checkout(self):
         """Ensure checkout() runs git commands to check out a ref."""
-        self.m_popen_good.communicate = Mock(return_value=('stdout', None))
-
         mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
+        mock_get_commit_hash = mock.patch(
+            'skt.kerneltree.KernelTree.get_commit_hash',
+            return_value="abcdef"
+        )
 
-        with self.popen_good, mock_git_cmd:
+        with mock_git_cmd, mock_get_commit_hash:
             result = self.kerneltree.checkout()
 
-        self.assertEqual("stdout", result)
+        self.assertEqual("abcdef", result)
+
+    def test_checkout_mirror(self):
+        """Ensure checkout() fetches through a mirror, if specified."""
+        self.kerneltree.mirror_dir = "{}/mirrors".format(self.tmpdir)
+
+        mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
+        mock_update = mock.patch('skt.mirror.GitMirror.update',
+                                 return_value='refs/mirror/master')
+        mock_get_commit_hash = mock.patch(
+            'skt.kerneltree.KernelTree.get_commit_hash',
+            return_value="abcdef"
+        )
+
+        with mock_update, mock_get_commit_hash, mock_git_cmd as m_git_cmd:
+            self.kerneltree.checkout()
+
+        mirror_path = m_git_cmd.call_args_list[0][0][2]
+        self.assertTrue(mirror_path.startswith(self.kerneltree.mirror_dir))
+        self.assertEqual(
+            ('fetch', '-n', mirror_path,
+             '+refs/mirror/master:refs/remotes/origin/master',
+             '--depth', '1'),
+            m_git_cmd.call_args_list[0][0]
+        )
+        with open("{}/.git/objects/info/alternates".format(self.tmpdir)) \
+                as fileh:
+            self.assertEqual(mirror_path + "/objects\n", fileh.read())
+
+    def test_checkout_filter(self):
+        """Ensure checkout() makes a partial clone with a fetch filter."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        subprocess.check_call(['git', '-C', upstream, 'config',
+                               'uploadpack.allowFilter', 'true'])
+        for content in ['old', 'new']:
+            commit_file(upstream, 'file', content)
+
+        ktree = KernelTree('file://' + upstream,
+                           wdir="{}/wdir".format(self.tmpdir),
+                           fetch_filter='blob:none')
+        ktree.checkout()
+        ktree.get_commit_date('HEAD~1')
+
+        with open("{}/file".format(ktree.wdir)) as fileh:
+            self.assertEqual('new', fileh.read())
+        # Only the checked out blob was fetched
+        missing = subprocess.check_output(
+            ['git', '--git-dir', ktree.gdir, 'rev-list', '--objects',
+             '--missing=print', 'HEAD']
+        ).splitlines()
+        self.assertEqual(1, len([obj for obj in missing
+                                 if obj.startswith('?')]))
+        # The fetch was recorded without the lazily fetched blobs
+        self.assertEqual(1, ktree.gitstats.get_summary()['fetch']['count'])
+
+    def test_checkout_seed_bundle(self):
+        """Ensure checkout() fetches only objects missing from the seed."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        bundle = "{}/seed.bundle".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'file', 'old')
+        subprocess.check_call(['git', '-C', upstream, 'bundle', 'create',
+                               '-q', bundle, '--all'])
+        commit_file(upstream, 'file', 'new')
+
+        ktree = KernelTree('file://' + upstream,
+                           wdir="{}/wdir".format(self.tmpdir),
+                           seed_bundle=bundle)
+        ktree.checkout()
+
+        with open("{}/file".format(ktree.wdir)) as fileh:
+            self.assertEqual('new', fileh.read())
+        self.assertIn(
+            'refs/skt-seed/heads/master',
+            subprocess.check_output(['git', '--git-dir', ktree.gdir,
+                                     'for-each-ref', 'refs/skt-seed/'])
+        )
+        # Only the new commit, its tree and blob came from the remote
+        fetches = [command for command in ktree.gitstats.commands
+                   if command['command'] == 'fetch']
+        self.assertEqual(2, len(fetches))
+        self.assertEqual(3, fetches[1]['objects'])
+
+        # The repository is seeded only once
+        with mock.patch('skt.kerneltree.KernelTree.git_cmd') as m_git_cmd:
+            ktree.seed()
+            m_git_cmd.assert_not_called()
+
+    def test_checkout_seed_bundle_missing(self):
+        """Ensure checkout() falls back to the remote without the seed."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'file', 'content')
+
+        ktree = KernelTree('file://' + upstream,
+                           wdir="{}/wdir".format(self.tmpdir),
+                           seed_bundle="{}/missing".format(self.tmpdir))
+        ktree.checkout()
+
+        with open("{}/file".format(ktree.wdir)) as fileh:
+            self.assertEqual('content', fileh.read())
+
+    def test_checkout_sync(self):
+        """Ensure checkout() only rewrites files differing from the ref."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        wdir = "{}/wdir".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'same', 'same')
+        commit_file(upstream, 'changed', 'old')
+        commit_file(upstream, 'modified', 'modified')
+        KernelTree('file://' + upstream, wdir=wdir).checkout()
+        commit_file(upstream, 'changed', 'new')
+
+        # Touch a file without changing it, as a build could, and modify
+        # another one locally
+        os.utime("{}/same".format(wdir), (1, 1))
+        with open("{}/modified".format(wdir), 'w') as fileh:
+            fileh.write('local')
+
+        ktree = KernelTree('file://' + upstream, wdir=wdir)
+        ktree.checkout()
+
+        self.assertEqual(2, ktree.changed_files)
+        self.assertEqual(1, os.stat("{}/same".format(wdir)).st_mtime)
+        for (name, content) in [('changed', 'new'),
+                                ('modified', 'modified')]:
+            with open("{}/{}".format(wdir, name)) as fileh:
+                self.assertEqual(content, fileh.read())
+
+    def test_checkout_check_fresh(self):
+        """Ensure only references missing locally are fetched."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        wdir = "{}/wdir".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'file', 'old')
+        subprocess.check_call(['git', '-C', upstream, 'branch', 'old'])
+        commit_file(upstream, 'file', 'new')
+        ktree = KernelTree('file://' + upstream, wdir=wdir, check_fresh=True)
+        ktree.checkout()
+        self.assertEqual({'fetch-needed': 1},
+                         ktree.gitstats.get_counters())
+        subprocess.check_call(['git', '-C', upstream, 'checkout', '-q', '-b',
+                               'next'])
+        commit_file(upstream, 'next', 'next')
+
+        ktree = KernelTree('file://' + upstream, wdir=wdir, check_fresh=True)
+        ktree.checkout()
+        ktree.fetch_git_refs([['file://' + upstream, 'old'],
+                              ['file://' + upstream, 'next']])
+
+        self.assertEqual({'fetch-needed': 1, 'fetch-skipped': 2},
+                         ktree.gitstats.get_counters())
+        summary = ktree.gitstats.get_summary()
+        self.assertEqual(1, summary['fetch']['count'])
+        # A single query per remote and pre-step
+        self.assertEqual(2, summary['ls-remote']['count'])
+        self.assertEqual(
+            subprocess.check_output(['git', '-C', upstream, 'rev-parse',
+                                     'old']),
+            subprocess.check_output(['git', '--git-dir', ktree.gdir,
+                                     'rev-parse', 'refs/remotes/upstream/old'])
+        )
+        self.assertEqual((0, ktree.remote_heads[('file://' + upstream,
+                                                 'next')]),
+                         ktree.merge_git_ref('file://' + upstream, 'next'))
+
+    def test_find_merged_patches(self):
+        """Ensure find_merged_patches() finds patches merged upstream."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'file', 'base')
+        commit_file(upstream, 'file', 'merged')
+        patch = subprocess.check_output(
+            ['git', '-C', upstream, 'format-patch', '--stdout', '-1']
+        )
+        merged = "{}/merged.patch".format(self.tmpdir)
+        with open(merged, 'w') as fileh:
+            fileh.write(patch)
+        commit = subprocess.check_output(
+            ['git', '-C', upstream, 'rev-parse', 'HEAD']
+        ).strip()
+
+        ktree = KernelTree('file://' + upstream,
+                           wdir="{}/wdir".format(self.tmpdir),
+                           patch_index=True)
+        ktree.checkout()
+
+        self.assertEqual([commit],
+                         ktree.find_merged_patches([('merged', merged)]))
+        self.assertIsNone(ktree.find_merged_patches(
+            [('merged', merged),
+             ('new', StringIO.StringIO(patch.replace('+merged', '+new')))]
+        ))
+
+        # Force-push the base, dropping the merged commit
+        subprocess.check_call(['git', '-C', upstream, 'reset', '-q', '--hard',
+                               'HEAD~1'])
+        commit_file(upstream, 'other', 'rewritten')
+        ktree.checkout()
+
+        self.assertIsNone(ktree.find_merged_patches([('merged', merged)]))
+
+    def test_get_changed_paths(self):
+        """Ensure get_changed_paths() lists paths changed since a commit."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'old', 'content')
+        ktree = KernelTree('file://' + upstream,
+                           wdir="{}/wdir".format(self.tmpdir))
+        base = ktree.checkout()
+        subprocess.check_call(['git', '-C', ktree.wdir, 'mv', 'old', 'new'])
+        os.mkdir("{}/dir".format(ktree.wdir))
+        commit_file(ktree.wdir, 'dir/file', 'content')
+
+        self.assertEqual(['dir/file', 'new', 'old'],
+                         ktree.get_changed_paths(base))
+
+    def test_precheck(self):
+        """Ensure precheck() finds the first merge or patch not applying."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'file', 'base\n')
+        subprocess.check_call(['git', '-C', upstream, 'branch', 'conflict'])
+        commit_file(upstream, 'file', 'master\n')
+        subprocess.check_call(['git', '-C', upstream, 'checkout', '-q', '-b',
+                               'topic'])
+        commit_file(upstream, 'topic', 'topic\n')
+        subprocess.check_call(['git', '-C', upstream, 'checkout', '-q',
+                               'conflict'])
+        commit_file(upstream, 'file', 'conflict\n')
+
+        patch = ("diff --git a/topic b/topic\n"
+                 "--- a/topic\n"
+                 "+++ b/topic\n"
+                 "@@ -1 +1 @@\n"
+                 "-%s\n"
+                 "+%s\n")
+        patches = []
+        for (idx, (old, new)) in enumerate([('topic', 'one'),
+                                            ('one', 'two')]):
+            path = "{}/{}.patch".format(self.tmpdir, idx)
+            with open(path, 'w') as fileh:
+                fileh.write(patch % (old, new))
+            patches.append((path, path))
+        with open(patches[1][1]) as fileh:
+            patches[1] = ('mbox', fileh)
+
+            ktree = KernelTree('file://' + upstream,
+                               wdir="{}/wdir".format(self.tmpdir))
+            ktree.checkout()
+            topic = [['file://' + upstream, 'topic']]
+            conflict = [['file://' + upstream, 'conflict']]
+            ktree.fetch_git_refs(topic + conflict)
+
+            self.assertIsNone(ktree.precheck(topic, patches))
+            self.assertEqual(0, fileh.tell())
+            # Patches only apply after merging
+            self.assertEqual(patches[0][0], ktree.precheck([], patches))
+            self.assertEqual('file://%s conflict' % upstream,
+                             ktree.precheck(topic + conflict, patches))
+
+        with open(ktree.mergelog) as fileh:
+            self.assertIn('CONFLICT', fileh.read())
+        # Neither the working directory nor the index were touched
+        self.assertEqual(
+            '', subprocess.check_output(['git', '-C', ktree.wdir, 'status',
+                                         '--porcelain', '-uno'])
+        )
+
+    def test_precheck_error(self):
+        """Ensure precheck() raises on failures other than conflicts."""
+        self.kerneltree.fetched_refs[('uri', 'master')] = [
+            ('origin-uri', 'refs/remotes/origin-uri/master')
+        ]
+        mock_check_cmd = mock.patch(
+            'skt.kerneltree.KernelTree.check_cmd',
+            return_value=(129, "error: unknown option `write-tree'")
+        )
+
+        with mock_check_cmd:
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.kerneltree.precheck([['uri']])
+
+    def test_merge_cache(self):
+        """Ensure merge results can be cached and restored."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'file', 'base\n')
+        subprocess.check_call(['git', '-C', upstream, 'checkout', '-q', '-b',
+                               'topic'])
+        commit_file(upstream, 'topic', 'topic\n')
+        subprocess.check_call(['git', '-C', upstream, 'checkout', '-q',
+                               'master'])
+        patch = "{}/0.patch".format(self.tmpdir)
+        with open(patch, 'w') as fileh:
+            fileh.write('patch')
+
+        ktree = KernelTree('file://' + upstream,
+                           wdir="{}/wdir".format(self.tmpdir))
+        ktree.checkout()
+        topic = [['file://' + upstream, 'topic']]
+        key = ktree.get_merge_cache_key(topic, [('p', patch)])
+        with open(patch) as fileh:
+            self.assertEqual(key, ktree.get_merge_cache_key(
+                topic, [('p', fileh)]
+            ))
+            self.assertEqual(0, fileh.tell())
+        self.assertNotEqual(key, ktree.get_merge_cache_key(topic, []))
+        self.assertIsNone(ktree.get_merge_cache_key(
+            [['file://' + upstream, 'missing']], []
+        ))
+        self.assertIsNone(ktree.load_merge_cache(key))
+
+        ktree.get_merge_cache_key(topic, [('p', patch)])
+        ktree.merge_git_ref(*topic[0])
+        merged = ktree.get_commit_hash()
+        info = list(ktree.info)
+        start = int(time.time())
+        ktree.save_merge_cache(key, {'utypes': ['[git]']})
+        # The creation time is stored for maintenance to age the entry by
+        entry = json.loads(subprocess.check_output(
+            ['git', '--git-dir', ktree.gdir, 'cat-file', 'blob',
+             'refs/skt/merge-cache-info/%s' % key]
+        ))
+        self.assertGreaterEqual(entry['created'], start)
+
+        ktree.checkout()
+        self.assertNotEqual(merged, ktree.get_commit_hash())
+        self.assertEqual({'utypes': ['[git]']}, ktree.load_merge_cache(key))
+        self.assertEqual(merged, ktree.get_commit_hash())
+        self.assertEqual(info, ktree.info)
+
+    def test_get_remote_head_hash(self):
+        """Ensure get_remote_head() passes commit hashes through."""
+        self.assertEqual('0123456789abcdef0123456789abcdef01234567',
+                         KernelTree.get_remote_head(
+                             'git://example.com/linux.git',
+                             '0123456789abcdef0123456789abcdef01234567'
+                         ))
+
+    def test_worktree(self):
+        """Ensure a worktree of a shared repository can be provisioned."""
+        repo = "{}/shared.git".format(self.tmpdir)
+        uri = 'git://example.com/linux.git'
+        ktrees = [KernelTree(uri, wdir="{}/wt{}".format(self.tmpdir, idx),
+                             worktree_repo=repo)
+                  for idx in range(2)]
+
+        for ktree in ktrees:
+            self.assertTrue(os.path.isfile(ktree.gdir))
+            self.assertTrue(ktree.remote.startswith('origin-'))
+        self.assertEqual(ktrees[0].remote, ktrees[1].remote)
+        self.assertEqual(
+            uri,
+            subprocess.check_output(['git', '--git-dir', repo, 'config',
+                                     'remote.%s.url' % ktrees[0].remote])
+            .strip()
+        )
+
+        ktrees[1].cleanup()
+        worktrees = subprocess.check_output(['git', '--git-dir', repo,
+                                             'worktree', 'list'])
+        self.assertIn(ktrees[0].wdir, worktrees)
+        self.assertNotIn(ktrees[1].wdir, worktrees)
+
+    def test_worktree_refs(self):
+        """Ensure worktrees of a shared repository fetch into own refs."""
+        upstream = "{}/upstream".format(self.tmpdir)
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        commit_file(upstream, 'file', 'master')
+        subprocess.check_call(['git', '-C', upstream, 'checkout', '-q', '-b',
+                               'next'])
+        commit_file(upstream, 'file', 'next')
+        repo = "{}/shared.git".format(self.tmpdir)
+        ktrees = [KernelTree('file://' + upstream, ref=ref,
+                             wdir="{}/wt-{}".format(self.tmpdir, ref),
+                             worktree_repo=repo)
+                  for ref in ['master', 'next']]
+
+        heads = [ktree.checkout() for ktree in ktrees]
+        # Both fetched to the same name, without moving each other's
+        dstref = ktrees[0].get_tracking_ref(ktrees[0].remote, 'master')
+        self.assertTrue(dstref.startswith('refs/worktree/'))
+        self.assertNotEqual(heads[0], heads[1])
+        for (ktree, head) in zip(ktrees, heads):
+            self.assertEqual(head, ktree.get_commit_hash(
+                ktree.get_tracking_ref(ktree.remote, ktree.ref)
+            ))
+        self.assertEqual('', subprocess.check_output(
+            ['git', '--git-dir', repo, 'for-each-ref', 'refs/remotes/']
+        ))
+        self.assertTrue(os.path.exists("%s.lock" % repo))
 
     def test_dumpinfo(self):
         """Ensure dumpinfo() can dump data in a CSV format."""
-        self.kerneltree.info = [('test1', 'test2', 'test3')]
+        self.kerneltree.info = [('test1', 'test2', 'test3'),
+                                ('test4', 'test5, test6')]
         result = self.kerneltree.dumpinfo()
         expected_filename = "{}/buildinfo.csv".format(self.tmpdir)
 
@@ -106,7 +515,8 @@ class KernelTreeTest(unittest.TestCase):
             file_contents = fileh.read()
 
         # Ensure the csv file has the correct data.
-        self.assertEqual("test1,test2,test3\n", file_contents)
+        self.assertEqual("test1,test2,test3\ntest4,test5; test6\n",
+                         file_contents)
 
     def test_getpath(self):
         """Ensure that getpath() returns the workdir path."""
@@ -115,43 +525,92 @@ class KernelTreeTest(unittest.TestCase):
 
     def test_get_commit_date(self):
         """Ensure that get_commit_date() returns an integer date."""
-        # Mock up an integer response that would normally come from the
-        # 'git show' command
-        self.m_popen_good.communicate = Mock(return_value=('100', None))
-
-        with self.popen_good:
+        commit = ("tree 4b825dc642cb6eb9a060e54bf8d69288fbee4904\n"
+                  "author A U Thor <author@example.com> 50 +0000\n"
+                  "committer C O Mitter <committer@example.com> 100 +0200\n"
+                  "\n"
+                  "committer 200 +0000\n")
+        mock_query = mock.patch('skt.kerneltree.GitCatFile.query',
+                                return_value=('abcdef', 'commit', commit))
+
+        with self.popen_good, mock_query as m_query:
             result = self.kerneltree.get_commit_date(ref='master')
 
         self.assertEqual(result, 100)
+        m_query.assert_called_once_with('master^{commit}')
 
     def test_get_commit_hash(self):
         """Ensure get_commit_hash() returns a git commit hash."""
-        self.m_popen_good.communicate = Mock(return_value=('abcdef', None))
+        mock_query = mock.patch('skt.kerneltree.GitCatFile.query',
+                                return_value=('abcdef', 'commit', ''))
 
-        with self.popen_good:
-            result = self.kerneltree.get_commit_hash(ref='master')
+        with self.popen_good, mock_query as m_query:
+            result = self.kerneltree.get_commit_hash()
 
         self.assertEqual(result, 'abcdef')
+        m_query.assert_called_once_with('HEAD^{commit}')
+
+    def test_get_commit_hash_missing(self):
+        """Ensure get_commit_hash() fails on a missing commit."""
+        mock_query = mock.patch('skt.kerneltree.GitCatFile.query',
+                                return_value=None)
+
+        with self.popen_good, mock_query:
+            with self.assertRaises(Exception):
+                self.kerneltree.get_commit_hash(ref='master')
+
+    def test_catfile(self):
+        """Ensure a single cat-file process answers repeated queries."""
+        env = mock.patch.dict('os.environ', {
+            'GIT_AUTHOR_NAME': 'A', 'GIT_AUTHOR_EMAIL': 'a@a',
+            'GIT_COMMITTER_NAME': 'C', 'GIT_COMMITTER_EMAIL': 'c@c',
+            'GIT_COMMITTER_DATE': '1500000000 +0000'
+        })
+        ktree = self.kerneltree
+        hashes = []
+        for _ in range(2):
+            with env:
+                ktree.git_cmd("commit", "-q", "--allow-empty", "-m", "x")
+            hashes.append(ktree.get_commit_hash())
+            self.assertEqual(1500000000, ktree.get_commit_date())
+        catfile = ktree.catfile
+
+        self.assertNotEqual(hashes[0], hashes[1])
+        self.assertEqual(hashes[0], ktree.get_commit_hash('HEAD~1'))
+        self.assertIs(catfile, ktree.catfile)
+        self.assertIsNone(catfile.query('no-such-ref'))
+
+        ktree.cleanup()
+        self.assertIsNone(catfile.proc)
 
     def test_get_remote_url(self):
         """Ensure get_remote_url() returns a fetch url."""
-        expected_stdout = "Fetch URL: http://example.com/"
-        self.m_popen_good.communicate = Mock(
-            return_value=(expected_stdout, None)
+        result = self.kerneltree.get_remote_url('origin')
+
+        self.assertEqual(self.kerneltree.uri, result)
+        self.assertIsNone(self.kerneltree.get_remote_url('missing'))
+
+    def test_get_remotes(self):
+        """Ensure get_remotes() reads the configuration only once."""
+        self.kerneltree.git_cmd('remote', 'add', 'other',
+                                'http://example.com/other.git')
+        self.assertEqual(
+            {'origin': self.kerneltree.uri,
+             'other': 'http://example.com/other.git'},
+            self.kerneltree.get_remotes()
         )
 
-        with self.popen_good:
-            result = self.kerneltree.get_remote_url('origin')
-
-        self.assertEqual(result, 'http://example.com/')
+        with self.popen_good as m_popen:
+            self.kerneltree.get_remotes()
+        m_popen.assert_not_called()
 
     def test_getrname(self):
-        """Ensure getrname() handles remote names from get_remote_url()."""
+        """Ensure getrname() avoids remote names taken by other URIs."""
         # If get_remote_url keeps returning the same value, then getrname()
         # will keep adding underscores forever and this test would never pass.
         mocked_get_remote_url = mock.patch(
             'skt.kerneltree.KernelTree.get_remote_url',
-            side_effect=['http://example.com/', "http://example2.com"]
+            side_effect=['http://example2.com/', None]
         )
 
         with mocked_get_remote_url:
@@ -159,6 +618,18 @@ class KernelTreeTest(unittest.TestCase):
 
         self.assertEqual('example.com_', result)
 
+    def test_getrname_existing(self):
+        """Ensure getrname() reuses remotes with the same URI."""
+        mocked_get_remote_url = mock.patch(
+            'skt.kerneltree.KernelTree.get_remote_url',
+            return_value='http://example.com/'
+        )
+
+        with mocked_get_remote_url:
+            result = self.kerneltree.getrname("http://example.com/")
+
+        self.assertEqual('example.com', result)
+
     def test_merge_git_ref(self):
         """Ensure merge_git_ref() returns a proper tuple."""
         mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
@@ -172,6 +643,65 @@ class KernelTreeTest(unittest.TestCase):
 
         self.assertTupleEqual((0, 'abcdef'), result)
 
+    def test_fetch_git_refs(self):
+        """Ensure fetch_git_refs() fetches all refs for merge_git_ref()."""
+        mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
+        mock_fetch_ref = mock.patch('skt.kerneltree.KernelTree.fetch_ref')
+        mock_get_commit_hash = mock.patch(
+            'skt.kerneltree.KernelTree.get_commit_hash',
+            return_value="abcdef"
+        )
+        self.kerneltree.remotes = {'a': 'http://example.com/other/a.git'}
+
+        with mock_git_cmd as m_git_cmd, mock_fetch_ref as m_fetch_ref, \
+                mock_get_commit_hash:
+            self.kerneltree.fetch_git_refs(
+                [['http://example.com/a.git', 'next'],
+                 ['http://example.com/a.git']]
+            )
+            self.assertEqual(2, m_fetch_ref.call_count)
+            m_git_cmd.assert_called_once_with(
+                'remote', 'add', 'a_', 'http://example.com/a.git',
+                stderr=subprocess.PIPE
+            )
+            self.kerneltree.fetch_git_refs([['http://example.com/b.git']] * 2)
+            self.assertEqual(3, m_fetch_ref.call_count)
+            m_fetch_ref.assert_any_call('a_', 'http://example.com/a.git',
+                                        'next', 'refs/remotes/a_/next')
+            m_fetch_ref.assert_any_call('a_', 'http://example.com/a.git',
+                                        'master', 'refs/remotes/a_/master')
+
+            self.kerneltree.merge_git_ref('http://example.com/a.git', 'next')
+            self.kerneltree.merge_git_ref('http://example.com/a.git')
+            self.assertEqual(3, m_fetch_ref.call_count)
+
+        m_git_cmd.assert_any_call('merge', '--no-edit',
+                                  'refs/remotes/a_/next',
+                                  stdout=subprocess.PIPE)
+        m_git_cmd.assert_any_call('merge', '--no-edit',
+                                  'refs/remotes/a_/master',
+                                  stdout=subprocess.PIPE)
+
+    def test_fetch_git_refs_failure(self):
+        """Ensure fetch_git_refs() fails if any fetch fails."""
+        mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
+        mock_fetch_ref = mock.patch('skt.kerneltree.KernelTree.fetch_ref',
+                                    side_effect=[
+                                        None,
+                                        subprocess.CalledProcessError(1, 'git')
+                                    ])
+        mock_get_remote_url = mock.patch(
+            'skt.kerneltree.KernelTree.get_remote_url',
+            return_value=None
+        )
+
+        with mock_git_cmd, mock_fetch_ref, mock_get_remote_url:
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.kerneltree.fetch_git_refs(
+                    [['http://example.com/a.git'],
+                     ['http://example.com/b.git']]
+                )
+
     def test_merge_git_ref_failure(self):
         """Ensure merge_git_ref() fails properly when remote add fails."""
         mock_git_cmd = mock.patch(
@@ -189,10 +719,10 @@ class KernelTreeTest(unittest.TestCase):
 
     def test_merge_pw_patch(self):
         """Ensure merge_patchwork_patch() handles patches properly."""
-        mock_gpm = mock.patch('skt.get_patch_mbox')
+        mock_gpm = mock.patch('skt.download_patch_mbox')
         mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
         mock_gpn = mock.patch(
-            'skt.get_patch_name',
+            'skt.read_patch_name',
             return_value="patch_name"
         )
 
@@ -208,9 +738,59 @@ class KernelTreeTest(unittest.TestCase):
             self.kerneltree.info[0]
         )
 
+    def test_merge_pw_patch_prefetched(self):
+        """Ensure merge_patchwork_patch() uses prefetched patch content."""
+        mock_gpm = mock.patch('skt.download_patch_mbox')
+        mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
+        mbox = StringIO.StringIO('Subject: prefetched\n\ndiff\n')
+        mbox.read()
+
+        self.m_popen_good.communicate = Mock(return_value=('stdout', None))
+        self.m_popen_good.wait = Mock(return_value=0)
+
+        with mock_git_cmd, mock_gpm as m_gpm, self.popen_good as m_popen:
+            self.kerneltree.merge_patchwork_patch('uri', mbox)
+
+        m_gpm.assert_not_called()
+        self.assertIs(mbox, m_popen.call_args[1]['stdin'])
+        self.assertTupleEqual(
+            ('patchwork', 'uri', 'prefetched'),
+            self.kerneltree.info[0]
+        )
+
+    def test_merge_pw_series(self):
+        """Ensure merge_patchwork_series() applies a series at once."""
+        series = ('From 1 Mon Sep 17 00:00:00 2001\n'
+                  'Subject: [PATCH 1/2] first, patch\n'
+                  'X-Patchwork-Id: 101\n\n'
+                  'diff\n\n'
+                  'From 2 Mon Sep 17 00:00:00 2001\n'
+                  'Subject: [PATCH 2/2] second\n\n'
+                  'diff\n')
+        mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
+
+        self.m_popen_good.communicate = Mock(return_value=('stdout', None))
+        self.m_popen_good.wait = Mock(return_value=0)
+
+        with mock_git_cmd, self.popen_good as m_popen:
+            result = self.kerneltree.merge_patchwork_series(
+                'https://pw.example.com/series/7/', StringIO.StringIO(series)
+            )
+
+        m_popen.assert_called_once()
+        self.assertListEqual(['https://pw.example.com/patch/101/',
+                              'https://pw.example.com/series/7/'], result)
+        self.assertListEqual(
+            [('patchwork', 'https://pw.example.com/patch/101/',
+              '[PATCH 1/2] first, patch'),
+             ('patchwork', 'https://pw.example.com/series/7/',
+              '[PATCH 2/2] second')],
+            self.kerneltree.info
+        )
+
     def test_merge_pw_patch_failure(self):
         """Ensure merge_patchwork_patch() handles patch failures properly."""
-        mock_get_patch_mbox = mock.patch('skt.get_patch_mbox')
+        mock_get_patch_mbox = mock.patch('skt.download_patch_mbox')
         mock_git_cmd = mock.patch('skt.kerneltree.KernelTree.git_cmd')
 
         self.m_popen_bad.communicate = Mock(return_value=('stdout', None))
@@ -257,3 +837,19 @@ class KernelTreeTest(unittest.TestCase):
         """Ensure merge_patch_file() fails when a patch is missing."""
         with self.assertRaises(Exception):
             self.kerneltree.merge_patch_file('patch_does_not_exist')
+
+    def test_get_kerneltree(self):
+        """Ensure the git CLI backend is used when pygit2 is missing."""
+        missing = mock.patch.dict('sys.modules', {'pygit2': None,
+                                                  'skt.pygit2tree': None})
+        with missing:
+            ktree = get_kerneltree('pygit2', 'git://example.com/linux.git',
+                                   wdir=self.tmpdir)
+        self.assertIs(KernelTree, type(ktree))
+        self.assertIs(KernelTree, type(get_kerneltree(
+            'cli', 'git://example.com/linux.git', wdir=self.tmpdir
+        )))
+
+        with self.assertRaises(Exception):
+            get_kerneltree('svn', 'git://example.com/linux.git',
+                           wdir=self.tmpdir)
@@ -0,0 +1,175 @@
+"""
+Test cases for maintenance module.
+"""
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General Public
+# License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from skt import maintenance
+
+
+class RepoMaintenanceTest(unittest.TestCase):
+    """Test cases for RepoMaintenance class."""
+
+    def setUp(self):
+        """Create a repository with a commit and a few remotes."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmpdir, 'repo')
+        subprocess.check_call(['git', 'init', '-q', self.repo])
+        with open(os.path.join(self.repo, 'a'), 'w') as fileh:
+            fileh.write('a\n')
+        self.git('add', 'a')
+        self.git('-c', 'user.name=a', '-c', 'user.email=a@a', 'commit', '-q',
+                 '-m', 'a')
+        for remote in ['origin', 'old', 'new']:
+            self.git('remote', 'add', remote, 'git://example.com/%s.git' %
+                     remote)
+            self.git('update-ref', 'refs/remotes/%s/master' % remote, 'HEAD')
+        # Left behind by a remote removed without its references
+        self.git('update-ref', 'refs/remotes/gone/master', 'HEAD')
+        self.git('update-ref', 'refs/worktree/remotes/gone/master', 'HEAD')
+        self.git('update-ref', 'refs/worktree/remotes/origin/master', 'HEAD')
+        self.maintenance = maintenance.RepoMaintenance(
+            os.path.join(self.repo, '.git'), max_age=100
+        )
+
+    def tearDown(self):
+        """Teardown steps when testing is complete."""
+        shutil.rmtree(self.tmpdir)
+
+    def git(self, *args):
+        """Execute a git command in the repository, returning its output."""
+        return subprocess.check_output(['git', '-C', self.repo] + list(args))
+
+    def test_record_run(self):
+        """Ensure runs, remote uses and timings are recorded."""
+        self.assertFalse(self.maintenance.is_due(1))
+
+        self.maintenance.record_run(['origin'], {
+            'fetch': {'count': 2, 'seconds': 1.5},
+            'am': {'count': 1, 'seconds': 0.5}
+        })
+        self.maintenance.record_run(['origin', 'new'], {
+            'fetch': {'count': 1, 'seconds': 0.5}
+        })
+
+        data = self.maintenance.load()
+        self.assertTrue(self.maintenance.is_due(2))
+        self.assertFalse(self.maintenance.is_due(3))
+        self.assertEqual(['new', 'origin'], sorted(data['remotes']))
+        self.assertEqual({'fetch': {'count': 3, 'seconds': 2.0}},
+                         data['after'])
+
+    def test_run(self):
+        """Ensure unused remotes and stale references are removed."""
+        self.maintenance.record_run(['origin'], {
+            'fetch': {'count': 1, 'seconds': 1.0}
+        })
+        data = self.maintenance.load()
+        data['remotes']['old'] = int(time.time()) - 1000
+        self.maintenance.save(data)
+
+        self.maintenance.run()
+
+        self.assertEqual(['new', 'origin'], self.git('remote').split())
+        self.assertEqual(
+            ['refs/heads/master', 'refs/remotes/new/master',
+             'refs/remotes/origin/master'],
+            self.git('for-each-ref', '--format=%(refname)', 'refs/heads/',
+                     'refs/remotes/').split()
+        )
+        self.assertEqual(
+            ['refs/worktree/remotes/origin/master'],
+            self.git('for-each-ref', '--format=%(refname)',
+                     'refs/worktree/').split()
+        )
+        self.assertTrue(os.path.exists(os.path.join(
+            self.repo, '.git', 'objects', 'pack', 'multi-pack-index'
+        )))
+        data = self.maintenance.load()
+        self.assertEqual(0, data['runs'])
+        self.assertEqual(['new', 'origin'], sorted(data['remotes']))
+        self.assertEqual({'fetch': {'count': 1, 'seconds': 1.0}},
+                         data['before'])
+        self.assertEqual({}, data['after'])
+
+    def test_prune_worktree_remotes(self):
+        """Ensure stale references private to worktrees are removed."""
+        worktree = os.path.join(self.tmpdir, 'worktree')
+        self.git('worktree', 'add', '-q', '--detach', worktree)
+        for remote in ['gone', 'origin']:
+            subprocess.check_call(['git', '-C', worktree, 'update-ref',
+                                   'refs/worktree/remotes/%s/master' % remote,
+                                   'HEAD'])
+
+        self.maintenance.prune_remotes({})
+
+        self.assertEqual(
+            ['refs/worktree/remotes/origin/master'],
+            subprocess.check_output(['git', '-C', worktree, 'for-each-ref',
+                                     '--format=%(refname)',
+                                     'refs/worktree/']).split()
+        )
+
+    def add_merge_cache_entry(self, key, commit, entry):
+        """Store a merge cache entry of a commit, as KernelTree does."""
+        proc = subprocess.Popen(['git', '-C', self.repo, 'hash-object', '-w',
+                                 '--stdin'],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        (blob, _) = proc.communicate(json.dumps(entry))
+        self.git('update-ref', 'refs/skt/merge-cache-info/%s' % key,
+                 blob.strip())
+        self.git('update-ref', 'refs/skt/merge-cache/%s' % key, commit)
+
+    def test_prune_merge_cache(self):
+        """Ensure merge cache entries are aged by their creation time."""
+        # A base commit older than the maximum age
+        subprocess.check_call(
+            ['git', '-C', self.repo, '-c', 'user.name=a', '-c',
+             'user.email=a@a', 'commit', '-q', '--allow-empty', '-m', 'old'],
+            env=dict(os.environ, GIT_COMMITTER_DATE='@1000000000')
+        )
+        now = int(time.time())
+        entry = {'info': [], 'data': {}}
+        self.add_merge_cache_entry('new', 'HEAD',
+                                   dict(entry, created=now))
+        self.add_merge_cache_entry('old', 'HEAD',
+                                   dict(entry, created=now - 1000))
+        # Stored without the creation time
+        self.add_merge_cache_entry('legacy', 'HEAD', entry)
+
+        self.maintenance.prune_merge_cache()
+
+        self.assertEqual(
+            ['refs/skt/merge-cache-info/new', 'refs/skt/merge-cache/new'],
+            self.git('for-each-ref', '--format=%(refname)',
+                     'refs/skt/').split()
+        )
+
+    def test_get_incremental_batch_size(self):
+        """Ensure the largest pack is left out of incremental repacks."""
+        packdir = os.path.join(self.tmpdir, 'pack')
+        os.mkdir(packdir)
+        self.assertIsNone(maintenance.get_incremental_batch_size(packdir))
+
+        for (name, size) in [('a', 1000), ('b', 10), ('c', 20)]:
+            with open(os.path.join(packdir, '%s.pack' % name), 'w') as fileh:
+                fileh.write('x' * size)
+        self.assertEqual(21, maintenance.get_incremental_batch_size(packdir))
@@ -0,0 +1,73 @@
+"""
+Test cases for manifest module.
+"""
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General Public
+# License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from skt import manifest
+
+
+class ManifestTest(unittest.TestCase):
+    """Test cases for manifest module."""
+
+    def setUp(self):
+        """Fixtures for testing manifests."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'manifest.json.gz')
+
+    def tearDown(self):
+        """Teardown steps when testing is complete."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_update_read(self):
+        """Ensure manifests can be written, updated and read back."""
+        buildinfo = [['base', 'git://example.com/linux.git', 'abcdef'],
+                     ['patchwork', 'https://pw.example.com/patch/1/',
+                      '[PATCH] subject, with a comma']]
+        manifest.write(self.path, {'buildinfo': buildinfo})
+        manifest.update(self.path, krelease='4.17.0', config='CONFIG_X=y\n')
+
+        self.assertEqual(
+            {'version': manifest.VERSION,
+             'buildinfo': buildinfo,
+             'krelease': '4.17.0',
+             'config': 'CONFIG_X=y\n'},
+            manifest.read(self.path)
+        )
+        self.assertEqual([self.path],
+                         [os.path.join(self.tmpdir, name)
+                          for name in os.listdir(self.tmpdir)])
+
+    def test_loads_version(self):
+        """Ensure manifests of unknown versions are rejected."""
+        with gzip.open(self.path, 'wb') as fileh:
+            fileh.write(json.dumps({'version': manifest.VERSION + 1}))
+
+        with self.assertRaises(Exception):
+            manifest.read(self.path)
+
+    def test_checksum(self):
+        """Ensure checksum() returns the SHA256 of a file."""
+        with open(self.path, 'wb') as fileh:
+            fileh.write('data')
+
+        self.assertEqual(hashlib.sha256('data').hexdigest(),
+                         manifest.checksum(self.path))
@@ -0,0 +1,153 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Test cases for mboxcache module."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from skt.mboxcache import MboxCache
+
+
+def make_response(status_code, content='', headers=None):
+    """Create a mocked streamed requests response."""
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers if headers is not None else {}
+    response.iter_content = mock.Mock(return_value=iter([content]))
+    return response
+
+
+class TestMboxCache(unittest.TestCase):
+    # (Access to a protected member) pylint: disable=protected-access
+    """Test cases for MboxCache class"""
+
+    def setUp(self):
+        """Create a cache in a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = MboxCache(self.tmpdir)
+
+    def tearDown(self):
+        """Remove the temporary cache directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_miss(self):
+        """Ensure a URL not in the cache is downloaded and stored."""
+        response = make_response(200, 'mbox content', {'ETag': '"abc"'})
+        with mock.patch('skt.httpsession.get', return_value=response) as m_get:
+            result = self.cache.get('http://example.com/patch/1/mbox')
+
+        self.assertEqual('mbox content', result)
+        self.assertEqual({}, m_get.call_args[1]['headers'])
+        self.assertEqual({'hits': 0, 'misses': 1}, self.cache.get_stats())
+
+    def test_revalidated_hit(self):
+        """Ensure a cached URL is revalidated and served from the cache."""
+        url = 'http://example.com/patch/1/mbox'
+        response = make_response(200, 'mbox content',
+                                 {'ETag': '"abc"',
+                                  'Last-Modified': 'Thu, 03 May 2018'})
+        with mock.patch('skt.httpsession.get', return_value=response):
+            self.cache.get(url)
+
+        with mock.patch('skt.httpsession.get',
+                        return_value=make_response(304)) as m_get:
+            result = self.cache.get(url)
+
+        self.assertEqual('mbox content', result)
+        self.assertEqual({'If-None-Match': '"abc"',
+                          'If-Modified-Since': 'Thu, 03 May 2018'},
+                         m_get.call_args[1]['headers'])
+        self.assertEqual({'hits': 1, 'misses': 1}, self.cache.get_stats())
+
+    def test_changed(self):
+        """Ensure a changed body replaces the cached one."""
+        url = 'http://example.com/patch/1/mbox'
+        with mock.patch('skt.httpsession.get',
+                        return_value=make_response(200, 'old')):
+            self.cache.get(url)
+        with mock.patch('skt.httpsession.get',
+                        return_value=make_response(200, 'new')):
+            result = self.cache.get(url)
+
+        self.assertEqual('new', result)
+        self.assertEqual(1, len(os.listdir(self.cache.objdir)))
+
+    def test_failure(self):
+        """Ensure an unexpected status raises an exception."""
+        with mock.patch('skt.httpsession.get',
+                        return_value=make_response(404)):
+            with self.assertRaises(Exception):
+                self.cache.get('http://example.com/patch/1/mbox')
+
+    def test_evict(self):
+        """Ensure least recently used entries are evicted past the limit."""
+        self.cache.max_size = 10
+        for (idx, content) in enumerate(['aaaaaa', 'bbbbbb']):
+            url = 'http://example.com/patch/%d/mbox' % idx
+            with mock.patch('skt.httpsession.get',
+                            return_value=make_response(200, content)):
+                self.cache.get(url)
+            # Make sure access times differ
+            idxpath = self.cache._idxpath(url)
+            os.utime(idxpath, (idx, idx))
+        self.cache.evict()
+
+        self.assertEqual(1, len(os.listdir(self.cache.idxdir)))
+        self.assertIsNone(
+            self.cache._read_entry('http://example.com/patch/0/mbox')
+        )
+        self.assertIsNotNone(
+            self.cache._read_entry('http://example.com/patch/1/mbox')
+        )
+        self.assertEqual(1, len(os.listdir(self.cache.objdir)))
+
+    def test_fetch_evicted(self):
+        """Ensure fetched bodies stay readable when evicted."""
+        url = 'http://example.com/patch/1/mbox'
+        with mock.patch('skt.httpsession.get',
+                        return_value=make_response(200, 'mbox content')):
+            fileh = self.cache.fetch(url)
+
+        self.cache.max_size = 0
+        os.unlink(self.cache._idxpath(url))
+        self.cache.evict()
+        with fileh:
+            self.assertEqual('mbox content', fileh.read())
+        self.assertEqual([], os.listdir(self.cache.objdir))
+
+    def test_revalidated_evicted(self):
+        """Ensure a body evicted during revalidation is downloaded again."""
+        url = 'http://example.com/patch/1/mbox'
+        with mock.patch('skt.httpsession.get',
+                        return_value=make_response(200, 'old',
+                                                   {'ETag': '"abc"'})):
+            self.cache.get(url)
+
+        def evicting_get(*_, **kwargs):
+            """Evict the body as if by another process, and respond."""
+            if kwargs['headers']:
+                for name in os.listdir(self.cache.objdir):
+                    os.unlink(os.path.join(self.cache.objdir, name))
+                return make_response(304)
+            return make_response(200, 'new')
+
+        with mock.patch('skt.httpsession.get',
+                        side_effect=evicting_get) as m_get:
+            result = self.cache.get(url)
+
+        self.assertEqual('new', result)
+        self.assertEqual(2, m_get.call_count)
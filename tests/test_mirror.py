@@ -0,0 +1,107 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Test cases for GitMirror class."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from skt.mirror import GitMirror
+
+
+class GitMirrorTest(unittest.TestCase):
+    """Test cases for GitMirror class."""
+
+    def setUp(self):
+        """Fixtures for testing GitMirror."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.mirror = GitMirror(
+            self.tmpdir,
+            'git://git.kernel.org/pub/scm/linux/kernel/git/stable/'
+            'linux-stable.git'
+        )
+
+    def tearDown(self):
+        """Teardown steps when testing is complete."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_path(self):
+        """Ensure mirrors are named after the repository and unique."""
+        other = GitMirror(self.tmpdir,
+                          'git://example.com/linux-stable.git')
+
+        self.assertTrue(
+            os.path.basename(self.mirror.path).startswith('linux-stable-')
+        )
+        self.assertNotEqual(self.mirror.path, other.path)
+        self.assertEqual(os.path.join(self.mirror.path, 'objects'),
+                         self.mirror.objdir)
+
+    def test_update(self):
+        """Ensure update() creates the mirror and fetches the reference."""
+        with mock.patch('skt.mirror.GitMirror.git_cmd') as m_git_cmd:
+            result = self.mirror.update('master', depth='5')
+
+        self.assertEqual('refs/mirror/master', result)
+        m_git_cmd.assert_any_call('init', '-q', '--bare')
+        m_git_cmd.assert_called_with(
+            'fetch', '-n', 'origin', '+master:refs/mirror/master',
+            '--depth', '5'
+        )
+        self.assertTrue(os.path.isfile(self.mirror.lockpath))
+
+    def test_update_filter(self):
+        """Ensure update() passes the object filter to the fetch."""
+        with mock.patch('skt.mirror.GitMirror.git_cmd') as m_git_cmd:
+            self.mirror.update('master', fetch_filter='blob:none')
+
+        m_git_cmd.assert_called_with(
+            'fetch', '-n', 'origin', '+master:refs/mirror/master',
+            '--filter=blob:none'
+        )
+
+    def test_update_existing(self):
+        """Ensure update() doesn't recreate an existing mirror."""
+        os.makedirs(self.mirror.objdir)
+        with mock.patch('skt.mirror.GitMirror.git_cmd') as m_git_cmd:
+            self.mirror.update('v4.16')
+
+        m_git_cmd.assert_called_once_with(
+            'fetch', '-n', 'origin', '+v4.16:refs/mirror/v4.16'
+        )
+
+    def test_sync(self):
+        """Ensure sync() fetches all references at once."""
+        with mock.patch('skt.mirror.GitMirror.git_cmd') as m_git_cmd:
+            result = self.mirror.sync(['master', 'v4.16'])
+
+        self.assertEqual(['refs/mirror/master', 'refs/mirror/v4.16'], result)
+        m_git_cmd.assert_called_with(
+            'fetch', '-n', 'origin', '+master:refs/mirror/master',
+            '+v4.16:refs/mirror/v4.16'
+        )
+
+    def test_sync_shallow(self):
+        """Ensure sync() completes the history of a shallow mirror."""
+        os.makedirs(self.mirror.objdir)
+        open(os.path.join(self.mirror.path, 'shallow'), 'w').close()
+        with mock.patch('skt.mirror.GitMirror.git_cmd') as m_git_cmd:
+            self.mirror.sync(['master'])
+
+        m_git_cmd.assert_called_once_with(
+            'fetch', '-n', 'origin', '+master:refs/mirror/master',
+            '--unshallow'
+        )
@@ -0,0 +1,109 @@
+"""
+Test cases for patchindex module.
+"""
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General Public
+# License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+import os
+import shutil
+import StringIO
+import subprocess
+import tempfile
+import unittest
+
+from skt import patchindex
+
+
+class PatchIdIndexTest(unittest.TestCase):
+    """Test cases for patchindex module."""
+
+    def setUp(self):
+        """Create a repository with a few commits."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmpdir, 'repo')
+        subprocess.check_call(['git', 'init', '-q', self.repo])
+        self.commits = []
+        for name in ['a', 'b', 'c']:
+            self.commit(name)
+
+    def tearDown(self):
+        """Teardown steps when testing is complete."""
+        shutil.rmtree(self.tmpdir)
+
+    def commit(self, name):
+        """Commit a new file to the repository, remembering the commit."""
+        with open(os.path.join(self.repo, name), 'w') as fileh:
+            fileh.write(name + '\n')
+        subprocess.check_call(['git', '-C', self.repo, 'add', name])
+        subprocess.check_call(['git', '-C', self.repo, '-c', 'user.name=a',
+                               '-c', 'user.email=a@a', 'commit', '-q', '-m',
+                               name])
+        self.commits.append(subprocess.check_output(
+            ['git', '-C', self.repo, 'rev-parse', 'HEAD']
+        ).strip())
+
+    def format_patches(self, *args):
+        """Get the mbox of patches of a revision range."""
+        return subprocess.check_output(['git', '-C', self.repo,
+                                        'format-patch', '--stdout'] +
+                                       list(args))
+
+    def test_get_patch_ids(self):
+        """Ensure patch IDs are found for every patch of every mbox."""
+        series = self.format_patches('HEAD~2')
+        single = self.format_patches('-1', 'HEAD~2')
+
+        patch_ids = patchindex.get_patch_ids(
+            [StringIO.StringIO(content)
+             for content in [series, single, 'no patch']]
+        )
+
+        self.assertEqual([2, 1, 0], [len(ids) for ids in patch_ids])
+        self.assertNotIn(patch_ids[1][0], patch_ids[0])
+
+    def test_update_lookup(self):
+        """Ensure the index is updated incrementally and limited in size."""
+        index = patchindex.PatchIdIndex(
+            os.path.join(self.repo, '.git', 'skt', 'index.json'),
+            os.path.join(self.repo, '.git'),
+            size=3
+        )
+        index.update(self.commits[-1])
+        self.commit('d')
+        index.update(self.commits[-1])
+        # Known heads are not walked again
+        index.update(self.commits[-1])
+
+        (series_ids, ) = patchindex.get_patch_ids(
+            [StringIO.StringIO(self.format_patches('--root'))]
+        )
+        self.assertEqual(
+            dict(zip(series_ids[1:], self.commits[1:])),
+            index.lookup(series_ids)
+        )
+        self.assertEqual([self.commits[-1], self.commits[-2]],
+                         index.load()['tips'])
+
+    def test_update_partial(self):
+        """Ensure partial clones aren't indexed."""
+        index = patchindex.PatchIdIndex(
+            os.path.join(self.repo, '.git', 'skt', 'index.json'),
+            os.path.join(self.repo, '.git')
+        )
+        self.assertFalse(index.is_partial())
+        subprocess.check_call(['git', '-C', self.repo, 'config',
+                               'remote.origin.promisor', 'true'])
+        self.assertTrue(index.is_partial())
+
+        self.assertFalse(index.update(self.commits[-1]))
+        self.assertEqual({'tips': [], 'patches': []}, index.load())
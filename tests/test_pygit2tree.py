@@ -0,0 +1,117 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General Public
+# License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+"""Test cases for Pygit2KernelTree class."""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from tests.test_kerneltree import commit_file
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
+from skt.kerneltree import KernelTree
+if pygit2:
+    from skt.pygit2tree import Pygit2KernelTree
+
+
+@unittest.skipUnless(pygit2, "pygit2 is not installed")
+class Pygit2KernelTreeTest(unittest.TestCase):
+    """Test cases comparing Pygit2KernelTree with the git CLI backend."""
+
+    def setUp(self):
+        """Create a repository and a tree of each backend using a copy."""
+        self.tmpdir = tempfile.mkdtemp()
+        upstream = os.path.join(self.tmpdir, "upstream")
+        subprocess.check_call(['git', 'init', '-q', upstream])
+        for content in ['first', 'second', 'third']:
+            commit_file(upstream, 'file', content)
+        subprocess.check_call(['git', '-C', upstream, '-c', 'user.name=T',
+                               '-c', 'user.email=t@t', 'tag', '-a', '-m',
+                               'tag', 'v1', 'HEAD~1'])
+
+        self.trees = []
+        for (name, cls) in [('cli', KernelTree),
+                            ('pygit2', Pygit2KernelTree)]:
+            wdir = os.path.join(self.tmpdir, name)
+            shutil.copytree(upstream, wdir)
+            self.trees.append(cls('file://' + upstream, wdir=wdir))
+
+    def tearDown(self):
+        """Remove the repositories."""
+        for ktree in self.trees:
+            ktree.cleanup()
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def get_config_remotes(ktree):
+        """Get the remote URLs from the repository configuration."""
+        output = subprocess.check_output(
+            ['git', '--git-dir', ktree.gdir, 'config', '--get-regexp',
+             r'^remote\..*\.url$']
+        )
+        return sorted(output.splitlines())
+
+    def test_set_remote(self):
+        """Ensure set_remote() adds and updates remotes like git."""
+        for ktree in self.trees:
+            ktree.set_remote('origin', 'git://example.com/old.git')
+            ktree.set_remote('origin', 'git://example.com/new.git')
+            ktree.set_remote('other', 'git://example.com/other.git')
+
+        (cli, pygit2_tree) = [self.get_config_remotes(ktree)
+                              for ktree in self.trees]
+        self.assertEqual(['remote.origin.url git://example.com/new.git',
+                          'remote.other.url git://example.com/other.git'],
+                         cli)
+        self.assertEqual(cli, pygit2_tree)
+
+    def test_add_remote(self):
+        """Ensure add_remote() keeps existing remotes like git."""
+        for ktree in self.trees:
+            self.assertTrue(ktree.add_remote('topic',
+                                             'git://example.com/topic.git'))
+            self.assertFalse(ktree.add_remote('topic',
+                                              'git://example.com/other.git'))
+
+        (cli, pygit2_tree) = [self.get_config_remotes(ktree)
+                              for ktree in self.trees]
+        self.assertIn('remote.topic.url git://example.com/topic.git', cli)
+        self.assertEqual(cli, pygit2_tree)
+        self.assertEqual(*[ktree.get_remotes() for ktree in self.trees])
+
+    def test_get_commit(self):
+        """Ensure get_commit() finds the same commits as git."""
+        for ref in [None, 'HEAD', 'HEAD~2', 'master', 'v1']:
+            (cli, pygit2_tree) = [ktree.get_commit(ref)
+                                  for ktree in self.trees]
+            self.assertEqual(cli, pygit2_tree)
+        self.assertEqual(self.trees[0].get_commit('HEAD~1'),
+                         self.trees[1].get_commit('v1'))
+
+        for ktree in self.trees:
+            with self.assertRaises(Exception):
+                ktree.get_commit('nonexistent')
+
+    def test_get_commit_date(self):
+        """Ensure get_commit_date() returns the same dates as git."""
+        for ref in [None, 'HEAD~1', 'v1']:
+            (cli, pygit2_tree) = [ktree.get_commit_date(ref)
+                                  for ktree in self.trees]
+            self.assertEqual(cli, pygit2_tree)
+            self.assertIsInstance(pygit2_tree, int)
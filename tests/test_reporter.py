@@ -14,13 +14,17 @@ Test cases for reporter module.
 # You should have received a copy of the GNU General Public License along with
 # this program; if not, write to the Free Software Foundation, Inc., 51
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+import os
 import re
+import shutil
+import tempfile
 import unittest
 
 from contextlib import contextmanager
 
 import mock
 
+from skt import manifest
 from skt import reporter
 
 from tests import misc
@@ -31,9 +35,9 @@ class TestConsoleLog(unittest.TestCase):
     @staticmethod
     @contextmanager
     def request_get_mocked(filename):
-        """Mock request.get to allow feeding ConsoleLog with known inputs. When
-        request.get is called, it "fetches" the content of the asset passed as
-        parameter.
+        """Mock skt.httpsession.get to allow feeding ConsoleLog with known
+        inputs. When skt.httpsession.get is called, it "fetches" the content
+        of the asset passed as parameter.
 
         Args:
             filename: Asset's filename.
@@ -45,7 +49,8 @@ class TestConsoleLog(unittest.TestCase):
             return not re.match(r'^nt ', line)
         get_mocked.text = filter(remove_nt_marker,
                                  misc.get_asset_content(filename))
-        with mock.patch('requests.get', mock.Mock(return_value=get_mocked)):
+        with mock.patch('skt.httpsession.get',
+                        mock.Mock(return_value=get_mocked)):
             yield
 
     @staticmethod
@@ -99,3 +104,59 @@ class TestConsoleLog(unittest.TestCase):
             msg = ("Trace_{} doesn't match.\n"
                    "{!r} != {!r}").format(idx, trace, expected_traces[idx])
             self.assertEqual(trace, expected_traces[idx], msg=msg)
+
+
+class TestReporter(unittest.TestCase):
+    """Test cases for reporter.Reporter class"""
+
+    def test_update_mergedata_manifest(self):
+        """Check merge data and config are read from the build manifest with
+        a single request.
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'manifest.json.gz')
+            manifest.write(path, {
+                'buildinfo': [
+                    ['base', 'git://example.com/linux.git', 'abcdef'],
+                    ['patchwork', 'https://pw.example.com/patch/1/',
+                     '[PATCH] subject, with a comma']
+                ],
+                'config': 'CONFIG_X=y\n'
+            })
+            with open(path, 'rb') as fileh:
+                response = mock.Mock(status_code=200, content=fileh.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+        rptr = reporter.Reporter({'manifesturl': 'http://example.com/m',
+                                  'cfgurl': 'http://example.com/c'})
+        with mock.patch('skt.httpsession.get',
+                        mock.Mock(return_value=response)) as m_get:
+            rptr.update_mergedata()
+
+        m_get.assert_called_once_with('http://example.com/m')
+        self.assertEqual(('git://example.com/linux.git', 'abcdef'),
+                         rptr.mergedata['base'])
+        self.assertEqual([('https://pw.example.com/patch/1/',
+                           '[PATCH] subject, with a comma')],
+                         rptr.mergedata['patchwork'])
+        self.assertEqual('CONFIG_X=y\n', rptr.mergedata['config'])
+
+    def test_report_build_skipped(self):
+        """Check skipped builds are reported without a configuration."""
+        rptr = reporter.Reporter({
+            'baserepo': 'git://example.com/linux.git',
+            'basehead': 'abcdef',
+            'localpatches': ['/tmp/docs.patch'],
+            'buildskipped': 'only files not used by kernel builds are '
+                            'changed',
+            'retcode': '0'
+        })
+        rptr.update_mergedata()
+
+        self.assertIn('Build and tests not needed', rptr.getsubject())
+        self.assertIn('The kernel was not built or tested, as only files '
+                      'not used by kernel builds are changed.',
+                      rptr.getreport())
+        self.assertEqual([], rptr.attach)
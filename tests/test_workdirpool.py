@@ -0,0 +1,152 @@
+"""
+Test cases for workdirpool module.
+"""
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General Public
+# License v.2 or later.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import mock
+
+from skt.workdirpool import WorkdirPool
+
+
+class WorkdirPoolTest(unittest.TestCase):
+    """Test cases for WorkdirPool class."""
+
+    def setUp(self):
+        """Fixtures for testing WorkdirPool."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.pool = WorkdirPool(os.path.join(self.tmpdir, 'pool'), size=3)
+
+    def tearDown(self):
+        """Teardown steps when testing is complete."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_lease_release(self):
+        """Ensure working directories are leased once until released."""
+        paths = [self.pool.lease() for _ in range(3)]
+
+        self.assertEqual(3, len(set(paths)))
+        with self.assertRaises(Exception):
+            self.pool.lease()
+
+        self.pool.release(paths[1])
+        self.assertEqual(paths[1], self.pool.lease())
+
+    def test_lease_expired(self):
+        """Ensure expired leases are ignored."""
+        self.pool.lease_time = -1
+        path = self.pool.lease()
+
+        self.assertEqual(path, self.pool.lease())
+
+    def test_lease_closest(self):
+        """Ensure the working directory closest to the commit is leased."""
+        for slot in range(3):
+            os.makedirs(os.path.join(self.pool.get_slot_path(slot), '.git'))
+        distances = {self.pool.get_slot_path(0): None,
+                     self.pool.get_slot_path(1): 10,
+                     self.pool.get_slot_path(2): 2}
+        mock_distance = mock.patch(
+            'skt.workdirpool.WorkdirPool.get_distance',
+            side_effect=lambda path, commit, repo: distances[path]
+        )
+
+        with mock_distance:
+            self.assertEqual(self.pool.get_slot_path(2),
+                             self.pool.lease('abcdef'))
+            self.assertEqual(self.pool.get_slot_path(1),
+                             self.pool.lease('abcdef'))
+            self.assertEqual(self.pool.get_slot_path(0),
+                             self.pool.lease('abcdef'))
+
+    def test_get_distance(self):
+        """Ensure get_distance() counts files differing from a commit."""
+        path = self.pool.get_slot_path(0)
+        self.assertIsNone(self.pool.get_distance(path, 'HEAD'))
+
+        git = ['git', '-C', path, '-c', 'user.name=A', '-c', 'user.email=a@a']
+        os.makedirs(path)
+        subprocess.check_call(git + ['init', '-q'])
+        for name in ['a', 'b']:
+            with open(os.path.join(path, name), 'w') as fileh:
+                fileh.write(name)
+        subprocess.check_call(git + ['add', 'a', 'b'])
+        subprocess.check_call(git + ['commit', '-q', '-m', 'first'])
+        base = subprocess.check_output(git + ['rev-parse', 'HEAD']).strip()
+        for name in ['a', 'b']:
+            with open(os.path.join(path, name), 'w') as fileh:
+                fileh.write('changed')
+        subprocess.check_call(git + ['commit', '-q', '-a', '-m', 'second'])
+
+        self.assertEqual(0, self.pool.get_distance(path, 'HEAD'))
+        self.assertEqual(2, self.pool.get_distance(path, base))
+        self.assertIsNone(self.pool.get_distance(path, '0' * 40))
+
+    def test_lease_new_commit(self):
+        """Ensure distances to a commit no slot has are measured in a repo."""
+        repo = os.path.join(self.tmpdir, 'repo')
+        git = ['git', '-C', repo, '-c', 'user.name=A', '-c', 'user.email=a@a']
+        subprocess.check_call(['git', 'init', '-q', repo])
+        commits = []
+        for names in [['a', 'b', 'c'], ['a', 'b'], ['a']]:
+            for name in names:
+                with open(os.path.join(repo, name), 'w') as fileh:
+                    fileh.write(str(len(commits)))
+            subprocess.check_call(git + ['add', '.'])
+            subprocess.check_call(git + ['commit', '-q', '-m', 'commit'])
+            commits.append(
+                subprocess.check_output(git + ['rev-parse', 'HEAD']).strip()
+            )
+
+        # The slots checked out the first two commits and nothing else
+        for (slot, commit) in enumerate(commits[:2]):
+            path = self.pool.get_slot_path(slot)
+            subprocess.check_call(['git', 'clone', '-q', '-n', repo, path])
+            subprocess.check_call(['git', '-C', path, 'checkout', '-q',
+                                   commit])
+            subprocess.check_call(['git', '-C', path, 'update-ref', '-d',
+                                   'refs/remotes/origin/master'])
+            subprocess.check_call(['git', '-C', path, 'reflog', 'expire',
+                                   '--expire=now', '--all'])
+            subprocess.check_call(['git', '-C', path, 'branch', '-q', '-D',
+                                   'master'])
+            subprocess.check_call(['git', '-C', path, 'gc', '-q',
+                                   '--prune=now'])
+            self.pool.record_base(path, commit)
+
+        path = self.pool.get_slot_path(0)
+        self.assertIsNone(self.pool.get_distance(path, commits[2]))
+        self.assertEqual(2, self.pool.get_distance(path, commits[2],
+                                                   os.path.join(repo,
+                                                                '.git')))
+        self.assertEqual(self.pool.get_slot_path(1),
+                         self.pool.lease(commits[2],
+                                         os.path.join(repo, '.git')))
+
+    def test_lease_free(self):
+        """Ensure all free working directories with checkouts are leased."""
+        for slot in range(2):
+            os.makedirs(os.path.join(self.pool.get_slot_path(slot), '.git'))
+        path = self.pool.lease()
+
+        leased = self.pool.lease_free()
+
+        self.assertEqual([self.pool.get_slot_path(slot) for slot in range(2)
+                          if self.pool.get_slot_path(slot) != path], leased)
+        self.assertEqual(self.pool.get_slot_path(2), self.pool.lease())